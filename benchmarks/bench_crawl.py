@@ -0,0 +1,160 @@
+## bench_crawl
+"""
+End to end benchmark of the scrape_*_from_jgi scripts, offline, against a
+local mock IMG server (see mock_img_server).
+
+Each script is run as its own process, with --homepage pointed at the mock
+server and a fresh SAVE_DIR under a temporary dir, and is reported with:
+
+  taxa/s        taxa written to SAVE_DIR per second of the script's wall time
+  taxon p50/p99 seconds between the first and the last request of a taxon, as seen by the server
+  peak RSS      max resident memory of the script's process
+  requests      requests served (and errors injected) by the mock server
+
+Usage:
+  bench_crawl.py [SCRIPT...] [options]
+
+Arguments:
+  SCRIPT  'archaea', 'bacteria', 'eukarya' or 'metagenomes' (all four by default)
+
+Options:
+  --args=<a>    extra options passed to every script, e.g. "--workers=8" or "--engine=async" [default: ]
+  --taxa=<n>    taxa per domain and per ecosystem class [default: 50]
+  --enzymes=<n>    ecs per enzyme json [default: 300]
+  --page_kb=<pk>    size of a taxon page, in KB [default: 100]
+  --latency=<ms>    mean delay of every response, in ms [default: 20]
+  --jitter=<ms>    max random deviation from the mean delay, in ms [default: 10]
+  --error_rate=<er>    fraction of responses that fail with --error_status [default: 0]
+  --error_status=<es>    http status of an injected error [default: 503]
+  --record_dir=<rd>    replay the pages of this page cache (see mock_img_server)
+  --json=<jp>    also write the results to this json file
+  --keep    keep the temporary dir with the scripts' output and logs
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import tempfile
+import subprocess
+from docopt import docopt
+
+from mock_img_server import MockIMG, start_server
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPTS = ['archaea', 'bacteria', 'eukarya', 'metagenomes']
+
+def percentile(values, q):
+    """
+    :returns: the q quantile of values (nearest rank), or 0 if there are none
+    """
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+
+    return values[int(q*(len(values)-1))]
+
+def run_script(script, homepage_url, work_dir, args):
+    """
+    run one scrape script to completion
+
+    :param script: one of SCRIPTS
+    :param homepage_url: homepage of the mock server
+    :param work_dir: dir to put the script's SAVE_DIR and log in
+    :param args: list of extra options for the script
+    :returns: dict with 'returncode', 'seconds', 'taxa' (jsons written to SAVE_DIR), 'peak_rss_mb' and 'log'
+    """
+
+    save_dir = os.path.join(work_dir, script)
+    os.makedirs(save_dir)
+    log_path = os.path.join(work_dir, script+'.log')
+
+    command = [sys.executable, os.path.join(REPO_DIR, 'scrape_%s_from_jgi.py'%script), save_dir, '--homepage=%s'%homepage_url]+args
+
+    start = time.time()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT)
+        ## wait4 rather than wait, for the resource usage of this child alone
+        pid, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.time()-start
+
+    taxa = sum(1 for name in os.listdir(save_dir) if name.endswith('.json'))
+
+    return {
+        'returncode': process.returncode,
+        'seconds': seconds,
+        'taxa': taxa,
+        ## ru_maxrss is in KB on linux
+        'peak_rss_mb': rusage.ru_maxrss/1024.,
+        'log': log_path,
+    }
+
+def run_benchmark(scripts, img, homepage_url, work_dir, args):
+    """
+    :param scripts: list of SCRIPTS to run
+    :param img: the MockIMG being served at homepage_url
+    :returns: dict of script -> results (see run_script, plus the server's stats)
+    """
+
+    results = dict()
+
+    print("%-12s %6s %8s %8s %10s %10s %10s %9s %7s"%('script', 'taxa', 'seconds', 'taxa/s', 'p50 s', 'p99 s', 'peak MB', 'requests', 'errors'))
+
+    for script in scripts:
+
+        img.reset_stats()
+        result = run_script(script, homepage_url, work_dir, args)
+        stats = img.stats()
+
+        result['requests'] = stats['requests']
+        result['errors'] = stats['errors']
+        result['taxa_per_second'] = result['taxa']/result['seconds']
+        result['taxon_p50'] = percentile(stats['taxon_latencies'], 0.5)
+        result['taxon_p99'] = percentile(stats['taxon_latencies'], 0.99)
+        results[script] = result
+
+        print("%-12s %6d %8.1f %8.2f %10.3f %10.3f %10.1f %9d %7d"%(script, result['taxa'], result['seconds'], result['taxa_per_second'],
+            result['taxon_p50'], result['taxon_p99'], result['peak_rss_mb'], result['requests'], result['errors']))
+        if result['returncode'] != 0:
+            print("  %s exited with %d, see %s"%(script, result['returncode'], result['log']))
+
+    return results
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='bench_crawl 1.0')
+
+    scripts = arguments['SCRIPT'] or SCRIPTS
+    for script in scripts:
+        if script not in SCRIPTS:
+            raise ValueError("Unknown script %r, expected one of %s"%(script, SCRIPTS))
+
+    img = MockIMG(taxa=int(arguments['--taxa']), enzymes=int(arguments['--enzymes']), page_kb=int(arguments['--page_kb']),
+        latency=float(arguments['--latency'])/1000., jitter=float(arguments['--jitter'])/1000.,
+        error_rate=float(arguments['--error_rate']), error_status=int(arguments['--error_status']),
+        record_dir=arguments['--record_dir'])
+    server, homepage_url = start_server(img)
+
+    work_dir = tempfile.mkdtemp(prefix='bench_crawl_')
+
+    print("Mock IMG at %s: %s taxa per list, %s ecs per taxon, %s KB taxon pages, %s+-%s ms latency, %s error rate"%(homepage_url,
+        arguments['--taxa'], arguments['--enzymes'], arguments['--page_kb'], arguments['--latency'], arguments['--jitter'], arguments['--error_rate']))
+    print("Script options: %s"%(arguments['--args'] or '(defaults)'))
+    print("-"*80)
+
+    try:
+        results = run_benchmark(scripts, img, homepage_url, work_dir, shlex.split(arguments['--args']))
+    finally:
+        server.shutdown()
+        if arguments['--keep']:
+            print("Output and logs kept in %s"%work_dir)
+        else:
+            shutil.rmtree(work_dir)
+
+    if arguments['--json']:
+        with open(arguments['--json'], 'w') as outfile:
+            json.dump({'options': dict((key, value) for key, value in arguments.items()), 'results': results}, outfile, indent=1)
@@ -0,0 +1,215 @@
+## bench_parse
+"""
+Micro-benchmark of the html parsing of the scrape_*_from_jgi scripts on
+saved taxon pages, against what the scripts did before jgi_parse:
+
+  metadata table  parse_metadata_table vs. a BeautifulSoup tree of the page
+  enzyme links    extract_detail_links vs. one regex search per datatype
+
+Pages are read from html files, or from the taxon pages of a PageCache
+(see jgi_cache). With neither, a synthetic IMG-like taxon page is used.
+
+Usage:
+  bench_parse.py [PAGE...] [options]
+
+Arguments:
+  PAGE  saved html source of a taxon page
+
+Options:
+  --cache_dir=<cd>    also use every taxon page held in this page cache
+  --max_pages=<mp>    use at most this many pages [default: 200]
+  --repeat=<n>    number of times each page is parsed by each parser [default: 5]
+  --page_kb=<pk>    size of the synthetic page, in KB [default: 400]
+  --one_line    put the synthetic page on a single line, like a minified page
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import warnings
+from docopt import docopt
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jgi_parse import parse_metadata_table, extract_detail_links
+from jgi_cache import PageCache
+
+TAXON_PAGE_REGEX = re.compile(r'page=(taxonDetail|metaDetail)')
+
+DATATYPES = ['assembled', 'unassembled', 'both']
+
+def bs4_metadata_table(htmlSource):
+    """
+    the metadata table parsing of get_*_metadata_while_on_*_page before jgi_parse
+    """
+
+    bs = BeautifulSoup(htmlSource,"html.parser")
+    metadata_table = bs.findAll('table')[0]
+
+    metadata_table_dict = dict()
+    for row in metadata_table.findAll('tr'):
+
+        if (len(row.findAll('th')) == 1) and (len(row.findAll('td')) == 1):
+
+            row_key = row.findAll('th')[0].text.rstrip()
+            row_value = row.findAll('td')[0].text.rstrip() if row.findAll('td')[0] else None
+            metadata_table_dict[row_key] = row_value
+
+    return metadata_table_dict
+
+def regex_enzyme_links(htmlSource):
+    """
+    the enzyme link parsing of get_enzyme_url_from_*_url before jgi_parse (one search per datatype)
+    """
+
+    links = dict()
+
+    regex = r'<a href=\"(main\.cgi\?section=TaxonDetail&amp;page=enzymes&amp;taxon_oid=\d*)\"'
+    match = re.search(regex, htmlSource)
+    if match:
+        links['genome'] = match.group(1)
+
+    for datatype in DATATYPES:
+        regex = r'<a href=\"(main\.cgi\?section=MetaDetail&amp;page=enzymes.*data_type=%s.*)\" onclick'%datatype
+        match = re.search(regex, htmlSource)
+        if match:
+            links[datatype] = match.group(1)
+
+    return links
+
+def extracted_enzyme_links(htmlSource):
+    links = extract_detail_links(htmlSource)
+    links.pop('taxon', None)
+    return links
+
+def synthetic_taxon_page(rows=80, tail_kb=400, seed=0):
+    """
+    :param rows: number of metadata rows
+    :param tail_kb: size of the page after the metadata table, in KB
+    :returns: html source shaped like an IMG taxon page (scripts and menus, the metadata table, then gene tables and the enzyme links)
+    """
+
+    R = random.Random(seed)
+
+    head = ['<!DOCTYPE html><html><head><title>Taxon Details</title>']
+    for i in range(20):
+        head.append('<script type="text/javascript">var menu%d = {"a": "<div>x</div>"}; function f%d(){ return 1 < 2; }</script>'%(i, i))
+    head.append('<style>'+'td.img { padding: 2px; } '*100+'</style></head><body>')
+    for i in range(60):
+        head.append('<div class="menu"><ul><li><a href="main.cgi?section=Menu&amp;page=p%d">Menu item %d</a></li></ul></div>'%(i, i))
+
+    table = ['<table class="img" border="1">', '<tr class="highlight"><th class="subhead" colspan="2">Overview</th></tr>']
+    for i in range(rows):
+        value = R.choice(['%d'%R.randint(1, 10**9), 'Some organism name strain %d'%i, 'Yes', '&nbsp;',
+            '<a href="main.cgi?section=TaxonDetail&amp;page=taxonDetail&amp;taxon_oid=%d">%d</a>'%(i, i)])
+        table.append('<tr class="img"><th class="subhead" align="right">Field number %d</th><td class="img">%s</td></tr>\n'%(i, value))
+    table.append('</table>')
+
+    tail = list()
+    size = 0
+    while size < tail_kb*1024:
+        chunk = '<table class="img"><tr><th>Gene %d</th><td>%s</td><td><a href="main.cgi?section=GeneDetail&amp;page=geneDetail&amp;gene_oid=%d">link</a></td></tr></table><script>var x%d = "<p>";</script>\n'%(size, 'y'*50, size, size)
+        tail.append(chunk)
+        size += len(chunk)
+    for datatype in DATATYPES:
+        tail.insert(R.randint(0, len(tail)), '<a href="main.cgi?section=MetaDetail&amp;page=enzymes&amp;taxon_oid=3300000001&amp;data_type=%s" onclick="return x()">Enzymes</a>'%datatype)
+    tail.append('<a href="main.cgi?section=TaxonDetail&amp;page=enzymes&amp;taxon_oid=2500000001">Enzymes</a>')
+
+    return ''.join(head)+''.join(table)+''.join(tail)+'</body></html>'
+
+def load_pages(paths, cache_dir=None, max_pages=200):
+    """
+    :returns: list of html sources of saved taxon pages
+    """
+
+    pages = list()
+
+    for path in paths:
+        with open(path) as infile:
+            pages.append(infile.read())
+
+    if cache_dir:
+        cache = PageCache(cache_dir)
+        urls = [url for (url,) in cache.db.execute('SELECT url FROM entries') if TAXON_PAGE_REGEX.search(url)]
+        for url in urls[:max(0, max_pages-len(pages))]:
+            entry = cache.get(url)
+            if entry is not None:
+                pages.append(entry['body'])
+        cache.close()
+
+    return pages[:max_pages]
+
+def parse_or_error(parse, htmlSource):
+    """
+    :returns: parse(htmlSource), or the name of the exception it raised
+    """
+
+    try:
+        return parse(htmlSource)
+    except Exception as e:
+        return type(e).__name__
+
+def time_parser(parse, pages, repeat):
+    """
+    :returns: list of seconds taken by each parse, and the parsed results (or errors) of the first round
+    """
+
+    results = [parse_or_error(parse, htmlSource) for htmlSource in pages]
+
+    times = list()
+    for i in range(repeat):
+        for htmlSource in pages:
+            start = time.perf_counter()
+            parse_or_error(parse, htmlSource)
+            times.append(time.perf_counter()-start)
+
+    return times, results
+
+def print_times(name, times):
+    times = sorted(times)
+    print("%-28s median %8.3f ms   p99 %8.3f ms   total %8.1f ms"%(name, 1000*times[len(times)//2], 1000*times[int(0.99*(len(times)-1))], 1000*sum(times)))
+
+def run_benchmark(benchmarks, pages, repeat):
+    """
+    :param benchmarks: list of (name, baseline function, new function), both function(htmlSource) -> result
+    :param pages: list of html sources
+    :param repeat: number of times each page is parsed by each function
+    """
+
+    print("%d pages, %.1f KB on average, each parsed %d times"%(len(pages), sum(len(page) for page in pages)/1024./len(pages), repeat))
+
+    for name, baseline, new in benchmarks:
+
+        print("-"*80)
+
+        baseline_times, baseline_results = time_parser(baseline, pages, repeat)
+        new_times, new_results = time_parser(new, pages, repeat)
+
+        print_times(name+' (before)', baseline_times)
+        print_times(name+' (now)', new_times)
+
+        mismatches = sum(1 for a, b in zip(baseline_results, new_results) if a != b)
+        print("%.1fx faster, %d of %d pages give a different result"%(sum(baseline_times)/sum(new_times), mismatches, len(pages)))
+
+BENCHMARKS = [
+    ('metadata table', bs4_metadata_table, parse_metadata_table),
+    ('enzyme links', regex_enzyme_links, extracted_enzyme_links),
+]
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='bench_parse 1.0')
+
+    ## BeautifulSoup's findAll deprecation warnings
+    warnings.simplefilter('ignore')
+
+    pages = load_pages(arguments['PAGE'], cache_dir=arguments['--cache_dir'], max_pages=int(arguments['--max_pages']))
+    if not pages:
+        print("No saved pages given, using a synthetic taxon page.")
+        pages = [synthetic_taxon_page(tail_kb=int(arguments['--page_kb']))]
+        if arguments['--one_line']:
+            pages = [page.replace('\n', '') for page in pages]
+
+    run_benchmark(BENCHMARKS, pages, int(arguments['--repeat']))
@@ -0,0 +1,335 @@
+## mock_img_server
+"""
+Local stand-in for the IMG site, to run the scrape_*_from_jgi scripts
+offline (point their --homepage at it).
+
+Serves the homepage, TaxonList pages (by domain, and by ecosystem class for
+metagenomes), their YAHOO DataSource list jsons, TaxonDetail / MetaDetail
+pages, enzyme pages and enzyme jsons. Pages are synthetic and shaped like
+IMG's (see bench_parse.synthetic_taxon_page), with `--taxa` taxa per list and
+`--enzymes` ecs per enzyme json, or replayed from the pages recorded in a
+PageCache (see jgi_cache) when `--record_dir` is given.
+
+Every response is delayed by `--latency` +- `--jitter` ms, and a fraction
+`--error_rate` of them fail with `--error_status` instead. The server counts
+requests and errors, and the time of the first and last request of each
+taxon (see MockIMG.stats).
+
+Usage:
+  mock_img_server.py [options]
+
+Options:
+  --port=<p>    port to listen on [default: 8000]
+  --taxa=<n>    taxa per domain and per ecosystem class [default: 200]
+  --enzymes=<n>    ecs per enzyme json [default: 300]
+  --page_kb=<pk>    size of a taxon page, in KB [default: 100]
+  --latency=<ms>    mean delay of every response, in ms [default: 20]
+  --jitter=<ms>    max random deviation from the mean delay, in ms [default: 10]
+  --error_rate=<er>    fraction of responses that fail with --error_status [default: 0]
+  --error_status=<es>    http status of an injected error [default: 503]
+  --record_dir=<rd>    replay the pages of this page cache (urls are matched on path and query)
+  --seed=<s>    seed of the synthetic pages, delays and errors [default: 0]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from docopt import docopt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jgi_cache import PageCache
+
+CGI_DIR = '/cgi-bin/m/'
+
+GENOME_DOMAINS = ['Archaea', 'Bacteria', 'Eukaryota']
+ECOSYSTEM_CLASSES = ['Engineered', 'Environmental', 'Host-associated']
+DATATYPES = ['assembled', 'unassembled', 'both']
+
+## first taxon_oid of each list
+FIRST_OID = {'Archaea': 2500000000, 'Bacteria': 2600000000, 'Eukaryota': 2700000000,
+    'Engineered': 3300000000, 'Environmental': 3310000000, 'Host-associated': 3320000000}
+
+DATASOURCE = '<script type="text/javascript">var myDataSource = new YAHOO.util.DataSource("%s");</script>'
+
+class MockIMG(object):
+    """
+    the pages of a mock IMG site, its injected latency and errors, and its request stats
+    """
+
+    def __init__(self, taxa=200, enzymes=300, page_kb=100, latency=0.02, jitter=0.01, error_rate=0.0, error_status=503,
+        record_dir=None, seed=0):
+        """
+        :param taxa: taxa per domain and per ecosystem class
+        :param enzymes: ecs per enzyme json
+        :param page_kb: size of a taxon page, in KB
+        :param latency: mean delay of every response, in seconds
+        :param jitter: max random deviation from the mean delay, in seconds
+        :param error_rate: fraction of responses that fail with error_status
+        :param error_status: http status of an injected error
+        :param record_dir: page cache to replay pages from, or None for synthetic pages only
+        :param seed: seed of the synthetic pages, delays and errors
+        """
+
+        self.taxa = taxa
+        self.enzymes = enzymes
+        self.page_kb = page_kb
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+        self.random = random.Random(seed)
+
+        self.recorded = self.load_recorded(record_dir) if record_dir else dict()
+
+        ## the gene tables after the metadata table are the same for every taxon page
+        tail = list()
+        size = 0
+        while size < page_kb*1024:
+            chunk = '<table class="img"><tr><th>Gene %d</th><td>%s</td><td><a href="main.cgi?section=GeneDetail&amp;page=geneDetail&amp;gene_oid=%d">link</a></td></tr></table>\n'%(size, 'y'*50, size)
+            tail.append(chunk)
+            size += len(chunk)
+        self.page_tail = ''.join(tail)
+
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def load_recorded(self, record_dir):
+        """
+        :returns: dict of path?query -> body of every page in the page cache
+        """
+
+        cache = PageCache(record_dir)
+        recorded = dict()
+        for (url,) in cache.db.execute('SELECT url FROM entries').fetchall():
+            entry = cache.get(url)
+            if entry is not None:
+                parts = urlsplit(url)
+                recorded[parts.path+'?'+parts.query] = entry['body']
+        cache.close()
+
+        print("Replaying %d recorded pages from %s"%(len(recorded), record_dir))
+
+        return recorded
+
+    def reset_stats(self):
+
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.taxon_times = dict()
+
+    def stats(self):
+        """
+        :returns: dict with 'requests', 'errors' and 'taxon_latencies' (seconds from the first to the last request of each taxon)
+        """
+
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'taxon_latencies': [last-first for first, last in self.taxon_times.values()],
+            }
+
+    def record_request(self, params):
+
+        now = time.time()
+
+        with self.lock:
+            self.requests += 1
+            taxon_oid = params.get('taxon_oid')
+            if taxon_oid:
+                first, last = self.taxon_times.get(taxon_oid, (now, now))
+                self.taxon_times[taxon_oid] = (first, now)
+
+    def delay_and_error(self):
+        """
+        :returns: seconds to delay the response, and whether it fails
+        """
+
+        with self.lock:
+            delay = max(0.0, self.latency+self.random.uniform(-self.jitter, self.jitter))
+            error = self.random.random() < self.error_rate
+            if error:
+                self.errors += 1
+
+        return delay, error
+
+    def taxon_oids(self, name):
+        """
+        :param name: a domain or an ecosystem class
+        :returns: the taxon_oids of its list
+        """
+
+        return [str(FIRST_OID[name]+i) for i in range(self.taxa)]
+
+    def homepage(self):
+
+        links = list()
+        for domain in GENOME_DOMAINS:
+            links.append('<a href="main.cgi?section=TaxonList&amp;page=taxonListAlpha&amp;domain=%s&amp;seq_center=jgi">%s (JGI)</a>'%(domain, domain))
+            links.append('<a href="main.cgi?section=TaxonList&amp;page=taxonListAlpha&amp;domain=%s">%s (all)</a>'%(domain, domain))
+        for seq_center in ('jgi', 'all'):
+            for ecosystemClass in ECOSYSTEM_CLASSES:
+                links.append('<a href="main.cgi?section=TaxonList&amp;domain=Metagenome&amp;seq_center=%s&amp;page=metaCatList&amp;phylum=%s">%s</a>'%(seq_center, ecosystemClass, ecosystemClass))
+
+        return '<!DOCTYPE html><html><head><title>IMG</title></head><body>%s</body></html>'%'<br>'.join(links)
+
+    def list_page(self, name):
+
+        return '<html><head>%s</head><body><div id="dt"></div></body></html>'%(DATASOURCE%('json_proxy.cgi?sid=list&list=%s'%name))
+
+    def list_json(self, name):
+
+        metagenome = name in ECOSYSTEM_CLASSES
+        records = list()
+        for taxon_oid in self.taxon_oids(name):
+            section, page = ('MetaDetail', 'metaDetail') if metagenome else ('TaxonDetail', 'taxonDetail')
+            href = 'main.cgi?section=%s&page=%s&taxon_oid=%s'%(section, page, taxon_oid)
+            records.append({'GenomeNameSampleNameDisp': "<a href='%s'>%s taxon %s</a>"%(href, name, taxon_oid), 'Domain': name, 'TaxonOid': taxon_oid})
+
+        return json.dumps({'recordsReturned': len(records), 'totalRecords': len(records), 'records': records})
+
+    def taxon_page(self, taxon_oid, metagenome):
+
+        R = random.Random('%s-%s'%(self.seed, taxon_oid))
+
+        rows = ['<tr><th class="subhead" align="right">%s</th><td class="img">%s</td></tr>'%('Taxon Object ID' if metagenome else 'Taxon ID', taxon_oid)]
+        for i in range(40):
+            rows.append('<tr><th class="subhead" align="right">Field number %d</th><td class="img">%s</td></tr>'%(i, R.choice(['%d'%R.randint(1, 10**9), 'Yes', 'Some organism strain %d'%i])))
+
+        if metagenome:
+            links = ''.join('<a href="main.cgi?section=MetaDetail&amp;page=enzymes&amp;taxon_oid=%s&amp;data_type=%s" onclick="return x()">Enzymes</a>'%(taxon_oid, datatype)
+                for datatype in DATATYPES)
+        else:
+            links = '<a href="main.cgi?section=TaxonDetail&amp;page=enzymes&amp;taxon_oid=%s">Enzymes</a>'%taxon_oid
+
+        return '<!DOCTYPE html><html><head><title>Taxon Details</title></head><body><table class="img" border="1">%s</table>%s%s</body></html>'%(
+            ''.join(rows), self.page_tail, links)
+
+    def enzyme_page(self, taxon_oid, datatype):
+
+        json_url = 'json_proxy.cgi?sid=enzymes&taxon_oid=%s'%taxon_oid+('&data_type=%s'%datatype if datatype else '')
+
+        return '<html><head>%s</head><body><div id="dt"></div></body></html>'%(DATASOURCE%json_url)
+
+    def enzyme_json(self, taxon_oid, datatype):
+
+        R = random.Random('%s-%s-%s'%(self.seed, taxon_oid, datatype))
+        records = [{'EnzymeID': 'EC:%d.%d.%d.%d'%(R.randint(1, 7), R.randint(1, 20), R.randint(1, 30), R.randint(1, 200)),
+            'EnzymeName': 'enzyme name %d'%i, 'GeneCount': str(R.randint(1, 50))} for i in range(self.enzymes)]
+
+        return json.dumps({'recordsReturned': len(records), 'records': records})
+
+    def respond(self, path, query):
+        """
+        :param path: path of the request
+        :param query: raw query string of the request (IMG's links keep their &amp; in it)
+        :returns: (status, content type, body)
+        """
+
+        params = dict((key, values[0]) for key, values in parse_qs(query.replace('&amp;', '&')).items())
+        self.record_request(params)
+
+        if path+'?'+query in self.recorded:
+            body = self.recorded[path+'?'+query]
+            return 200, 'application/json' if body.lstrip().startswith('{') else 'text/html', body
+
+        if path == CGI_DIR+'main.cgi':
+
+            section = params.get('section')
+            page = params.get('page')
+
+            if section is None:
+                return 200, 'text/html', self.homepage()
+            if section == 'TaxonList' and page == 'taxonListAlpha' and params.get('domain') in GENOME_DOMAINS:
+                return 200, 'text/html', self.list_page(params['domain'])
+            if section == 'TaxonList' and page == 'metaCatList' and params.get('phylum') in ECOSYSTEM_CLASSES:
+                return 200, 'text/html', self.list_page(params['phylum'])
+            if page in ('taxonDetail', 'metaDetail') and 'taxon_oid' in params:
+                return 200, 'text/html', self.taxon_page(params['taxon_oid'], page == 'metaDetail')
+            if page == 'enzymes' and 'taxon_oid' in params:
+                return 200, 'text/html', self.enzyme_page(params['taxon_oid'], params.get('data_type'))
+
+        elif path == CGI_DIR+'json_proxy.cgi':
+
+            if params.get('sid') == 'list' and params.get('list') in FIRST_OID:
+                return 200, 'application/json', self.list_json(params['list'])
+            if params.get('sid') == 'enzymes' and 'taxon_oid' in params:
+                return 200, 'application/json', self.enzyme_json(params['taxon_oid'], params.get('data_type'))
+
+        return 404, 'text/html', '<html><body>Not found</body></html>'
+
+def make_handler(img):
+    """
+    :param img: the MockIMG to serve
+    :returns: request handler class serving img
+    """
+
+    class MockIMGHandler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+
+            parts = urlsplit(self.path)
+            status, content_type, body = img.respond(parts.path, parts.query)
+
+            delay, error = img.delay_and_error()
+            time.sleep(delay)
+            if error:
+                status, body = img.error_status, '<html><body>Service unavailable</body></html>'
+
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type+'; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockIMGHandler
+
+def start_server(img, port=0):
+    """
+    serve img from a background thread
+
+    :param img: the MockIMG to serve
+    :param port: port to listen on (0 for any free port)
+    :returns: the server, and the homepage url to give the scripts
+    """
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(img))
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, name='mock-img')
+    thread.daemon = True
+    thread.start()
+
+    return server, 'http://127.0.0.1:%d%smain.cgi'%(server.server_address[1], CGI_DIR)
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='mock_img_server 1.0')
+
+    img = MockIMG(taxa=int(arguments['--taxa']), enzymes=int(arguments['--enzymes']), page_kb=int(arguments['--page_kb']),
+        latency=float(arguments['--latency'])/1000., jitter=float(arguments['--jitter'])/1000.,
+        error_rate=float(arguments['--error_rate']), error_status=int(arguments['--error_status']),
+        record_dir=arguments['--record_dir'], seed=int(arguments['--seed']))
+
+    server, homepage_url = start_server(img, port=int(arguments['--port']))
+
+    print("Mock IMG homepage: %s"%homepage_url)
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,391 @@
+## jgi_archive
+"""
+Append-only archive of the raw responses of a crawl (`--archive_dir`), to
+rebuild its jsons after a parsing fix without fetching anything again
+(`--reparse`).
+
+Every page and json body a fetcher returns (from the network or from the page
+cache) is appended to the archive as a WARC/1.0 `resource` record. Each record
+is its own gzip member, so the segments can be read by WARC tools and any one
+record can be decompressed on its own:
+
+  ARCHIVE_DIR/responses-00000.warc.gz, responses-00001.warc.gz, ...
+  ARCHIVE_DIR/index.sqlite   url, taxon_id, stage, segment, offset and length of every record
+
+Each run appends to a new segment, and rolls over to another one past
+`segment_mb`, so a segment is never written to again once closed. The newest
+record of a url wins. The taxon_id of a record is the taxon_oid in its url,
+when it has one (taxon and enzyme pages).
+
+A reparse runs the scripts' own functions over an ArchiveFetcher, which
+answers every load from the archive: the list pages give the taxa, and
+`reparse_archive` scrapes them again in one process per core. Each process
+sends the stage metrics of a taxon back with it, so a reparse is reported
+like a crawl (see jgi_metrics).
+"""
+
+import os
+import json
+import gzip
+import time
+import uuid
+import sqlite3
+import builtins
+import threading
+import multiprocessing
+from jgi_manifest import TAXON_OID_REGEX
+from jgi_metrics import METRICS
+
+SEGMENT_PREFIX = 'responses-'
+SEGMENT_SUFFIX = '.warc.gz'
+
+def content_type(stage):
+    """
+    :param stage: stage the body was fetched for (see jgi_waits.STAGE_TIMEOUTS)
+    :returns: the content type of its record
+    """
+
+    return 'application/json' if stage.endswith('_json') else 'text/html'
+
+def warc_record(url, stage, body):
+    """
+    :param url: url the body was fetched from
+    :param stage: stage it was fetched for
+    :param body: the body text
+    :returns: bytes of a WARC/1.0 resource record holding body
+    """
+
+    data = body.encode('utf-8')
+    header = '\r\n'.join([
+        'WARC/1.0',
+        'WARC-Type: resource',
+        'WARC-Record-ID: <urn:uuid:%s>'%uuid.uuid4(),
+        'WARC-Date: %s'%time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'WARC-Target-URI: %s'%url,
+        'JGI-Stage: %s'%stage,
+        'Content-Type: %s; charset=utf-8'%content_type(stage),
+        'Content-Length: %d'%len(data),
+    ])
+
+    return header.encode('utf-8')+b'\r\n\r\n'+data+b'\r\n\r\n'
+
+def parse_warc_record(record):
+    """
+    :param record: bytes of one (decompressed) record written by warc_record
+    :returns: the body text
+    """
+
+    header, rest = record.split(b'\r\n\r\n', 1)
+    for line in header.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            return rest[:int(line.split(b':', 1)[1])].decode('utf-8')
+
+    raise ValueError("WARC record without a Content-Length")
+
+def open_index(archive_dir, read_only=False):
+    """
+    :returns: connection to the archive's sqlite index
+    """
+
+    path = os.path.join(archive_dir, 'index.sqlite')
+
+    if read_only:
+        return sqlite3.connect('file:%s?mode=ro'%path, uri=True, check_same_thread=False)
+
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('''CREATE TABLE IF NOT EXISTS records (
+        id INTEGER PRIMARY KEY, url TEXT, taxon_id TEXT, stage TEXT, segment TEXT, offset INTEGER, length INTEGER, fetched_at REAL)''')
+    db.execute('CREATE INDEX IF NOT EXISTS records_url ON records (url)')
+    db.execute('CREATE INDEX IF NOT EXISTS records_taxon_id ON records (taxon_id)')
+
+    return db
+
+class ResponseArchive(object):
+    """
+    append every response body of a crawl to gzipped WARC segments, indexed by url and taxon id
+    """
+
+    def __init__(self, archive_dir, segment_mb=1024):
+        """
+        :param archive_dir: dir to keep the segments and their index in
+        :param segment_mb: size in MB past which the next record starts a new segment
+        """
+
+        self.archive_dir = archive_dir
+        self.segment_bytes = segment_mb*1024**2
+
+        if not os.path.exists(archive_dir):
+            os.makedirs(archive_dir)
+
+        self.lock = threading.Lock()
+        self.db = open_index(archive_dir)
+
+        ## segments of earlier runs are left as they are
+        numbers = [int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(archive_dir)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+        self.segment_number = max(numbers)+1 if numbers else 0
+        self.outfile = None
+        self.open_segment()
+
+        self.records = 0
+
+    def open_segment(self):
+
+        if self.outfile is not None:
+            self.outfile.close()
+            self.segment_number += 1
+
+        self.segment = '%s%05d%s'%(SEGMENT_PREFIX, self.segment_number, SEGMENT_SUFFIX)
+        self.outfile = open(os.path.join(self.archive_dir, self.segment), 'ab')
+        self.offset = self.outfile.tell()
+
+    def add(self, url, stage, body):
+        """
+        append body to the archive and index it
+
+        :param url: url it was fetched from
+        :param stage: stage it was fetched for (see jgi_waits.STAGE_TIMEOUTS)
+        :param body: the body text
+        """
+
+        with METRICS.timed('archive_write'):
+
+            member = gzip.compress(warc_record(url, stage, body), compresslevel=6)
+
+            match = TAXON_OID_REGEX.search(url)
+            taxon_id = match.group(1) if match else None
+
+            with self.lock:
+
+                if self.offset and self.offset+len(member) > self.segment_bytes:
+                    self.open_segment()
+
+                offset = self.offset
+                self.outfile.write(member)
+                ## the record is on disk before the index points at it
+                self.outfile.flush()
+                self.offset += len(member)
+
+                self.db.execute('INSERT INTO records (url, taxon_id, stage, segment, offset, length, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (url, taxon_id, stage, self.segment, offset, len(member), time.time()))
+                self.records += 1
+
+    def close(self):
+
+        with self.lock:
+            self.outfile.close()
+            self.db.close()
+
+        print("Archived %d responses to %s"%(self.records, self.archive_dir))
+
+class ArchiveReader(object):
+    """
+    read the archived body of a url back, from any thread
+    """
+
+    def __init__(self, archive_dir):
+        """
+        :param archive_dir: dir of a ResponseArchive
+        """
+
+        self.archive_dir = archive_dir
+        self.db = open_index(archive_dir, read_only=True)
+        self.lock = threading.Lock()
+        self.fds = dict()
+
+    def locate(self, url):
+        """
+        :returns: (segment, offset, length) of the newest record of url, or None if it is not archived
+        """
+
+        with self.lock:
+            return self.db.execute('SELECT segment, offset, length FROM records WHERE url = ? ORDER BY id DESC LIMIT 1', (url,)).fetchone()
+
+    def get(self, url):
+        """
+        :param url: url of an archived page or json
+        :returns: its body text, or None if it is not archived
+        """
+
+        row = self.locate(url)
+        if row is None:
+            return None
+
+        segment, offset, length = row
+
+        with self.lock:
+            if segment not in self.fds:
+                self.fds[segment] = os.open(os.path.join(self.archive_dir, segment), os.O_RDONLY)
+            fd = self.fds[segment]
+
+        return parse_warc_record(gzip.decompress(os.pread(fd, length, offset)))
+
+    def urls_of_taxon(self, taxon_id):
+        """
+        :returns: list of (url, stage) of every archived record of a taxon
+        """
+
+        with self.lock:
+            return self.db.execute('SELECT DISTINCT url, stage FROM records WHERE taxon_id = ?', (taxon_id,)).fetchall()
+
+    def close(self):
+
+        with self.lock:
+            for fd in self.fds.values():
+                os.close(fd)
+            self.fds = dict()
+            self.db.close()
+
+class ArchiveFetcher(object):
+    """
+    fetcher answering every load from an archive instead of the network (see jgi_fetch for the interface)
+    """
+
+    def __init__(self, archive_dir):
+        """
+        :param archive_dir: dir of a ResponseArchive
+        """
+
+        self.reader = ArchiveReader(archive_dir)
+
+    def get(self, url, stage):
+
+        with METRICS.timed(stage):
+            body = self.reader.get(url)
+
+        if body is None:
+            raise ValueError("No response to %s in the archive (stage '%s')"%(url, stage))
+
+        return body
+
+    def archived(self, url):
+        """
+        :returns: True if url has a record in the archive
+        """
+
+        return self.reader.locate(url) is not None
+
+    def load_page(self, url, stage):
+        return self.get(url, stage)
+
+    def load_json(self, url, stage):
+
+        jsonSource = self.get(url, stage)
+
+        with METRICS.timed('json_decode'):
+            return json.loads(jsonSource)
+
+    def close(self):
+        self.reader.close()
+
+## state of a reparse worker process, set by init_reparse_worker
+REPARSE_WORKER = dict()
+
+def init_reparse_worker(archive_dir, scrape_taxon):
+
+    ## a lock held by a thread of the parent (e.g. the metrics reporter) when it forked would never be released here
+    METRICS.lock = threading.Lock()
+
+    REPARSE_WORKER['fetcher'] = ArchiveFetcher(archive_dir)
+    REPARSE_WORKER['scrape_taxon'] = scrape_taxon
+
+def reparse_taxon(taxon_url):
+    """
+    :returns: (taxon_url, single taxon dict, None, histograms, counters), or (taxon_url, None, (exception type name,
+        message), histograms, counters) if it failed, with the METRICS histograms and counters recorded scraping it
+    """
+
+    METRICS.reset()
+
+    try:
+        result, error = REPARSE_WORKER['scrape_taxon'](REPARSE_WORKER['fetcher'], taxon_url), None
+    except Exception as e:
+        ## the exception itself may not pickle, so only its type and message are sent back
+        result, error = None, (type(e).__name__, str(e))
+
+    return taxon_url, result, error, METRICS.histograms, METRICS.counters
+
+def rebuild_error(name, message):
+    """
+    :returns: an exception of the type named name (a builtin one, or a new Exception subclass of that name) holding message
+    """
+
+    error_type = getattr(builtins, name, None)
+    if isinstance(error_type, type) and issubclass(error_type, Exception):
+        try:
+            return error_type(message)
+        except TypeError:
+            ## e.g. UnicodeDecodeError, which needs more than a message
+            pass
+
+    return type(name, (Exception,), {})(message)
+
+def reparse_archive(archive_dir, taxon_urls, scrape_taxon, processes=None, manifest=None, on_result=None, on_error=None):
+    """
+    scrape taxa again from the archive, in parallel processes (forked, so scrape_taxon may be a lambda)
+
+    :param archive_dir: dir of a ResponseArchive
+    :param taxon_urls: urls of the taxa to scrape (the ones with no archived taxon page are skipped)
+    :param scrape_taxon: function(fetcher, taxon_url) -> single taxon dict (e.g. scrape_single_<domain>, which writes its json)
+    :param processes: number of processes, None for one per core
+    :param manifest: CrawlManifest to record finished taxa in (see jgi_manifest), or None
+    :param on_result: function(single taxon dict) called in this process as each taxon finishes
+    :param on_error: function(taxon_url, exception) called when a taxon fails, instead of stopping the reparse (e.g. Quarantine.add)
+    :returns: number of taxa scraped
+    """
+
+    fetcher = ArchiveFetcher(archive_dir)
+    archived_urls = [taxon_url for taxon_url in taxon_urls if fetcher.archived(taxon_url)]
+    fetcher.close()
+
+    if len(archived_urls) < len(taxon_urls):
+        print("%d of %d taxa have no archived taxon page, skipping them."%(len(taxon_urls)-len(archived_urls), len(taxon_urls)))
+
+    processes = processes or os.cpu_count()
+
+    print("Reparsing %d taxa from %s with %d processes ..."%(len(archived_urls), archive_dir, processes))
+
+    start = time.time()
+    done = 0
+
+    pool = multiprocessing.get_context('fork').Pool(processes, initializer=init_reparse_worker, initargs=(archive_dir, scrape_taxon))
+
+    try:
+
+        ## small chunks keep every process busy to the end
+        chunksize = max(1, min(8, len(archived_urls)//(4*processes)))
+
+        for taxon_url, result, error, histograms, counters in pool.imap_unordered(reparse_taxon, archived_urls, chunksize=chunksize):
+
+            METRICS.merge(histograms, counters)
+
+            e = rebuild_error(*error) if error is not None else None
+
+            if e is None:
+                ## recorded as completed only once written out; a taxon on_result fails to write out is failed as well
+                try:
+                    if on_result is not None:
+                        on_result(result)
+                except Exception as on_result_error:
+                    e = on_result_error
+                else:
+                    if manifest is not None:
+                        manifest.mark_completed(taxon_url)
+                    done += 1
+                    continue
+
+            if manifest is not None:
+                manifest.mark_failed(taxon_url, e)
+            if on_error is None:
+                raise e
+            on_error(taxon_url, e)
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+    print("Reparsed %d taxa in %.1fs."%(done, time.time()-start))
+
+    return done
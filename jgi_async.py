@@ -0,0 +1,420 @@
+## jgi_async
+"""
+asyncio crawl engine shared by the scrape_*_from_jgi scripts.
+
+The list -> taxon page -> enzyme page -> enzyme json chain of each taxon runs
+as its own coroutine, so slow taxa never block fast ones. Every request goes
+through one aiohttp connection pool, and no more than `per_host` requests are
+in flight to any one host at a time. Up to `taxa_in_flight` taxon chains are
+started at once.
+
+`crawl_targets_async` runs several CrawlTargets (e.g. every domain) as one
+frontier of taxa over the same connection pool, so the crawl of one domain
+never waits for another to finish.
+
+The disk i/o of the crawl never runs on the event loop: page cache lookups
+and stores and archive appends run in the loop's default thread pool, and the
+json of each taxon, the manifest and `on_result` (the concatenated file, pack
+or sqlite database) are written by one writer thread, so the writers of
+`on_result` still see one taxon at a time.
+
+Only the parsing functions of the scripts are reused here: pages are fetched
+directly over http (there is no chrome fallback), so point `homepage_url` at a
+local stand-in server to test a crawl offline.
+"""
+
+import os
+import json
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import aiohttp
+from jgi_waits import DATASOURCE_REGEX, STAGE_TIMEOUTS
+from jgi_fetch import USER_AGENT, page_ready
+from jgi_retry import retry_async
+from jgi_metrics import METRICS
+
+async def run_blocking(function, *args, executor=None, **kwargs):
+    """
+    :param executor: executor to run function in, None for the event loop's default thread pool
+    :returns: function(*args, **kwargs), run in a thread so its disk i/o does not block the event loop
+    """
+
+    return await asyncio.get_event_loop().run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+class AsyncFetcher(object):
+    """
+    GET pages and json over one shared aiohttp connection pool, capping concurrent requests per host
+    """
+
+    def __init__(self, session, per_host=8, cache=None, limiter=None, archive=None):
+        """
+        :param session: the aiohttp.ClientSession to fetch with
+        :param per_host: max number of requests in flight to any one host
+        :param cache: PageCache to answer fetches from and revalidate against (see jgi_cache), or None
+        :param limiter: RateLimiter every request goes through, below the per_host cap (see jgi_ratelimit), or None
+        :param archive: ResponseArchive to append every page and json loaded to (see jgi_archive), or None
+        """
+
+        self.session = session
+        self.per_host = per_host
+        self.host_limits = dict()
+        self.cache = cache
+        self.limiter = limiter
+        self.archive = archive
+
+    def host_limit(self, url):
+        """
+        :returns: the semaphore capping concurrent requests to url's host
+        """
+
+        host = urlsplit(url).netloc
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.per_host)
+
+        return self.host_limits[host]
+
+    async def get_text(self, url, stage):
+        """
+        :param url: url to GET
+        :param stage: stage the url belongs to (sets the timeout, see jgi_waits.STAGE_TIMEOUTS)
+        :returns: body of the response (from the cache when it is fresh or the server answers 304 Not Modified)
+        """
+
+        with METRICS.timed(stage):
+            return await self.get_text_untimed(url, stage)
+
+    async def get_text_untimed(self, url, stage):
+        """
+        untimed body of get_text
+        """
+
+        entry = None
+        headers = dict()
+
+        if self.cache is not None:
+            entry = await run_blocking(self.cache.get, url)
+            if entry is not None:
+                if entry['fresh']:
+                    self.cache.count('hit')
+                    return entry['body']
+                headers = self.cache.conditional_headers(entry)
+
+        async with self.host_limit(url):
+
+            start = await self.limiter.acquire_async(url) if self.limiter is not None else None
+            status = None
+            retry_after = None
+
+            try:
+                async with self.session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=STAGE_TIMEOUTS[stage])) as response:
+
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After')
+
+                    if entry is not None and response.status == 304:
+                        await run_blocking(self.cache.refresh, url)
+                        self.cache.count('revalidated')
+                        return entry['body']
+
+                    response.raise_for_status()
+                    body = await response.text()
+            finally:
+                if self.limiter is not None:
+                    ## no status: timed out, or the connection failed, both count as server pressure
+                    self.limiter.release(url, stage, start, status=status, timed_out=status is None, retry_after=retry_after)
+
+        if self.cache is not None:
+            self.cache.count('miss')
+            await run_blocking(self.cache.put, url, body, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+
+        return body
+
+    async def load_page(self, url, stage):
+        """
+        :param url: url of the page to load
+        :param stage: one of 'homepage', 'list', 'taxon', or 'enzyme'
+        :returns: html source of the page
+        """
+
+        htmlSource = await self.get_text(url, stage)
+
+        if not page_ready(htmlSource, stage):
+            if self.cache is not None:
+                await run_blocking(self.cache.discard, url)
+            raise ValueError("Page at %s is not ready for stage '%s' without javascript"%(url, stage))
+
+        ## archived once accepted, like the pages of jgi_fetch's fetchers
+        if self.archive is not None:
+            await run_blocking(self.archive.add, url, stage, htmlSource)
+
+        return htmlSource
+
+    async def load_json(self, url, stage):
+        """
+        :param url: url of a YAHOO DataSource json
+        :param stage: one of 'list_json' or 'enzyme_json'
+        :returns: the parsed json
+        """
+
+        jsonSource = await self.get_text(url, stage)
+
+        with METRICS.timed('json_decode'):
+            parsed_json = json.loads(jsonSource)
+
+        if self.archive is not None:
+            await run_blocking(self.archive.add, url, stage, jsonSource)
+
+        return parsed_json
+
+async def load_datasource_json(fetcher, page_url, page_stage, json_stage):
+    """
+    load page_url -> retrieve its YAHOO DataSource json_url -> load json_url -> retrieve json
+
+    :param fetcher: the AsyncFetcher
+    :param page_url: url of a list or enzyme page
+    :param page_stage: 'list' or 'enzyme'
+    :param json_stage: 'list_json' or 'enzyme_json'
+    :returns: the parsed json
+    """
+
+    htmlSource = await fetcher.load_page(page_url, page_stage)
+
+    json_suffix = DATASOURCE_REGEX.search(htmlSource).group(1)
+    json_url = page_url.split('main.cgi')[0]+json_suffix
+
+    return await fetcher.load_json(json_url, json_stage)
+
+def write_taxon_json(save_dir, single_dict, taxon_id_key):
+    """
+    write single_dict to save_dir/<taxon_id>.json
+    """
+
+    with METRICS.timed('write'):
+        with open(os.path.join(save_dir, single_dict['metadata'][taxon_id_key]+'.json'), 'w') as outfile:
+
+            json.dump(single_dict,outfile)
+
+async def scrape_taxon(fetcher, taxon_url, save_dir, get_metadata, get_enzyme_urls, parse_enzyme_info, taxon_id_key, writer=None):
+    """
+    load taxon_url -> scrape metadata -> load every enzyme json concurrently -> write <taxon_id>.json
+
+    :param fetcher: the AsyncFetcher
+    :param taxon_url: url for a single taxon
+    :param save_dir: dir to write the taxon's json to (None to write nothing, e.g. when the taxa are packed)
+    :param get_metadata: function(htmlSource) -> metadata_table_dict
+    :param get_enzyme_urls: function(taxon_url, htmlSource) -> dict of key ('genome' or datatype) -> enzyme_url or None
+    :param parse_enzyme_info: function(enzyme_json) -> enzyme_dict
+    :param taxon_id_key: metadata key naming the json file ('Taxon ID' or 'Taxon Object ID')
+    :param writer: executor to write the json in, None for the event loop's default thread pool
+    :returns: single taxon dict ({'metadata': ..., key: enzyme_dict, ...})
+    """
+
+    print("Scraping: %s ..."%taxon_url)
+
+    htmlSource = await fetcher.load_page(taxon_url, 'taxon')
+
+    single_dict = {'metadata': get_metadata(htmlSource)}
+
+    enzyme_urls = [(key, enzyme_url) for key, enzyme_url in get_enzyme_urls(taxon_url, htmlSource).items() if enzyme_url]
+
+    enzyme_jsons = await asyncio.gather(*[load_datasource_json(fetcher, enzyme_url, 'enzyme', 'enzyme_json') for key, enzyme_url in enzyme_urls])
+
+    for (key, enzyme_url), enzyme_json in zip(enzyme_urls, enzyme_jsons):
+        single_dict[key] = parse_enzyme_info(enzyme_json)
+
+    if save_dir is not None:
+        await run_blocking(write_taxon_json, save_dir, single_dict, taxon_id_key, executor=writer)
+
+    print("Done scraping: %s"%taxon_url)
+
+    return single_dict
+
+class CrawlTarget(object):
+    """
+    the list pages of one domain (or of the ecosystem classes of metagenomes) and how to scrape and record its taxa
+    """
+
+    def __init__(self, list_urls, save_dir, get_taxon_urls, get_metadata, get_enzyme_urls, parse_enzyme_info, taxon_id_key,
+        manifest=None, delta=None, on_result=None, on_error=None, taxon_urls=None):
+        """
+        see `crawl_async` for the parameters
+        """
+
+        self.list_urls = list_urls
+        self.save_dir = save_dir
+        self.get_taxon_urls = get_taxon_urls
+        self.get_metadata = get_metadata
+        self.get_enzyme_urls = get_enzyme_urls
+        self.parse_enzyme_info = parse_enzyme_info
+        self.taxon_id_key = taxon_id_key
+        self.manifest = manifest
+        self.delta = delta
+        self.on_result = on_result
+        self.on_error = on_error
+        self.taxon_urls = taxon_urls
+
+def record_result(target, taxon_url, result):
+    """
+    hand a finished taxon of target to its on_result, then record it in its manifest, so a taxon
+    recorded as completed has been written out
+    """
+
+    if target.on_result is not None:
+        target.on_result(result)
+    if target.manifest is not None:
+        target.manifest.mark_completed(taxon_url)
+
+def record_failure(target, taxon_url, error):
+    """
+    record a failed taxon of target in its manifest and hand it to its on_error
+    """
+
+    if target.manifest is not None:
+        target.manifest.mark_failed(taxon_url, error)
+    if target.on_error is not None:
+        target.on_error(taxon_url, error)
+
+async def crawl_frontier(targets, per_host=8, taxa_in_flight=200, cache=None, limiter=None, retries=0, retry_delay=2.0, archive=None):
+    """
+    coroutine behind `crawl_targets_async`; see there for the parameters
+    """
+
+    connector = aiohttp.TCPConnector(limit_per_host=per_host)
+
+    ## the one thread writing the taxa out
+    writer = ThreadPoolExecutor(max_workers=1)
+
+    try:
+        return await crawl_with_writer(targets, connector, writer, per_host=per_host, taxa_in_flight=taxa_in_flight, cache=cache, limiter=limiter,
+            retries=retries, retry_delay=retry_delay, archive=archive)
+    finally:
+        ## waits for the writes already handed to it
+        writer.shutdown()
+
+async def crawl_with_writer(targets, connector, writer, per_host=8, taxa_in_flight=200, cache=None, limiter=None, retries=0, retry_delay=2.0, archive=None):
+    """
+    body of `crawl_frontier`, writing the taxa out in writer
+    """
+
+    async with aiohttp.ClientSession(connector=connector, headers={'User-Agent': USER_AGENT}) as session:
+
+        fetcher = AsyncFetcher(session, per_host=per_host, cache=cache, limiter=limiter, archive=archive)
+
+        ## the list jsons of every target (not given its taxon urls) are loaded at once
+        list_targets = [target for target in targets if target.taxon_urls is None]
+        list_jsons = await asyncio.gather(*[load_datasource_json(fetcher, list_url, 'list', 'list_json')
+            for target in list_targets for list_url in target.list_urls])
+
+        ## one frontier of (target, taxon_url) across every target
+        frontier = list()
+
+        for target in targets:
+
+            if target.taxon_urls is not None:
+
+                taxon_urls = target.taxon_urls
+
+            else:
+
+                target_jsons, list_jsons = list_jsons[:len(target.list_urls)], list_jsons[len(target.list_urls):]
+
+                if target.delta is not None:
+                    target_jsons = [target.delta.select(list_json) for list_json in target_jsons]
+
+                taxon_urls = [taxon_url for list_json in target_jsons for taxon_url in target.get_taxon_urls(list_json)]
+
+            if target.manifest is not None:
+                taxon_urls = target.manifest.start(taxon_urls)
+
+            frontier.extend((target, taxon_url) for taxon_url in taxon_urls)
+
+        print("Scraping %d taxa, at most %d at a time ..."%(len(frontier), taxa_in_flight))
+
+        taxon_queue = asyncio.Queue()
+        for item in frontier:
+            taxon_queue.put_nowait(item)
+
+        results = list()
+
+        async def work():
+            while not taxon_queue.empty():
+                target, taxon_url = taxon_queue.get_nowait()
+                try:
+                    result = await retry_async(lambda: scrape_taxon(fetcher, taxon_url, target.save_dir, target.get_metadata, target.get_enzyme_urls,
+                        target.parse_enzyme_info, target.taxon_id_key, writer=writer), taxon_url, retries=retries, retry_delay=retry_delay)
+                    ## a taxon on_result fails to write out is failed as well
+                    await run_blocking(record_result, target, taxon_url, result, executor=writer)
+                except Exception as e:
+                    await run_blocking(record_failure, target, taxon_url, e, executor=writer)
+                    if target.on_error is not None:
+                        continue
+                    raise
+                if target.on_result is None:
+                    results.append(result)
+
+        tasks = [asyncio.ensure_future(work()) for i in range(max(1, min(taxa_in_flight, len(frontier))))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return results
+
+def crawl_targets_async(targets, per_host=8, taxa_in_flight=200, cache=None, limiter=None, retries=0, retry_delay=2.0, archive=None):
+    """
+    the list jsons of every target -> one frontier of taxon urls -> scrape every taxon in its own coroutine, over one connection pool
+
+    :param targets: list of CrawlTarget, e.g. one per domain
+    :param per_host: max number of requests in flight to any one host
+    :param taxa_in_flight: max number of taxon chains running at once, across every target
+    :param cache: PageCache to answer fetches from (see jgi_cache), or None
+    :param limiter: RateLimiter every request goes through (see jgi_ratelimit), or None
+    :param retries: number of times a failing taxon is scraped again, after a jittered backoff (see jgi_retry)
+    :param retry_delay: seconds the backoff between retries starts at
+    :param archive: ResponseArchive to append every body fetched to (see jgi_archive), or None
+    :returns: list of single taxon dicts of the targets without an on_result, in the order the taxa finished
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(crawl_frontier(targets, per_host=per_host, taxa_in_flight=taxa_in_flight, cache=cache, limiter=limiter,
+            retries=retries, retry_delay=retry_delay, archive=archive))
+    finally:
+        loop.close()
+
+def crawl_async(list_urls, save_dir, get_taxon_urls, get_metadata, get_enzyme_urls, parse_enzyme_info, taxon_id_key,
+    per_host=8, taxa_in_flight=200, manifest=None, cache=None, delta=None, on_result=None, limiter=None,
+    retries=0, retry_delay=2.0, on_error=None, taxon_urls=None, archive=None):
+    """
+    list_urls -> list jsons -> taxon urls -> scrape every taxon in its own coroutine
+
+    :param list_urls: urls of the taxon list pages (e.g. the bacteria_url, or one ecosystemClass_url per class)
+    :param save_dir: dir to write each taxon's json to (None to write nothing, e.g. when the taxa are packed)
+    :param get_taxon_urls: function(list_json) -> list of taxon urls
+    :param get_metadata: function(htmlSource) -> metadata_table_dict
+    :param get_enzyme_urls: function(taxon_url, htmlSource) -> dict of key ('genome' or datatype) -> enzyme_url or None
+    :param parse_enzyme_info: function(enzyme_json) -> enzyme_dict
+    :param taxon_id_key: metadata key naming the json file ('Taxon ID' or 'Taxon Object ID')
+    :param per_host: max number of requests in flight to any one host
+    :param taxa_in_flight: max number of taxon chains running at once
+    :param manifest: CrawlManifest to skip completed taxa with and record finished taxa in (see jgi_manifest), or None
+    :param cache: PageCache to answer fetches from (see jgi_cache), or None
+    :param delta: ListDelta selecting only added and changed taxa of the list jsons (see jgi_delta), or None
+    :param on_result: function(single taxon dict) called as each taxon finishes, instead of collecting them
+    :param limiter: RateLimiter every request goes through (see jgi_ratelimit), or None
+    :param retries: number of times a failing taxon is scraped again, after a jittered backoff (see jgi_retry)
+    :param retry_delay: seconds the backoff between retries starts at
+    :param on_error: function(taxon_url, exception) called when a taxon still fails after its retries, instead of stopping the crawl (e.g. Quarantine.add)
+    :param taxon_urls: urls of the taxa to scrape, instead of the ones listed by list_urls (e.g. to redrive quarantined taxa)
+    :param archive: ResponseArchive to append every body fetched to (see jgi_archive), or None
+    :returns: list of single taxon dicts, in the order the taxa finished (empty when on_result is given)
+    """
+
+    target = CrawlTarget(list_urls, save_dir, get_taxon_urls, get_metadata, get_enzyme_urls, parse_enzyme_info, taxon_id_key,
+        manifest=manifest, delta=delta, on_result=on_result, on_error=on_error, taxon_urls=taxon_urls)
+
+    return crawl_targets_async([target], per_host=per_host, taxa_in_flight=taxa_in_flight, cache=cache, limiter=limiter,
+        retries=retries, retry_delay=retry_delay, archive=archive)
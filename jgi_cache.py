@@ -0,0 +1,209 @@
+## jgi_cache
+"""
+On-disk page cache used under the fetchers of the scrape_*_from_jgi scripts.
+
+Bodies are stored zlib compressed under `cache_dir`, in a file named after
+the sha256 of their url. A small sqlite index (`cache_dir/index.sqlite`) keeps
+each entry's size, when it was fetched, when it was last used, and the ETag /
+Last-Modified headers it was served with.
+
+  - entries younger than `ttl` seconds are served without touching the network
+  - older entries are revalidated with If-None-Match / If-Modified-Since when
+    IMG sent an ETag or Last-Modified (a 304 just refreshes the entry)
+  - once the bodies take more than `max_bytes`, the least recently used
+    entries are evicted
+"""
+
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from jgi_metrics import METRICS
+
+class PageCache(object):
+    """
+    url -> compressed body cache with a ttl and a size-bounded lru eviction
+    """
+
+    def __init__(self, cache_dir, ttl=7*24*3600, max_bytes=10*1024**3):
+        """
+        :param cache_dir: dir to keep the cached bodies and their index in
+        :param ttl: seconds an entry is served without revalidation
+        :param max_bytes: max total size of the (compressed) bodies
+        """
+
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, url TEXT, size INTEGER, fetched_at REAL, last_used REAL, etag TEXT, last_modified TEXT)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+        ## how fetches were answered: 'hit' (fresh entry), 'revalidated' (304 Not Modified) or 'miss' (downloaded)
+        self.counts = {'hit': 0, 'revalidated': 0, 'miss': 0}
+
+    def key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def body_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, url):
+        """
+        :param url: url of the cached page
+        :returns: dict with 'body', 'fresh' (younger than ttl), 'etag' and 'last_modified', or None if url is not cached
+        """
+
+        key = self.key(url)
+
+        with self.lock:
+            row = self.db.execute('SELECT fetched_at, etag, last_modified FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+
+        try:
+            with open(self.body_path(key), 'rb') as infile:
+                body = zlib.decompress(infile.read()).decode('utf-8')
+        except (IOError, zlib.error):
+            self.discard(url)
+            return None
+
+        fetched_at, etag, last_modified = row
+
+        return {'body': body, 'fresh': time.time()-fetched_at < self.ttl, 'etag': etag, 'last_modified': last_modified}
+
+    def conditional_headers(self, entry):
+        """
+        :param entry: a stale entry returned by get
+        :returns: headers revalidating entry with the server
+        """
+
+        headers = dict()
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """
+        :param url: url of the page
+        :param body: text of the page
+        :param etag: ETag header it was served with, if any
+        :param last_modified: Last-Modified header it was served with, if any
+        """
+
+        key = self.key(url)
+        path = self.body_path(key)
+        data = zlib.compress(body.encode('utf-8'))
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = '%s.tmp.%d.%d'%(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as outfile:
+            outfile.write(data)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            self.total_bytes += len(data)-(row[0] if row else 0)
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)', (key, url, len(data), now, now, etag, last_modified))
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def refresh(self, url):
+        """
+        mark url's entry as just fetched (after the server answered 304 Not Modified)
+        """
+
+        now = time.time()
+        with self.lock:
+            self.db.execute('UPDATE entries SET fetched_at = ?, last_used = ? WHERE key = ?', (now, now, self.key(url)))
+
+    def discard(self, url):
+        """
+        drop url's entry, if any
+        """
+
+        key = self.key(url)
+        with self.lock:
+            row = self.db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.total_bytes -= row[0]
+        self.remove_body(key)
+
+    def remove_body(self, key):
+        try:
+            os.remove(self.body_path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        drop least recently used entries until the bodies take no more than 90% of max_bytes (call with self.lock held)
+        """
+
+        target = 0.9*self.max_bytes
+        while self.total_bytes > target:
+            rows = self.db.execute('SELECT key, size FROM entries ORDER BY last_used LIMIT 100').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.remove_body(key)
+                self.total_bytes -= size
+                if self.total_bytes <= target:
+                    break
+
+    def fresh_body(self, url):
+        """
+        :param url: url of the page
+        :returns: the cached body if url's entry is younger than ttl, otherwise None
+        """
+
+        entry = self.get(url)
+        if entry is None or not entry['fresh']:
+            return None
+
+        self.count('hit')
+
+        return entry['body']
+
+    def count(self, outcome):
+        """
+        :param outcome: how a fetch was answered, 'hit', 'revalidated' or 'miss'
+        """
+
+        with self.lock:
+            self.counts[outcome] += 1
+
+        METRICS.count('cache_'+outcome)
+
+    def close(self):
+        self.db.close()
+
+    def print_summary(self):
+        """
+        print how many fetches the cache answered
+        """
+
+        print("Page cache: %d fresh hits, %d revalidated, %d misses, %.1f MB on disk"%(
+            self.counts['hit'], self.counts['revalidated'], self.counts['miss'], self.total_bytes/1024.**2))
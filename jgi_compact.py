@@ -0,0 +1,336 @@
+## jgi_compact
+"""
+Compact, interned representation of the taxa of a crawl.
+
+Every taxon json repeats the full enzyme name and a string gene count for
+each of its ecs, so the same few thousand names are stored tens of thousands
+of times. Here each ec is stored once, in a global ec table, and each taxon
+keeps two parallel integer arrays per datatype: the ids of its ecs in the
+table and their gene counts.
+
+  OUT_DIR/ecs.json     {"gene_count_type": "str", "ecs": [[ec, enzymeName], ...]}  (an ec's id is its index)
+  OUT_DIR/taxa.jsonl   one line per taxon:
+                       {"metadata": {...}, "genome": [[ec_id, ...], [gene_count, ...]], ...}
+
+A taxon whose name for an ec differs from the table's keeps it under
+"names" ({ec_id: enzymeName}), and a gene count the array cannot give back
+exactly (e.g. '07', or a count that is not a number) keeps its raw value
+under "counts" ({datatype: {ec_id: genecount}}), so `expand_taxon` gives back
+exactly the dict the scrape_*_from_jgi scripts wrote (ec order, and string
+gene counts, included).
+
+Usage:
+  jgi_compact.py SOURCE OUT_DIR [options]
+  jgi_compact.py --expand OUT_DIR SAVE_DIR
+
+Arguments:
+  SOURCE   save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file (see jgi_output)
+  OUT_DIR  directory holding ecs.json and taxa.jsonl
+  SAVE_DIR directory to write <taxon_id>.json files back to
+
+Options:
+  --measure    also report the file size and in-memory size of SOURCE against the compact format
+"""
+
+import os
+import gc
+import json
+import tracemalloc
+from array import array
+from docopt import docopt
+from jgi_output import iter_taxa, taxon_id_of, enzyme_keys_of
+
+## keys of a compact taxon dict that are not datatypes
+COMPACT_KEYS = ('metadata', 'names', 'counts')
+
+## range of the 'q' gene count arrays
+GENE_COUNT_MIN = -2**63
+GENE_COUNT_MAX = 2**63-1
+
+class ECTable(object):
+    """
+    global table of ecs and their enzyme names; an ec's id is its index
+    """
+
+    def __init__(self, ecs=None, gene_count_type=None):
+        """
+        :param ecs: list of [ec, enzymeName] to start from, or None
+        :param gene_count_type: 'str' or 'int', the type gene counts are given back as (None until the first taxon is compacted)
+        """
+
+        self.ecs = list()
+        self.names = list()
+        self.ids = dict()
+        self.gene_count_type = gene_count_type
+
+        for ec, enzymeName in ecs or []:
+            self.intern(ec, enzymeName)
+
+    def intern(self, ec, enzymeName):
+        """
+        :returns: id of ec, adding it to the table if needed
+        """
+
+        ec_id = self.ids.get(ec)
+        if ec_id is None:
+            ec_id = self.ids[ec] = len(self.ecs)
+            self.ecs.append(ec)
+            self.names.append(enzymeName)
+
+        return ec_id
+
+    def __len__(self):
+        return len(self.ecs)
+
+def packed_count(genecount, gene_count_type):
+    """
+    :param genecount: gene count as scraped
+    :param gene_count_type: 'str' or 'int', the type expand_taxon gives gene counts back as
+    :returns: (value for the gene counts array, whether expand_taxon gives genecount back exactly from it)
+    """
+
+    try:
+        value = int(genecount)
+    except (TypeError, ValueError, OverflowError):
+        return 0, False
+
+    if not GENE_COUNT_MIN <= value <= GENE_COUNT_MAX:
+        return 0, False
+
+    if gene_count_type == 'str':
+        return value, isinstance(genecount, str) and str(value) == genecount
+
+    return value, type(genecount) is int
+
+def compact_taxon(single_dict, ec_table):
+    """
+    :param single_dict: single taxon dict ({'metadata': ..., datatype: {ec: [enzymeName, genecount]}, ...})
+    :param ec_table: ECTable to intern the taxon's ecs in
+    :returns: compact taxon dict ({'metadata': ..., datatype: (ec_ids array, gene_counts array), ...})
+    """
+
+    compact = {'metadata': single_dict['metadata']}
+    names = dict()
+    counts = dict()
+
+    for datatype in enzyme_keys_of(single_dict):
+
+        ec_ids = array('i')
+        gene_counts = array('q')
+
+        for ec, (enzymeName, genecount) in single_dict[datatype].items():
+
+            if ec_table.gene_count_type is None:
+                ec_table.gene_count_type = 'str' if isinstance(genecount, str) else 'int'
+
+            ec_id = ec_table.intern(ec, enzymeName)
+            if ec_table.names[ec_id] != enzymeName:
+                names[ec_id] = enzymeName
+
+            value, exact = packed_count(genecount, ec_table.gene_count_type)
+            if not exact:
+                counts.setdefault(datatype, dict())[ec_id] = genecount
+
+            ec_ids.append(ec_id)
+            gene_counts.append(value)
+
+        compact[datatype] = (ec_ids, gene_counts)
+
+    if names:
+        compact['names'] = names
+
+    if counts:
+        compact['counts'] = counts
+
+    return compact
+
+def expand_taxon(compact, ec_table):
+    """
+    :param compact: compact taxon dict (see compact_taxon)
+    :param ec_table: the ECTable it was compacted with
+    :returns: the single taxon dict it was compacted from
+    """
+
+    cast = str if ec_table.gene_count_type == 'str' else int
+    names = compact.get('names', {})
+
+    single_dict = {'metadata': compact['metadata']}
+
+    for datatype, value in compact.items():
+        if datatype in COMPACT_KEYS:
+            continue
+        ec_ids, gene_counts = value
+        counts = compact.get('counts', {}).get(datatype, {})
+        single_dict[datatype] = dict((ec_table.ecs[ec_id], [names.get(ec_id, ec_table.names[ec_id]),
+            counts[ec_id] if ec_id in counts else cast(gene_count)])
+            for ec_id, gene_count in zip(ec_ids, gene_counts))
+
+    return single_dict
+
+def dump_counts(counts):
+    """
+    :returns: the "counts" of a compact taxon with json (string) ec id keys
+    """
+
+    return dict((datatype, dict((str(ec_id), genecount) for ec_id, genecount in datatype_counts.items()))
+        for datatype, datatype_counts in counts.items())
+
+def load_counts(counts):
+    """
+    :returns: the "counts" of a compact taxon from its json form (see dump_counts)
+    """
+
+    return dict((datatype, dict((int(ec_id), genecount) for ec_id, genecount in datatype_counts.items()))
+        for datatype, datatype_counts in counts.items())
+
+def write_compact(source, out_dir):
+    """
+    source -> OUT_DIR/taxa.jsonl and OUT_DIR/ecs.json
+
+    :param source: save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file
+    :param out_dir: dir to write the compact files to
+    :returns: the ECTable
+    """
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    ec_table = ECTable()
+    n = 0
+
+    with open(os.path.join(out_dir, 'taxa.jsonl'), 'w') as outfile:
+        for single_dict in iter_taxa(source):
+
+            compact = compact_taxon(single_dict, ec_table)
+
+            line = dict()
+            for key, value in compact.items():
+                if key == 'metadata':
+                    line[key] = value
+                elif key == 'names':
+                    line[key] = dict((str(ec_id), enzymeName) for ec_id, enzymeName in value.items())
+                elif key == 'counts':
+                    line[key] = dump_counts(value)
+                else:
+                    line[key] = [value[0].tolist(), value[1].tolist()]
+
+            outfile.write(json.dumps(line, separators=(',', ':'))+'\n')
+            n += 1
+
+    with open(os.path.join(out_dir, 'ecs.json'), 'w') as outfile:
+        json.dump({'gene_count_type': ec_table.gene_count_type, 'ecs': [[ec, enzymeName] for ec, enzymeName in zip(ec_table.ecs, ec_table.names)]}, outfile)
+
+    print("Wrote %d taxa and %d ecs to %s"%(n, len(ec_table), out_dir))
+
+    return ec_table
+
+def read_ec_table(out_dir):
+    """
+    :param out_dir: dir written by write_compact
+    :returns: the ECTable
+    """
+
+    with open(os.path.join(out_dir, 'ecs.json')) as infile:
+        header = json.load(infile)
+
+    return ECTable(header['ecs'], gene_count_type=header['gene_count_type'])
+
+def iter_compact(out_dir):
+    """
+    :param out_dir: dir written by write_compact
+    :returns: generator of compact taxon dicts
+    """
+
+    with open(os.path.join(out_dir, 'taxa.jsonl')) as infile:
+        for line in infile:
+
+            line = json.loads(line)
+
+            compact = dict()
+            for key, value in line.items():
+                if key == 'metadata':
+                    compact[key] = value
+                elif key == 'names':
+                    compact[key] = dict((int(ec_id), enzymeName) for ec_id, enzymeName in value.items())
+                elif key == 'counts':
+                    compact[key] = load_counts(value)
+                else:
+                    compact[key] = (array('i', value[0]), array('q', value[1]))
+
+            yield compact
+
+def expand_compact(out_dir, save_dir):
+    """
+    OUT_DIR -> one <taxon_id>.json per taxon in save_dir, as written by the scrape_*_from_jgi scripts
+
+    :param out_dir: dir written by write_compact
+    :param save_dir: dir to write the jsons to
+    """
+
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    ec_table = read_ec_table(out_dir)
+
+    n = 0
+    for compact in iter_compact(out_dir):
+        single_dict = expand_taxon(compact, ec_table)
+        with open(os.path.join(save_dir, taxon_id_of(single_dict)+'.json'), 'w') as outfile:
+            json.dump(single_dict, outfile)
+        n += 1
+
+    print("Wrote %d taxa to %s"%(n, save_dir))
+
+def source_size(source):
+    """
+    :returns: bytes taken on disk by a save dir of jsons or a concatenated file
+    """
+
+    if os.path.isdir(source):
+        return sum(os.path.getsize(os.path.join(source, fname)) for fname in os.listdir(source) if fname.endswith('.json'))
+
+    return os.path.getsize(source)
+
+def traced_size(load):
+    """
+    :param load: function returning the object to measure
+    :returns: bytes allocated by load() that are still held by what it returns
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    loaded = load()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del loaded
+
+    return size
+
+def measure(source, out_dir):
+    """
+    print the file size and in-memory size of source against its compact form in out_dir
+    """
+
+    def load_compact():
+        ec_table = read_ec_table(out_dir)
+        return ec_table, list(iter_compact(out_dir))
+
+    json_bytes = source_size(source)
+    compact_bytes = sum(os.path.getsize(os.path.join(out_dir, fname)) for fname in ('taxa.jsonl', 'ecs.json'))
+
+    json_memory = traced_size(lambda: list(iter_taxa(source)))
+    compact_memory = traced_size(load_compact)
+
+    print("On disk:   %.1f MB as json, %.1f MB compact (%.1fx smaller)"%(json_bytes/1024.**2, compact_bytes/1024.**2, json_bytes/float(compact_bytes)))
+    print("In memory: %.1f MB as dicts, %.1f MB compact (%.1fx smaller)"%(json_memory/1024.**2, compact_memory/1024.**2, json_memory/float(compact_memory)))
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='jgi_compact 1.0')
+
+    if arguments['--expand']:
+        expand_compact(arguments['OUT_DIR'], arguments['SAVE_DIR'])
+    else:
+        write_compact(arguments['SOURCE'], arguments['OUT_DIR'])
+        if arguments['--measure']:
+            measure(arguments['SOURCE'], arguments['OUT_DIR'])
@@ -0,0 +1,345 @@
+## jgi_dataset
+"""
+Binary, memory-mapped dataset of the taxa of a crawl, to read any one taxon
+without loading (or json-parsing) the rest, however large the crawl is.
+
+One file, SAVE_DIR_dataset.bin, in native byte order:
+
+  header        magic, version, number of taxa and the offsets of the sections below
+  taxon data    for each taxon, as streamed from the source:
+                  its metadata as json (plus the enzyme names differing from the ec table and the raw
+                  gene counts the arrays cannot give back exactly, see jgi_compact)
+                  one block per datatype: datatype (see jgi_index.DATATYPES), number of ecs and the
+                  offset of its packed arrays, ec ids (int32) then gene counts (int64)
+  ec table      json, [[ec, enzymeName], ...] (an ec's id is its index) and the gene count type
+  taxon table   one fixed size entry per taxon, sorted by taxon id: offset and length of its
+                metadata, and offset and number of its blocks
+  taxon ids     sorted taxon ids (int64), parallel to the taxon table
+
+A reader maps the file read only and binary searches the taxon ids, so
+looking a taxon up touches a handful of pages, and processes reading the
+same dataset share its pages through the page cache. The source is read one
+taxon at a time (see jgi_output.iter_taxa), so a concatenated json of any
+size can be converted.
+
+Usage:
+  jgi_dataset.py SOURCE [DATASET]
+  jgi_dataset.py --get DATASET TAXON_ID
+
+Arguments:
+  SOURCE   save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file (see jgi_output)
+  DATASET  path of the dataset, SOURCE_dataset.bin by default
+  TAXON_ID Taxon ID / Taxon Object ID of the taxon to print
+"""
+
+import os
+import json
+import mmap
+import struct
+import bisect
+from array import array
+from docopt import docopt
+from jgi_output import CONCATENATED_FORMATS, iter_taxa, taxon_id_of
+from jgi_compact import COMPACT_KEYS, ECTable, compact_taxon, expand_taxon, dump_counts, load_counts
+from jgi_index import DATATYPES
+
+MAGIC = b'JGIDSET\x00'
+VERSION = 1
+
+## magic, version, number of taxa, ec table offset and length, taxon table offset, taxon ids offset
+HEADER = struct.Struct('=8sIIQQQQ')
+HEADER_BYTES = 64
+
+## metadata offset, metadata length, number of blocks, blocks offset
+TAXON_ENTRY = struct.Struct('=QIIQ')
+
+## datatype, number of ecs, arrays offset
+BLOCK = struct.Struct('=IIQ')
+
+## as compacted by jgi_compact.compact_taxon
+EC_ID_TYPE = 'i'
+GENE_COUNT_TYPE = 'q'
+EC_ID_BYTES = array(EC_ID_TYPE).itemsize
+GENE_COUNT_BYTES = array(GENE_COUNT_TYPE).itemsize
+
+def dataset_path(source):
+    """
+    :param source: save dir (or concatenated file) of a crawl; the dataset is written next to it
+    :returns: path of its dataset
+    """
+
+    source = source.rstrip('/')
+
+    ## only a concatenated file's own suffix is dropped, so a dotted save dir (e.g. runs/v1.2) keeps its name
+    for fmt in CONCATENATED_FORMATS:
+        if source.endswith('.'+fmt):
+            source = source[:-len('.'+fmt)]
+            break
+
+    return source+'_dataset.bin'
+
+def pad(outfile):
+    """
+    pad outfile with zeros up to the next multiple of 8 bytes, so the arrays after it are aligned
+    """
+
+    outfile.write(b'\x00'*(-outfile.tell()%8))
+
+def write_dataset(source, path=None):
+    """
+    source -> binary dataset
+
+    :param source: save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file
+    :param path: path of the dataset, dataset_path(source) by default
+    :returns: path
+    """
+
+    path = path or dataset_path(source)
+
+    ec_table = ECTable()
+    ## taxon id -> taxon table entry; a taxon found twice (e.g. in a concatenated file of several runs) keeps its last one
+    entries = dict()
+
+    tmp_path = '%s.tmp.%d'%(path, os.getpid())
+
+    with open(tmp_path, 'wb') as outfile:
+
+        outfile.write(b'\x00'*HEADER_BYTES)
+
+        for single_dict in iter_taxa(source):
+
+            compact = compact_taxon(single_dict, ec_table)
+
+            meta = {'metadata': compact['metadata']}
+            if 'names' in compact:
+                meta['names'] = dict((str(ec_id), enzymeName) for ec_id, enzymeName in compact['names'].items())
+            if 'counts' in compact:
+                meta['counts'] = dump_counts(compact['counts'])
+            data = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+
+            metadata_offset = outfile.tell()
+            outfile.write(data)
+            pad(outfile)
+
+            datatypes = [key for key in compact if key not in COMPACT_KEYS]
+
+            ## the arrays go right after the blocks pointing at them
+            blocks_offset = outfile.tell()
+            arrays_offset = blocks_offset+BLOCK.size*len(datatypes)
+            blocks = list()
+            for datatype in datatypes:
+                ec_ids, gene_counts = compact[datatype]
+                blocks.append(BLOCK.pack(DATATYPES.index(datatype), len(ec_ids), arrays_offset))
+                arrays_offset += len(ec_ids)*ec_ids.itemsize
+                arrays_offset += -arrays_offset%8+len(gene_counts)*gene_counts.itemsize
+
+            outfile.write(b''.join(blocks))
+            for datatype in datatypes:
+                ec_ids, gene_counts = compact[datatype]
+                outfile.write(ec_ids.tobytes())
+                pad(outfile)
+                outfile.write(gene_counts.tobytes())
+
+            pad(outfile)
+
+            entries[int(taxon_id_of(single_dict))] = (metadata_offset, len(data), len(datatypes), blocks_offset)
+
+        ecs_offset = outfile.tell()
+        data = json.dumps({'gene_count_type': ec_table.gene_count_type,
+            'ecs': [[ec, enzymeName] for ec, enzymeName in zip(ec_table.ecs, ec_table.names)]}).encode('utf-8')
+        outfile.write(data)
+        pad(outfile)
+
+        taxon_ids = sorted(entries)
+
+        table_offset = outfile.tell()
+        outfile.write(b''.join(TAXON_ENTRY.pack(*entries[taxon_id]) for taxon_id in taxon_ids))
+
+        ids_offset = outfile.tell()
+        outfile.write(array('q', taxon_ids).tobytes())
+
+        outfile.seek(0)
+        outfile.write(HEADER.pack(MAGIC, VERSION, len(taxon_ids), ecs_offset, len(data), table_offset, ids_offset))
+
+    os.replace(tmp_path, path)
+
+    print("Wrote %d taxa and %d ecs to %s (%.1f MB)"%(len(taxon_ids), len(ec_table), path, os.path.getsize(path)/1024.**2))
+
+    return path
+
+class TaxonDataset(object):
+    """
+    read taxa out of a memory-mapped dataset, one at a time
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of a dataset written by write_dataset
+        """
+
+        self.path = path
+
+        with open(path, 'rb') as infile:
+            self.mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n_taxa, ecs_offset, ecs_length, self.table_offset, ids_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError("%s is not a version %d taxon dataset"%(path, VERSION))
+
+        header = json.loads(self.mm[ecs_offset:ecs_offset+ecs_length].decode('utf-8'))
+        self.ec_table = ECTable(header['ecs'], gene_count_type=header['gene_count_type'])
+
+        self.view = memoryview(self.mm)
+        self.ids = self.view[ids_offset:ids_offset+8*self.n_taxa].cast('q')
+
+    def __len__(self):
+        return self.n_taxa
+
+    def locate(self, taxon_id):
+        """
+        :returns: index of taxon_id in the taxon table, or None if it is not in the dataset
+        """
+
+        taxon_id = int(taxon_id)
+        i = bisect.bisect_left(self.ids, taxon_id)
+
+        return i if i < self.n_taxa and self.ids[i] == taxon_id else None
+
+    def __contains__(self, taxon_id):
+        return self.locate(taxon_id) is not None
+
+    def taxon_ids(self):
+        """
+        :returns: generator of the taxon ids in the dataset, sorted
+        """
+
+        for taxon_id in self.ids:
+            yield str(taxon_id)
+
+    def entry(self, taxon_id):
+
+        i = self.locate(taxon_id)
+        if i is None:
+            raise KeyError("No taxon %s in %s"%(taxon_id, self.path))
+
+        return TAXON_ENTRY.unpack_from(self.mm, self.table_offset+i*TAXON_ENTRY.size)
+
+    def read_meta(self, entry):
+
+        metadata_offset, metadata_length, n_blocks, blocks_offset = entry
+
+        return json.loads(self.mm[metadata_offset:metadata_offset+metadata_length].decode('utf-8'))
+
+    def metadata(self, taxon_id):
+        """
+        :param taxon_id: Taxon ID / Taxon Object ID of a taxon
+        :returns: its metadata dict
+        """
+
+        return self.read_meta(self.entry(taxon_id))['metadata']
+
+    def read_arrays(self, entry):
+
+        metadata_offset, metadata_length, n_blocks, blocks_offset = entry
+
+        arrays = dict()
+        for b in range(n_blocks):
+            code, n, offset = BLOCK.unpack_from(self.mm, blocks_offset+b*BLOCK.size)
+            ids_end = offset+n*EC_ID_BYTES
+            counts_offset = ids_end+(-ids_end)%8
+            arrays[DATATYPES[code]] = (self.view[offset:ids_end].cast(EC_ID_TYPE),
+                self.view[counts_offset:counts_offset+n*GENE_COUNT_BYTES].cast(GENE_COUNT_TYPE))
+
+        return arrays
+
+    def arrays(self, taxon_id, copy=False):
+        """
+        :param taxon_id: Taxon ID / Taxon Object ID of a taxon
+        :param copy: give copies (arrays) instead of views, to keep them past close
+        :returns: dict of datatype -> (ec ids, gene counts) of the taxon (ec ids index self.ec_table),
+            as views into the mapped file unless copy is set
+        """
+
+        arrays = self.read_arrays(self.entry(taxon_id))
+
+        if copy:
+            for datatype, (ec_ids, gene_counts) in arrays.items():
+                arrays[datatype] = (array(EC_ID_TYPE, ec_ids), array(GENE_COUNT_TYPE, gene_counts))
+                ec_ids.release()
+                gene_counts.release()
+
+        return arrays
+
+    def enzymes(self, taxon_id, datatype=None):
+        """
+        :param taxon_id: Taxon ID / Taxon Object ID of a taxon
+        :param datatype: 'genome', 'assembled', ..., or None for the taxon's first (a genome's only) datatype
+        :returns: list of (ec, gene_count) of the taxon, as ints (0 for a scraped count that is not a number; see get for the exact taxon)
+        """
+
+        arrays = self.arrays(taxon_id)
+        if not arrays:
+            return []
+
+        ec_ids, gene_counts = arrays[datatype] if datatype is not None else next(iter(arrays.values()))
+
+        return [(self.ec_table.ecs[ec_id], gene_count) for ec_id, gene_count in zip(ec_ids, gene_counts)]
+
+    def get(self, taxon_id):
+        """
+        :param taxon_id: Taxon ID / Taxon Object ID of a taxon
+        :returns: its single taxon dict, as written by the scrape_*_from_jgi scripts
+        """
+
+        entry = self.entry(taxon_id)
+        meta = self.read_meta(entry)
+
+        compact = {'metadata': meta['metadata']}
+        for datatype, (ec_ids, gene_counts) in self.read_arrays(entry).items():
+            compact[datatype] = (ec_ids, gene_counts)
+        if 'names' in meta:
+            compact['names'] = dict((int(ec_id), enzymeName) for ec_id, enzymeName in meta['names'].items())
+        if 'counts' in meta:
+            compact['counts'] = load_counts(meta['counts'])
+
+        return expand_taxon(compact, self.ec_table)
+
+    def iter_taxa(self):
+        """
+        :returns: generator of every single taxon dict in the dataset, by taxon id
+        """
+
+        for taxon_id in self.taxon_ids():
+            yield self.get(taxon_id)
+
+    def close(self):
+        """
+        unmap the dataset; while views given by arrays() are still alive, it is unmapped once the last of them is gone
+        """
+
+        self.ids.release()
+        try:
+            self.view.release()
+            self.mm.close()
+        except BufferError:
+            ## a view still held by a caller keeps the mapping; dropping ours lets it go with that view
+            pass
+        self.view = None
+        self.mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='jgi_dataset 1.0')
+
+    if arguments['--get']:
+        dataset = TaxonDataset(arguments['DATASET'])
+        print(json.dumps(dataset.get(arguments['TAXON_ID']), indent=1))
+        dataset.close()
+    else:
+        write_dataset(arguments['SOURCE'], arguments['DATASET'])
@@ -0,0 +1,112 @@
+## jgi_delta
+"""
+Incremental (delta) crawls driven by the taxon list json, used by the
+scrape_*_from_jgi scripts (`--incremental`).
+
+The list json returned for a domain (or ecosystem class) already has one row
+per taxon. Each row is hashed and compared to the snapshot of the previous
+crawl, `<save_dir>_list_snapshot.json` ({taxon_id: row hash}):
+
+  added      taxa not in the snapshot              -> scraped
+  changed    taxa whose row hash differs           -> scraped
+  unchanged  taxa whose row hash is the same       -> carried forward (their json is kept)
+  removed    taxa in the snapshot but not the list -> reported
+
+The snapshot is only rewritten at the end of a crawl, and only records taxa
+that are unchanged or were scraped successfully, so failed taxa show up as
+added/changed again next time.
+"""
+
+import os
+import json
+import hashlib
+from jgi_manifest import taxon_id_from_url, write_json_atomically
+
+def row_hash(row):
+    """
+    :param row: a record of the list json
+    :returns: hash of the row's fields
+    """
+
+    return hashlib.sha1(json.dumps(row, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ListDelta(object):
+    """
+    diff of this crawl's list json rows against the previous crawl's snapshot
+    """
+
+    def __init__(self, save_dir):
+        """
+        :param save_dir: dir the crawl writes its jsons to; the snapshot is written next to it
+        """
+
+        self.path = save_dir.rstrip('/')+'_list_snapshot.json'
+
+        self.previous = dict()
+        if os.path.exists(self.path):
+            with open(self.path) as infile:
+                self.previous = json.load(infile)
+
+        self.current = dict()
+        self.added = set()
+        self.changed = set()
+        self.unchanged = set()
+
+    def select(self, list_json):
+        """
+        diff the rows of list_json against the snapshot
+
+        :param list_json: list json (with a 'records' list) of a domain or ecosystem class
+        :returns: copy of list_json with only the added and changed records
+        """
+
+        records = list()
+
+        for row in list_json['records']:
+
+            taxon_id = taxon_id_from_url(row['GenomeNameSampleNameDisp'])
+            self.current[taxon_id] = row_hash(row)
+
+            if taxon_id not in self.previous:
+                self.added.add(taxon_id)
+            elif self.previous[taxon_id] != self.current[taxon_id]:
+                self.changed.add(taxon_id)
+            else:
+                self.unchanged.add(taxon_id)
+                continue
+
+            records.append(row)
+
+        print("List diff: %d added, %d changed, %d unchanged."%(len(self.added), len(self.changed), len(self.unchanged)))
+
+        selected_json = dict(list_json)
+        selected_json['records'] = records
+
+        return selected_json
+
+    def removed(self):
+        """
+        :returns: set of ids of the taxa in the snapshot that are no longer listed
+        """
+
+        return set(self.previous)-set(self.current)
+
+    def save(self, completed):
+        """
+        write the new snapshot (unchanged taxa, and added/changed taxa that were scraped) and report removed taxa
+
+        :param completed: set of ids of the taxa scraped successfully
+        """
+
+        snapshot = dict()
+        for taxon_id, current_hash in self.current.items():
+            if taxon_id in self.unchanged or taxon_id in completed:
+                snapshot[taxon_id] = current_hash
+            elif taxon_id in self.previous:
+                snapshot[taxon_id] = self.previous[taxon_id]
+
+        write_json_atomically(self.path, snapshot)
+
+        removed = self.removed()
+        if removed:
+            print("%d taxa are no longer listed (their jsons are kept): %s"%(len(removed), ', '.join(sorted(removed))))
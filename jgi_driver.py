@@ -0,0 +1,458 @@
+## jgi_driver
+"""
+Chrome driver profiles of the scrape_*_from_jgi scripts.
+
+The scripts only ever read the page source and json text of a page, so the
+images, stylesheets, fonts and tracking scripts chrome downloads for every
+IMG page are wasted time and memory. The driver of `activate_driver` is
+started with one of two profiles:
+
+  lean     headless, the 'eager' page load strategy (driver.get returns once the
+           document is parsed, the readiness checks of jgi_waits do the rest) and
+           every request for an image, stylesheet, font or tracker blocked
+  default  a plain, headed chrome, as the scripts used to start
+
+The profile, the page load strategy ('normal', 'eager' or 'none'), the path of
+chromedriver and extra chrome switches are set by `configure_driver`.
+
+Every page a ChromeFetcher loads is recorded here (see `record_page_load`):
+its load time and, every RSS_SAMPLE_PAGES pages, the resident memory of
+chrome (chromedriver and every browser process under it, summed, so shared
+pages count more than once) right after it. `print_driver_summary` reports both at the end of a run, so
+two runs with different profiles can be compared.
+
+A ChromeFetcher loads its pages through a DriverSession, which starts chrome
+on first use and quits it (starting a fresh one for the next page) after
+`max_pages` pages or once chrome's memory is past `max_rss_mb`, as chrome
+grows over tens of thousands of navigations. A page whose load kills the
+session (chrome crashed, or chromedriver is gone) is loaded again in a new
+chrome, so the taxon it belongs to is not lost. Every running chrome is
+quit when the process exits, also on a SIGTERM.
+"""
+
+import os
+import time
+import atexit
+import signal
+import threading
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from jgi_metrics import METRICS, Histogram
+
+PAGE_LOAD_STRATEGIES = ('normal', 'eager', 'none')
+
+DRIVER_PROFILES = {
+    'lean': {'headless': True, 'page_load_strategy': 'eager', 'block_resources': True},
+    'default': {'headless': False, 'page_load_strategy': 'normal', 'block_resources': False},
+}
+
+## url patterns blocked with the 'lean' profile (see Network.setBlockedURLs of the chrome devtools protocol)
+BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp', '*.bmp',
+    '*.css',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+]
+
+## chrome switches of the 'lean' profile
+LEAN_ARGUMENTS = [
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-dev-shm-usage',
+    '--disable-background-networking',
+    '--no-first-run',
+    '--mute-audio',
+    '--blink-settings=imagesEnabled=false',
+]
+
+## how activate_driver starts chrome, see configure_driver
+DRIVER_SETTINGS = {
+    'profile': 'lean',
+    'chromedriver': '~/chromedriver',
+    'page_load_strategy': None,
+    'arguments': [],
+    'max_pages': 1000,
+    'max_rss_mb': 2048,
+}
+
+## histogram of the seconds the pages loaded in chrome took, and the sum, count and max of chrome's resident memory (bytes) after them
+DRIVER_STATS = {
+    'load_times': Histogram(),
+    'rss_sum': 0,
+    'rss_count': 0,
+    'peak_rss': 0,
+}
+STATS_LOCK = threading.Lock()
+
+def configure_driver(profile=None, chromedriver=None, page_load_strategy=None, arguments=None, max_pages=None, max_rss_mb=None):
+    """
+    set how activate_driver starts chrome, and when a DriverSession recycles it
+
+    :param profile: 'lean' or 'default' (see DRIVER_PROFILES)
+    :param chromedriver: path of the chromedriver executable
+    :param page_load_strategy: 'normal', 'eager' or 'none', instead of the profile's
+    :param arguments: list of extra chrome command line switches, e.g. ['--window-size=1280,800']
+    :param max_pages: pages a chrome loads before it is recycled, 0 for no limit
+    :param max_rss_mb: memory in MB past which a chrome is recycled, 0 for no limit
+    """
+
+    quit_drivers_on_sigterm()
+
+    if profile is not None:
+        if profile not in DRIVER_PROFILES:
+            raise ValueError("Driver profile must be one of %s"%(sorted(DRIVER_PROFILES),))
+        DRIVER_SETTINGS['profile'] = profile
+
+    if chromedriver is not None:
+        DRIVER_SETTINGS['chromedriver'] = chromedriver
+
+    if page_load_strategy is not None:
+        if page_load_strategy not in PAGE_LOAD_STRATEGIES:
+            raise ValueError("Page load strategy must be one of %s"%(PAGE_LOAD_STRATEGIES,))
+        DRIVER_SETTINGS['page_load_strategy'] = page_load_strategy
+
+    if arguments is not None:
+        DRIVER_SETTINGS['arguments'] = list(arguments)
+
+    if max_pages is not None:
+        DRIVER_SETTINGS['max_pages'] = max_pages
+
+    if max_rss_mb is not None:
+        DRIVER_SETTINGS['max_rss_mb'] = max_rss_mb
+
+def chrome_options(profile, arguments=None):
+    """
+    :param profile: 'lean' or 'default'
+    :param arguments: list of extra chrome command line switches
+    :returns: webdriver.ChromeOptions of the profile
+    """
+
+    options = webdriver.ChromeOptions()
+
+    if DRIVER_PROFILES[profile]['headless']:
+        options.add_argument('--headless')
+
+    if DRIVER_PROFILES[profile]['block_resources']:
+        for argument in LEAN_ARGUMENTS:
+            options.add_argument(argument)
+        ## images are also turned off in the content settings, for chromes that ignore the blink setting
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+    for argument in arguments or []:
+        options.add_argument(argument)
+
+    return options
+
+def block_resources(driver):
+    """
+    block every request of driver matching BLOCKED_URLS
+
+    :param driver: a chrome driver object
+    """
+
+    ## execute_cdp_cmd needs selenium 3.14 or later; older drivers keep the content settings only
+    if hasattr(driver, 'execute_cdp_cmd'):
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+
+def start_driver():
+    """
+    start chrome with the settings of configure_driver
+
+    :returns: driver [object]
+    """
+
+    profile = DRIVER_SETTINGS['profile']
+    page_load_strategy = DRIVER_SETTINGS['page_load_strategy'] or DRIVER_PROFILES[profile]['page_load_strategy']
+
+    driver = webdriver.Chrome(executable_path=os.path.expanduser(DRIVER_SETTINGS['chromedriver']),
+        options=chrome_options(profile, DRIVER_SETTINGS['arguments']),
+        desired_capabilities={'pageLoadStrategy': page_load_strategy})
+
+    if DRIVER_PROFILES[profile]['block_resources']:
+        block_resources(driver)
+
+    return driver
+
+def process_tree(pid):
+    """
+    :param pid: id of a process
+    :returns: list of the ids of pid and every process under it (linux only, empty elsewhere)
+    """
+
+    children = dict()
+    for name in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat'%name) as infile:
+                ## the command name in parentheses may hold spaces; the parent id is the 2nd field after it
+                ppid = int(infile.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, list()).append(int(name))
+
+    tree = list()
+    todo = [pid]
+    while todo:
+        pid = todo.pop()
+        tree.append(pid)
+        todo.extend(children.get(pid, []))
+
+    return tree
+
+def browser_rss(driver):
+    """
+    :param driver: a chrome driver object
+    :returns: resident memory in bytes of chromedriver and every chrome process it started, or None if it cannot be read
+    """
+
+    try:
+        pid = driver.service.process.pid
+    except AttributeError:
+        return None
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+
+    rss = 0
+    for process in process_tree(pid):
+        try:
+            with open('/proc/%d/statm'%process) as infile:
+                rss += int(infile.read().split()[1])*page_size
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+
+    return rss or None
+
+def record_page_load(driver, seconds, sample_rss=True):
+    """
+    record a page loaded in chrome, and chrome's memory after it
+
+    :param driver: the chrome driver object that loaded it
+    :param seconds: time the load took (navigation and readiness wait)
+    :param sample_rss: whether to read chrome's memory after this page
+    :returns: chrome's memory in bytes, or None if it was not (or cannot be) read
+    """
+
+    METRICS.observe('chrome_page', seconds)
+
+    rss = browser_rss(driver) if sample_rss else None
+
+    with STATS_LOCK:
+        DRIVER_STATS['load_times'].observe(seconds)
+        if rss is not None:
+            DRIVER_STATS['rss_sum'] += rss
+            DRIVER_STATS['rss_count'] += 1
+            DRIVER_STATS['peak_rss'] = max(DRIVER_STATS['peak_rss'], rss)
+
+    return rss
+
+## pages between two reads of chrome's memory, as each read walks all of /proc
+RSS_SAMPLE_PAGES = 20
+
+## every DriverSession with a running chrome, quit at exit
+LIVE_SESSIONS = set()
+SESSIONS_LOCK = threading.Lock()
+
+class DriverSession(object):
+    """
+    a chrome started on first use, recycled after max_pages pages or past max_rss_mb (checked every
+    RSS_SAMPLE_PAGES pages), and restarted when it dies
+    """
+
+    def __init__(self, start=None, max_pages=None, max_rss_mb=None):
+        """
+        :param start: function returning a new chrome driver object (e.g. activate_driver), start_driver by default
+        :param max_pages: pages a chrome loads before it is recycled, 0 for no limit [default=DRIVER_SETTINGS['max_pages']]
+        :param max_rss_mb: memory in MB past which a chrome is recycled, 0 for no limit [default=DRIVER_SETTINGS['max_rss_mb']]
+        """
+
+        self.start = start or start_driver
+        self.max_pages = DRIVER_SETTINGS['max_pages'] if max_pages is None else max_pages
+        self.max_rss_mb = DRIVER_SETTINGS['max_rss_mb'] if max_rss_mb is None else max_rss_mb
+
+        self.current = None
+        self.pages = 0
+
+    def driver(self):
+        """
+        :returns: the running chrome driver object, started if there is none
+        """
+
+        if self.current is None:
+            self.current = self.start()
+            self.pages = 0
+            with SESSIONS_LOCK:
+                LIVE_SESSIONS.add(self)
+
+        return self.current
+
+    def alive(self):
+        """
+        :returns: False if chromedriver exited or no longer answers for its chrome
+        """
+
+        try:
+            if self.current.service.process.poll() is not None:
+                return False
+        except AttributeError:
+            pass
+
+        try:
+            self.current.window_handles
+        except Exception:
+            return False
+
+        return True
+
+    def timed_load(self, load, url, stage):
+        """
+        :returns: what load returned, recording the load (see record_page_load) and recycling chrome if it is due
+        """
+
+        driver = self.driver()
+
+        start = time.time()
+        try:
+            result = load(driver, url, stage)
+        finally:
+            ## a new chrome's first page is always sampled
+            rss = record_page_load(driver, time.time()-start, sample_rss=self.pages%RSS_SAMPLE_PAGES == 0)
+            self.pages += 1
+
+        ## recycled after a page that loaded, so a failed load still finds its chrome to tell whether it died
+        if (self.max_pages and self.pages >= self.max_pages) or (self.max_rss_mb and rss is not None and rss > self.max_rss_mb*1024**2):
+            METRICS.count('driver_recycles')
+            self.quit()
+
+        return result
+
+    def load(self, load, url, stage):
+        """
+        :param load: jgi_waits.load_page or jgi_waits.load_json
+        :param url: url to load
+        :param stage: stage it is loaded for
+        :returns: what load returned, loading url again in a new chrome if the session died under it
+        """
+
+        try:
+            return self.timed_load(load, url, stage)
+        except TimeoutException:
+            raise
+        except Exception:
+            if self.current is not None and self.alive():
+                raise
+
+        print("Chrome session died loading %s, restarting it"%url)
+        METRICS.count('driver_restarts')
+        self.quit()
+
+        return self.timed_load(load, url, stage)
+
+    def quit(self):
+        """
+        quit chrome, if it is running, killing whatever is left of it
+        """
+
+        if self.current is None:
+            return
+
+        driver, self.current = self.current, None
+        with SESSIONS_LOCK:
+            LIVE_SESSIONS.discard(self)
+
+        try:
+            tree = process_tree(driver.service.process.pid)
+        except AttributeError:
+            tree = list()
+
+        try:
+            driver.quit()
+        except Exception:
+            ## a dead session cannot be quit; its processes are killed below
+            pass
+
+        for pid in tree:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+def quit_all_drivers():
+    """
+    quit every chrome still running
+    """
+
+    with SESSIONS_LOCK:
+        sessions = list(LIVE_SESSIONS)
+
+    for session in sessions:
+        session.quit()
+
+atexit.register(quit_all_drivers)
+
+## id of the process quit_drivers_on_sigterm was called in
+SIGTERM_PID = list()
+
+def exit_on_sigterm(signum, frame):
+
+    if os.getpid() not in SIGTERM_PID:
+        ## a forked child (e.g. a reparse worker) dies as it would have
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+        return
+
+    raise SystemExit(128+signum)
+
+def quit_drivers_on_sigterm():
+    """
+    turn a SIGTERM into SystemExit, so the chromes are quit at exit instead of being left running
+    """
+
+    ## only the main thread can set signal handlers, and a handler set by the caller is kept
+    if threading.current_thread() is not threading.main_thread() or signal.getsignal(signal.SIGTERM) not in (signal.SIG_DFL, exit_on_sigterm):
+        return
+
+    SIGTERM_PID[:] = [os.getpid()]
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+def driver_summary():
+    """
+    :returns: dict with the number of pages loaded in chrome, their mean / p50 / p99 / max load seconds
+        (p50 and p99 are the upper bounds of their jgi_metrics.BUCKETS bucket), and the mean and peak
+        memory of a chrome after a page (bytes, None if it could not be read), or None if no page was loaded in chrome
+    """
+
+    with STATS_LOCK:
+        load_times = DRIVER_STATS['load_times'].summary()
+        mean_rss = DRIVER_STATS['rss_sum']/DRIVER_STATS['rss_count'] if DRIVER_STATS['rss_count'] else None
+        peak_rss = DRIVER_STATS['peak_rss'] or None
+
+    if not load_times['count']:
+        return None
+
+    return {
+        'pages': load_times['count'],
+        'mean': load_times['mean'],
+        'p50': load_times['p50'],
+        'p99': load_times['p99'],
+        'max': load_times['max'],
+        'mean_rss': mean_rss,
+        'peak_rss': peak_rss,
+    }
+
+def print_driver_summary():
+    """
+    print the load times of the pages loaded in chrome and chrome's memory
+    """
+
+    summary = driver_summary()
+    if summary is None:
+        return
+
+    page_load_strategy = DRIVER_SETTINGS['page_load_strategy'] or DRIVER_PROFILES[DRIVER_SETTINGS['profile']]['page_load_strategy']
+
+    print("Pages loaded in chrome ('%s' profile, '%s' page loads):"%(DRIVER_SETTINGS['profile'], page_load_strategy))
+    print("  n=%-7d mean=%6.2fs p50<=%6.2fs p99<=%6.2fs max=%6.2fs"%(summary['pages'], summary['mean'], summary['p50'], summary['p99'], summary['max']))
+    if summary['peak_rss'] is not None:
+        print("  chrome memory after a page: mean=%.0f MB peak=%.0f MB"%(summary['mean_rss']/1024.**2, summary['peak_rss']/1024.**2))
@@ -0,0 +1,352 @@
+## jgi_fetch
+"""
+Page fetch backends shared by the scrape_*_from_jgi scripts.
+
+A fetcher loads a page for a stage (see jgi_waits) and returns its html source
+(`load_page`) or, for YAHOO DataSource json endpoints, the parsed json
+(`load_json`). Two backends are available:
+
+  HttpFetcher    GETs pages and json endpoints directly over a pooled,
+                 keep-alive requests session. No browser is needed unless a
+                 page turns out to need javascript, in which case it falls
+                 back to a ChromeFetcher (started lazily, on first use).
+  ChromeFetcher  loads every page in chrome, waiting for it to be ready. Its
+                 chrome is started on first use, and recycled or restarted
+                 as needed (see jgi_driver.DriverSession).
+
+Both can be given a PageCache (see jgi_cache) to answer fetches from disk,
+a RateLimiter (see jgi_ratelimit) that every request they send goes through,
+and a ResponseArchive (see jgi_archive) every body they return is appended
+to. Every fetch is timed into its stage's histogram (see jgi_metrics).
+"""
+
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.common.exceptions import TimeoutException
+from jgi_waits import DATASOURCE_REGEX, STAGE_TIMEOUTS, load_page, load_json
+from jgi_metrics import METRICS
+from jgi_driver import DriverSession
+
+BACKENDS = ('http', 'chrome')
+
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0 Safari/537.36'
+
+def page_ready(htmlSource, stage):
+    """
+    check whether html fetched without a browser already has what stage needs
+
+    :param htmlSource: html source of the page
+    :param stage: one of 'homepage', 'list', 'taxon', or 'enzyme'
+    :returns: True if the page can be used as is, False if it needs javascript
+    """
+
+    if stage in ('list', 'enzyme'):
+        return DATASOURCE_REGEX.search(htmlSource) is not None
+    if stage == 'taxon':
+        return '<table' in htmlSource
+
+    return True
+
+def read_text(response, deadline):
+    """
+    read a streamed response's body, giving up at deadline (the timeout of requests only bounds each read, so a server trickling bytes could otherwise hold a worker forever)
+
+    :param response: response of a GET made with stream=True
+    :param deadline: time.time() past which to give up
+    :returns: the body text
+    """
+
+    chunks = list()
+
+    for chunk in response.iter_content(64*1024):
+        if time.time() > deadline:
+            response.close()
+            raise requests.exceptions.Timeout("Reading %s took longer than its deadline"%response.url)
+        chunks.append(chunk)
+
+    return b''.join(chunks).decode(response.encoding or 'utf-8', errors='replace')
+
+class ChromeFetcher(object):
+    """
+    load pages in chrome, waiting for each to be ready for its stage
+    """
+
+    def __init__(self, session, cache=None, limiter=None, archive=None):
+        """
+        :param session: DriverSession the pages are loaded in (see jgi_driver)
+        :param cache: PageCache to answer fetches from (see jgi_cache), or None
+        :param limiter: RateLimiter every page load goes through (see jgi_ratelimit), or None
+        :param archive: ResponseArchive to append every page and json loaded to (see jgi_archive), or None
+        """
+
+        self.session = session
+        self.cache = cache
+        self.limiter = limiter
+        self.archive = archive
+
+    def navigate(self, load, url, stage):
+        """
+        :param load: jgi_waits.load_page or jgi_waits.load_json
+        :returns: what load returned, after waiting for the rate limiter
+        """
+
+        if self.limiter is None:
+            return self.session.load(load, url, stage)
+
+        start = self.limiter.acquire(url)
+        timed_out = False
+        try:
+            return self.session.load(load, url, stage)
+        except TimeoutException:
+            timed_out = True
+            raise
+        finally:
+            self.limiter.release(url, stage, start, timed_out=timed_out)
+
+    def load_page(self, url, stage):
+        """
+        :param url: url of the page to load
+        :param stage: one of 'homepage', 'list', 'taxon', or 'enzyme'
+        :returns: html source of the page
+        """
+
+        with METRICS.timed(stage):
+            htmlSource = self.load_page_untimed(url, stage)
+
+        if self.archive is not None:
+            self.archive.add(url, stage, htmlSource)
+
+        return htmlSource
+
+    def load_page_untimed(self, url, stage):
+        """
+        untimed body of load_page
+        """
+
+        if self.cache is not None:
+            htmlSource = self.cache.fresh_body(url)
+            if htmlSource is not None:
+                return htmlSource
+
+        htmlSource = self.navigate(load_page, url, stage)
+
+        if self.cache is not None:
+            self.cache.count('miss')
+            self.cache.put(url, htmlSource)
+
+        return htmlSource
+
+    def load_json(self, url, stage):
+        """
+        :param url: url of a YAHOO DataSource json
+        :param stage: one of 'list_json' or 'enzyme_json'
+        :returns: the parsed json
+        """
+
+        with METRICS.timed(stage):
+            parsed_json = self.load_json_untimed(url, stage)
+
+        if self.archive is not None:
+            self.archive.add(url, stage, json.dumps(parsed_json))
+
+        return parsed_json
+
+    def load_json_untimed(self, url, stage):
+        """
+        untimed body of load_json
+        """
+
+        if self.cache is not None:
+            jsonSource = self.cache.fresh_body(url)
+            if jsonSource is not None:
+                with METRICS.timed('json_decode'):
+                    return json.loads(jsonSource)
+
+        parsed_json = self.navigate(load_json, url, stage)
+
+        if self.cache is not None:
+            self.cache.count('miss')
+            self.cache.put(url, json.dumps(parsed_json))
+
+        return parsed_json
+
+    def close(self):
+        self.session.quit()
+
+class HttpFetcher(object):
+    """
+    GET pages and json directly over a pooled, keep-alive http session
+    """
+
+    def __init__(self, pool_size=10, fallback=None, cache=None, limiter=None, archive=None):
+        """
+        :param pool_size: number of keep-alive connections to keep open per host
+        :param fallback: function returning a fetcher to use for pages that need javascript (e.g. a ChromeFetcher), or None to never fall back
+        :param cache: PageCache to answer fetches from and revalidate against (see jgi_cache), or None
+        :param limiter: RateLimiter every request goes through (see jgi_ratelimit), or None
+        :param archive: ResponseArchive to append every page and json loaded to (see jgi_archive), or None
+        """
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.make_fallback = fallback
+        self.fallback = None
+        self.cache = cache
+        self.limiter = limiter
+        self.archive = archive
+
+    def send(self, url, stage, headers):
+        """
+        GET url (after waiting for the rate limiter), giving up once STAGE_TIMEOUTS[stage] seconds have passed
+
+        :returns: the response, and its body text
+        """
+
+        start = self.limiter.acquire(url) if self.limiter is not None else None
+        deadline = time.time()+STAGE_TIMEOUTS[stage]
+        response = None
+        body = None
+        try:
+            response = self.session.get(url, timeout=STAGE_TIMEOUTS[stage], headers=headers, stream=True)
+            body = read_text(response, deadline)
+        finally:
+            if self.limiter is not None:
+                if body is not None:
+                    self.limiter.release(url, stage, start, status=response.status_code, retry_after=response.headers.get('Retry-After'))
+                else:
+                    ## timed out, or the connection failed: both count as server pressure
+                    self.limiter.release(url, stage, start, timed_out=True)
+
+        return response, body
+
+    def get(self, url, stage):
+        """
+        :param url: url to GET
+        :param stage: stage the url belongs to (sets the timeout, see jgi_waits.STAGE_TIMEOUTS)
+        :returns: body of the response (from the cache when it is fresh or the server answers 304 Not Modified)
+        """
+
+        with METRICS.timed(stage):
+            return self.get_untimed(url, stage)
+
+    def get_untimed(self, url, stage):
+        """
+        untimed body of get
+        """
+
+        entry = None
+        headers = dict()
+
+        if self.cache is not None:
+            entry = self.cache.get(url)
+            if entry is not None:
+                if entry['fresh']:
+                    self.cache.count('hit')
+                    return entry['body']
+                headers = self.cache.conditional_headers(entry)
+
+        response, body = self.send(url, stage, headers)
+
+        if entry is not None and response.status_code == 304:
+            self.cache.refresh(url)
+            self.cache.count('revalidated')
+            return entry['body']
+
+        response.raise_for_status()
+
+        if self.cache is not None:
+            self.cache.count('miss')
+            self.cache.put(url, body, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+
+        return body
+
+    def get_fallback(self, url, stage):
+        """
+        :returns: the fallback fetcher, starting it if needed
+        """
+
+        if self.make_fallback is None:
+            raise ValueError("Page at %s is not ready for stage '%s' without javascript and no fallback is set"%(url, stage))
+
+        if self.fallback is None:
+            print("Falling back to chrome for stage '%s' ..."%stage)
+            self.fallback = self.make_fallback()
+
+        METRICS.count('chrome_fallbacks')
+
+        return self.fallback
+
+    def load_page(self, url, stage):
+        """
+        :param url: url of the page to load
+        :param stage: one of 'homepage', 'list', 'taxon', or 'enzyme'
+        :returns: html source of the page
+        """
+
+        htmlSource = self.get(url, stage)
+
+        if not page_ready(htmlSource, stage):
+            if self.cache is not None:
+                self.cache.discard(url)
+            return self.get_fallback(url, stage).load_page(url, stage)
+
+        ## archived once accepted, so a page handed to the fallback is archived (by it) only as chrome loaded it
+        if self.archive is not None:
+            self.archive.add(url, stage, htmlSource)
+
+        return htmlSource
+
+    def load_json(self, url, stage):
+        """
+        :param url: url of a YAHOO DataSource json
+        :param stage: one of 'list_json' or 'enzyme_json'
+        :returns: the parsed json
+        """
+
+        jsonSource = self.get(url, stage)
+
+        try:
+            with METRICS.timed('json_decode'):
+                parsed_json = json.loads(jsonSource)
+        except ValueError:
+            if self.cache is not None:
+                self.cache.discard(url)
+            return self.get_fallback(url, stage).load_json(url, stage)
+
+        if self.archive is not None:
+            self.archive.add(url, stage, jsonSource)
+
+        return parsed_json
+
+    def close(self):
+        self.session.close()
+        if self.fallback is not None:
+            self.fallback.close()
+
+def make_fetcher(backend, activate_driver, chrome_fallback=True, cache=None, limiter=None, archive=None):
+    """
+    build the fetcher for a backend
+
+    :param backend: 'http' or 'chrome'
+    :param activate_driver: function returning a new chrome driver object
+    :param chrome_fallback: for the 'http' backend, fall back to chrome for pages that need javascript
+    :param cache: PageCache shared by the fetcher (and its chrome fallback), or None
+    :param limiter: RateLimiter shared by the fetcher (and its chrome fallback), or None
+    :param archive: ResponseArchive shared by the fetcher (and its chrome fallback), or None
+    :returns: fetcher object
+    """
+
+    if backend == 'chrome':
+        return ChromeFetcher(DriverSession(activate_driver), cache=cache, limiter=limiter, archive=archive)
+    elif backend == 'http':
+        fallback = (lambda: ChromeFetcher(DriverSession(activate_driver), cache=cache, limiter=limiter, archive=archive)) if chrome_fallback else None
+        return HttpFetcher(fallback=fallback, cache=cache, limiter=limiter, archive=archive)
+    else:
+        raise ValueError("Backend must be one of %s"%(BACKENDS,))
@@ -0,0 +1,351 @@
+## jgi_index
+"""
+Inverted index of a crawl, from ec to the taxa carrying it, to answer "which
+taxa have this ec, and how many genes for it" without opening every
+<taxon_id>.json of the save dir.
+
+  INDEX_DIR/index.json            the ecs (sorted), their enzyme names and where their postings are,
+                                  and the size and mtime of every json indexed
+  INDEX_DIR/postings-00000.bin    for each ec, in index.json order, its postings sorted by taxon id:
+                                  taxon ids (int64), datatypes (int8, see DATATYPES) and gene counts (int64),
+                                  as three packed arrays in native byte order
+
+The index is built next to the save dir (SAVE_DIR_ec_index) by a pool of
+processes, each reading a share of the jsons. Building it again over the
+same save dir only reads the jsons that were added or changed since (and
+drops the taxa whose json is gone), merges them with the postings already
+on disk and writes the next postings file; index.json is replaced last, so
+a reader sees either the old index or the new one.
+
+An ec query is either an ec ('1.1.1.1' or 'EC:1.1.1.1') or a prefix of the
+ec hierarchy ending in '*' ('1.1.*' for every ec in 1.1, '3.*'), answered
+from the sorted ecs with a binary search.
+
+Usage:
+  jgi_index.py SAVE_DIR [options]
+  jgi_index.py --ec=<ec> SAVE_DIR [options]
+
+Arguments:
+  SAVE_DIR  save dir of <taxon_id>.json files
+
+Options:
+  --index_dir=<id>    dir of the index, SAVE_DIR_ec_index by default
+  --processes=<p>    number of processes reading the jsons, one per core by default
+  --ec=<ec>    print the taxa carrying this ec, or every ec under a prefix like 1.1.*
+  --min_gene_count=<mg>    with --ec, only taxa with more than this many genes for it [default: 0]
+  --datatype=<dt>    with --ec, only this datatype, e.g. 'genome' or 'assembled'
+"""
+
+import os
+import json
+import mmap
+import time
+import bisect
+import multiprocessing
+from array import array
+from docopt import docopt
+from jgi_output import taxon_id_of, enzyme_keys_of
+
+DATATYPES = ('genome', 'assembled', 'unassembled', 'both')
+
+POSTINGS_PREFIX = 'postings-'
+POSTINGS_SUFFIX = '.bin'
+
+## bytes of one posting: its taxon id, datatype and gene count
+POSTING_BYTES = array('q').itemsize+array('b').itemsize+array('q').itemsize
+
+def index_path(save_dir):
+    """
+    :param save_dir: dir the crawl writes its jsons to; the index is written next to it
+    :returns: path of the crawl's ec index dir
+    """
+
+    return save_dir.rstrip('/')+'_ec_index'
+
+def normalize_ec(ec):
+    """
+    :returns: ec as IMG writes it, e.g. 'EC:1.1.1.1' for '1.1.1.1'
+    """
+
+    return ec if ec.startswith('EC:') else 'EC:'+ec
+
+def new_postings():
+    """
+    :returns: empty (taxon ids, datatypes, gene counts) arrays
+    """
+
+    return (array('q'), array('b'), array('q'))
+
+def read_jsons(args):
+    """
+    read a share of the jsons of a save dir into postings (run in a pool process)
+
+    :param args: (save_dir, list of json file names)
+    :returns: (dict of ec -> postings arrays, dict of ec -> enzyme name, dict of file name -> [mtime_ns, size, taxon_id])
+    """
+
+    save_dir, fnames = args
+
+    postings = dict()
+    names = dict()
+    files = dict()
+
+    for fname in fnames:
+
+        path = os.path.join(save_dir, fname)
+        stat = os.stat(path)
+        with open(path) as infile:
+            single_dict = json.load(infile)
+
+        taxon_id = taxon_id_of(single_dict)
+        files[fname] = [stat.st_mtime_ns, stat.st_size, taxon_id]
+
+        for datatype in enzyme_keys_of(single_dict):
+            for ec, (enzymeName, gene_count) in single_dict[datatype].items():
+                if ec not in postings:
+                    postings[ec] = new_postings()
+                    names[ec] = enzymeName
+                taxon_ids, datatypes, gene_counts = postings[ec]
+                taxon_ids.append(int(taxon_id))
+                datatypes.append(DATATYPES.index(datatype))
+                gene_counts.append(int(gene_count))
+
+    return postings, names, files
+
+class ECIndex(object):
+    """
+    read the postings of an ec index
+    """
+
+    def __init__(self, index_dir):
+        """
+        :param index_dir: dir written by build_index
+        """
+
+        self.index_dir = index_dir
+
+        with open(os.path.join(index_dir, 'index.json')) as infile:
+            header = json.load(infile)
+
+        self.files = header['files']
+        self.postings_name = header['postings']
+        self.ecs = [ec for ec, enzymeName, offset, count in header['ecs']]
+        self.entries = dict((ec, (enzymeName, offset, count)) for ec, enzymeName, offset, count in header['ecs'])
+
+        self.infile = open(os.path.join(index_dir, self.postings_name), 'rb')
+        ## an empty file cannot be mapped
+        self.data = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(self.infile.fileno()).st_size else b''
+
+    def enzyme_name(self, ec):
+        return self.entries[normalize_ec(ec)][0]
+
+    def postings(self, ec):
+        """
+        :param ec: e.g. 'EC:1.1.1.1' or '1.1.1.1'
+        :returns: (taxon ids, datatypes, gene counts) arrays of ec, sorted by taxon id (empty if ec is not indexed)
+        """
+
+        entry = self.entries.get(normalize_ec(ec))
+        if entry is None:
+            return new_postings()
+
+        enzymeName, offset, count = entry
+
+        postings = new_postings()
+        for values in postings:
+            end = offset+count*values.itemsize
+            values.frombytes(self.data[offset:end])
+            offset = end
+
+        return postings
+
+    def matching_ecs(self, query):
+        """
+        :param query: an ec, or a prefix of the ec hierarchy ending in '*' (e.g. '1.1.*')
+        :returns: sorted list of the indexed ecs it matches
+        """
+
+        query = normalize_ec(query)
+
+        if not query.endswith('*'):
+            return [query] if query in self.entries else []
+
+        prefix = query[:-1]
+        ## '1.1*' is taken as '1.1.*', so 1.10 does not match
+        if prefix != 'EC:' and not prefix.endswith('.'):
+            prefix += '.'
+
+        start = bisect.bisect_left(self.ecs, prefix)
+        end = start
+        while end < len(self.ecs) and self.ecs[end].startswith(prefix):
+            end += 1
+
+        return self.ecs[start:end]
+
+    def query(self, query, min_gene_count=0, datatype=None):
+        """
+        :param query: an ec, or a prefix of the ec hierarchy ending in '*' (e.g. '1.1.*')
+        :param min_gene_count: only taxa with more than this many genes for the ec
+        :param datatype: only this datatype ('genome', 'assembled', ...), or None for any
+        :returns: dict of ec -> list of (taxon_id, datatype, gene_count), by taxon_id
+        """
+
+        datatype_code = DATATYPES.index(datatype) if datatype is not None else None
+
+        results = dict()
+
+        for ec in self.matching_ecs(query):
+            taxon_ids, datatypes, gene_counts = self.postings(ec)
+            results[ec] = [(str(taxon_id), DATATYPES[code], gene_count) for taxon_id, code, gene_count in zip(taxon_ids, datatypes, gene_counts)
+                if gene_count > min_gene_count and (datatype_code is None or code == datatype_code)]
+
+        return results
+
+    def close(self):
+
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.infile.close()
+
+def write_index(index_dir, postings, names, files):
+    """
+    write postings to the next postings file of index_dir, then replace its index.json
+
+    :param postings: dict of ec -> (taxon ids, datatypes, gene counts) arrays, in any order
+    :param names: dict of ec -> enzyme name
+    :param files: dict of json file name -> [mtime_ns, size, taxon_id] of every taxon in postings
+    """
+
+    numbers = [int(name[len(POSTINGS_PREFIX):-len(POSTINGS_SUFFIX)]) for name in os.listdir(index_dir)
+        if name.startswith(POSTINGS_PREFIX) and name.endswith(POSTINGS_SUFFIX)]
+    postings_name = '%s%05d%s'%(POSTINGS_PREFIX, max(numbers)+1 if numbers else 0, POSTINGS_SUFFIX)
+
+    ecs = list()
+    offset = 0
+
+    with open(os.path.join(index_dir, postings_name), 'wb') as outfile:
+
+        for ec in sorted(postings):
+
+            taxon_ids, datatypes, gene_counts = postings[ec]
+            if not taxon_ids:
+                continue
+
+            order = sorted(range(len(taxon_ids)), key=lambda i: (taxon_ids[i], datatypes[i]))
+            for values in (taxon_ids, datatypes, gene_counts):
+                outfile.write(array(values.typecode, [values[i] for i in order]).tobytes())
+
+            ecs.append([ec, names[ec], offset, len(taxon_ids)])
+            offset += len(taxon_ids)*POSTING_BYTES
+
+    tmp_path = os.path.join(index_dir, 'index.json.tmp.%d'%os.getpid())
+    with open(tmp_path, 'w') as outfile:
+        json.dump({'postings': postings_name, 'ecs': ecs, 'files': files}, outfile)
+    os.replace(tmp_path, os.path.join(index_dir, 'index.json'))
+
+    ## postings files of earlier builds are no longer pointed at
+    for number in numbers:
+        os.remove(os.path.join(index_dir, '%s%05d%s'%(POSTINGS_PREFIX, number, POSTINGS_SUFFIX)))
+
+def build_index(save_dir, index_dir=None, processes=None):
+    """
+    build the ec index of a save dir, or bring an existing one up to date with it
+
+    :param save_dir: save dir of <taxon_id>.json files
+    :param index_dir: dir of the index, index_path(save_dir) by default
+    :param processes: number of processes reading the jsons, None for one per core
+    :returns: index_dir
+    """
+
+    index_dir = index_dir or index_path(save_dir)
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+
+    start = time.time()
+
+    current = dict()
+    for entry in os.scandir(save_dir):
+        if entry.name.endswith('.json') and entry.is_file():
+            stat = entry.stat()
+            current[entry.name] = (stat.st_mtime_ns, stat.st_size)
+
+    postings = dict()
+    names = dict()
+    files = dict()
+
+    if os.path.exists(os.path.join(index_dir, 'index.json')):
+
+        index = ECIndex(index_dir)
+
+        ## jsons indexed before and not touched since are kept as they are
+        files = dict((fname, value) for fname, value in index.files.items() if tuple(value[:2]) == current.get(fname))
+        ## taxa whose json changed or is gone
+        removed_ids = set(int(value[2]) for fname, value in index.files.items() if fname not in files)
+
+        for ec in index.ecs:
+            taxon_ids, datatypes, gene_counts = index.postings(ec)
+            if removed_ids:
+                kept = new_postings()
+                for i, taxon_id in enumerate(taxon_ids):
+                    if taxon_id not in removed_ids:
+                        kept[0].append(taxon_id)
+                        kept[1].append(datatypes[i])
+                        kept[2].append(gene_counts[i])
+                taxon_ids, datatypes, gene_counts = kept
+            postings[ec] = (taxon_ids, datatypes, gene_counts)
+            names[ec] = index.enzyme_name(ec)
+
+        dropped = len(index.files)-len(files)
+        index.close()
+
+    else:
+        dropped = 0
+
+    fnames = sorted(fname for fname in current if fname not in files)
+
+    if fnames:
+
+        processes = min(processes or os.cpu_count(), len(fnames))
+        ## small chunks keep every process busy to the end
+        chunksize = max(1, min(64, len(fnames)//(4*processes)))
+        chunks = [(save_dir, fnames[i:i+chunksize]) for i in range(0, len(fnames), chunksize)]
+
+        print("Indexing %d jsons of %s with %d processes ..."%(len(fnames), save_dir, processes))
+
+        pool = multiprocessing.get_context('fork').Pool(processes)
+
+        try:
+            for chunk_postings, chunk_names, chunk_files in pool.imap_unordered(read_jsons, chunks):
+                for ec, values in chunk_postings.items():
+                    if ec not in postings:
+                        postings[ec] = new_postings()
+                        names[ec] = chunk_names[ec]
+                    for merged, new in zip(postings[ec], values):
+                        merged.extend(new)
+                files.update(chunk_files)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    write_index(index_dir, postings, names, files)
+
+    print("Indexed %d taxa (%d new or changed, %d dropped) and %d ecs into %s in %.1fs"%(len(files), len(fnames), dropped,
+        sum(1 for values in postings.values() if values[0]), index_dir, time.time()-start))
+
+    return index_dir
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='jgi_index 1.0')
+
+    index_dir = arguments['--index_dir'] or index_path(arguments['SAVE_DIR'])
+
+    if arguments['--ec']:
+        index = ECIndex(index_dir)
+        results = index.query(arguments['--ec'], min_gene_count=int(arguments['--min_gene_count']), datatype=arguments['--datatype'])
+        for ec, postings in results.items():
+            for taxon_id, datatype, gene_count in postings:
+                print("%s\t%s\t%s\t%s"%(ec, taxon_id, datatype, gene_count))
+        index.close()
+    else:
+        build_index(arguments['SAVE_DIR'], index_dir=index_dir,
+            processes=int(arguments['--processes']) if arguments['--processes'] else None)
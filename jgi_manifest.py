@@ -0,0 +1,238 @@
+## jgi_manifest
+"""
+Checkpoint manifest of completed, failed and pending taxa, used by the
+scrape_*_from_jgi scripts to resume a crawl (`--resume`).
+
+The manifest is a json snapshot, `<save_dir>_manifest.json`:
+
+  {"completed": [taxon_id, ...], "failed": {taxon_id: error, ...}, "pending": [taxon_id, ...]}
+
+plus an append-only journal, `<save_dir>_manifest.json.log`, holding one json
+line per taxon finished since the snapshot. Each finished taxon only appends a
+line to the journal; every `checkpoint_every` taxa the snapshot is rewritten
+atomically (written to a temp file, then renamed over the old one) and the
+journal is emptied. Loading the manifest replays the journal on top of the
+snapshot (ignoring a torn last line), so it can be trusted without re-parsing
+any of the output jsons.
+"""
+
+import os
+import re
+import json
+import sqlite3
+import threading
+from jgi_metrics import METRICS
+
+TAXON_OID_REGEX = re.compile(r'taxon_oid=(\d+)')
+
+def taxon_id_from_url(taxon_url):
+    """
+    :param taxon_url: url for a single taxon
+    :returns: the taxon_oid in the url (the Taxon ID / Taxon Object ID its json is named after), or the url itself if it has none
+    """
+
+    match = TAXON_OID_REGEX.search(taxon_url)
+
+    return match.group(1) if match else taxon_url
+
+def write_json_atomically(path, obj):
+    """
+    write obj as json to a temp file next to path, then rename it over path
+
+    :param path: file to write
+    :param obj: json serializable object
+    """
+
+    tmp_path = '%s.tmp.%d'%(path, os.getpid())
+
+    with open(tmp_path, 'w') as outfile:
+        json.dump(obj, outfile)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.replace(tmp_path, path)
+
+def stored_taxon_ids(db_path):
+    """
+    :param db_path: a pack's index.sqlite (see jgi_pack) or a taxa database (see jgi_sqlite), both with a taxa table
+    :returns: set of the taxon ids in its taxa table, empty if there is no such database
+    """
+
+    if not os.path.exists(db_path):
+        return set()
+
+    db = sqlite3.connect(db_path)
+    try:
+        return set(str(taxon_id) for (taxon_id,) in db.execute('SELECT taxon_id FROM taxa'))
+    except sqlite3.DatabaseError:
+        return set()
+    finally:
+        db.close()
+
+def iter_taxon_jsons(save_dir, taxon_ids):
+    """
+    read the <taxon_id>.json of taxa scraped by earlier runs one at a time (e.g. to write the concatenated json of a resumed crawl)
+
+    :param save_dir: dir the jsons were written to
+    :param taxon_ids: ids of the taxa to read; ids without a json are skipped
+    :returns: generator of single taxon dicts
+    """
+
+    for taxon_id in sorted(taxon_ids):
+        fname = os.path.join(save_dir, taxon_id+'.json')
+        if os.path.exists(fname):
+            with open(fname) as infile:
+                yield json.load(infile)
+
+class CrawlManifest(object):
+    """
+    completed / failed / pending taxon ids of a crawl, checkpointed to disk
+    """
+
+    def __init__(self, save_dir, checkpoint_every=100):
+        """
+        :param save_dir: dir the crawl writes its jsons to; the manifest is written next to it
+        :param checkpoint_every: rewrite the snapshot (and empty the journal) after this many taxa finish
+        """
+
+        self.save_dir = save_dir
+        self.path = save_dir.rstrip('/')+'_manifest.json'
+        self.journal_path = self.path+'.log'
+        self.checkpoint_every = checkpoint_every
+
+        self.completed = set()
+        self.failed = dict()
+        self.pending = set()
+        self.previously_completed = set()
+
+        self.lock = threading.Lock()
+        self.journal = None
+        self.since_checkpoint = 0
+
+    def load(self, sqlite_path=None):
+        """
+        load the snapshot and replay the journal. If there is no manifest yet, every
+        taxon already written out is counted as completed: the <taxon_id>.json in
+        save_dir, the taxa of its pack (see jgi_pack) and those of the sqlite database.
+
+        :param sqlite_path: path of the crawl's sqlite database (see jgi_sqlite), or None
+        """
+
+        if os.path.exists(self.path):
+
+            with open(self.path) as infile:
+                snapshot = json.load(infile)
+
+            self.completed = set(snapshot['completed'])
+            self.failed = dict(snapshot['failed'])
+            self.pending = set(snapshot['pending'])
+
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path) as infile:
+                    for line in infile:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            ## torn last line of a crawl that died mid-write
+                            continue
+                        self.apply(entry)
+
+        else:
+
+            if os.path.isdir(self.save_dir):
+                self.completed = set(fname[:-len('.json')] for fname in os.listdir(self.save_dir) if fname.endswith('.json'))
+
+            ## the index of the pack of jgi_pack.pack_path (read here without zstandard)
+            self.completed |= stored_taxon_ids(os.path.join(self.save_dir.rstrip('/')+'_pack', 'index.sqlite'))
+
+            if sqlite_path:
+                self.completed |= stored_taxon_ids(sqlite_path)
+
+        self.previously_completed = set(self.completed)
+
+        print("Resuming crawl: %d taxa completed, %d failed, %d pending."%(len(self.completed), len(self.failed), len(self.pending)))
+
+    def apply(self, entry):
+        """
+        :param entry: journal entry, {'completed': taxon_id} or {'failed': taxon_id, 'error': error}
+        """
+
+        if 'completed' in entry:
+            taxon_id = entry['completed']
+            self.completed.add(taxon_id)
+            self.failed.pop(taxon_id, None)
+        else:
+            taxon_id = entry['failed']
+            self.failed[taxon_id] = entry['error']
+
+        self.pending.discard(taxon_id)
+
+    def start(self, taxon_urls):
+        """
+        record every taxon not yet completed as pending, and checkpoint
+
+        :param taxon_urls: list of all taxon urls of the crawl
+        :returns: list of the taxon urls still to scrape
+        """
+
+        todo_urls = [taxon_url for taxon_url in taxon_urls if taxon_id_from_url(taxon_url) not in self.completed]
+
+        with self.lock:
+            self.pending = set(taxon_id_from_url(taxon_url) for taxon_url in todo_urls)
+            self.checkpoint()
+
+        print("%d of %d taxa left to scrape."%(len(todo_urls), len(taxon_urls)))
+
+        return todo_urls
+
+    def record(self, entry):
+        """
+        apply a journal entry, append it to the journal, and checkpoint every checkpoint_every entries
+        """
+
+        with self.lock:
+
+            self.apply(entry)
+
+            if self.journal is None:
+                self.journal = open(self.journal_path, 'a')
+            self.journal.write(json.dumps(entry)+'\n')
+            self.journal.flush()
+
+            self.since_checkpoint += 1
+            if self.since_checkpoint >= self.checkpoint_every:
+                self.checkpoint()
+
+    def mark_completed(self, taxon_url):
+        METRICS.count('taxa_completed')
+        self.record({'completed': taxon_id_from_url(taxon_url)})
+
+    def mark_failed(self, taxon_url, error):
+        METRICS.count('taxa_failed')
+        self.record({'failed': taxon_id_from_url(taxon_url), 'error': repr(error)})
+
+    def checkpoint(self):
+        """
+        atomically rewrite the snapshot and empty the journal (call with self.lock held)
+        """
+
+        write_json_atomically(self.path, {
+            'completed': sorted(self.completed),
+            'failed': self.failed,
+            'pending': sorted(self.pending),
+        })
+
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_path, 'w')
+        self.since_checkpoint = 0
+
+    def close(self):
+        """
+        write a final checkpoint
+        """
+
+        with self.lock:
+            self.checkpoint()
+            self.journal.close()
+            self.journal = None
@@ -0,0 +1,259 @@
+## jgi_metrics
+"""
+Per-stage timing metrics of the scrape_*_from_jgi scripts (`--metrics`).
+
+Every stage of a crawl is timed into a latency histogram in METRICS:
+
+  homepage, list, taxon, enzyme   fetching the page (from the cache, over http or in chrome)
+  list_json, enzyme_json          fetching the YAHOO DataSource json
+  chrome_page                     a page or json loaded in chrome, navigation and readiness wait (see jgi_driver)
+  json_decode                     decoding a fetched json
+  metadata_parse                  parsing a taxon's metadata table (see jgi_parse)
+  link_extract                    extracting a taxon's enzyme page links (see jgi_parse)
+  write                           writing a taxon's json
+  concatenated_write              appending a taxon to the concatenated file (see jgi_output)
+  archive_write                   appending a response to the archive (see jgi_archive)
+  pack_write                      appending a taxon to the pack (see jgi_pack)
+  sqlite_insert                   inserting a batch of taxa into the sqlite database (see jgi_sqlite)
+  sqlite_index                    building its indexes at the end of the load
+
+alongside counters of taxa completed / failed / retried / quarantined, cache
+hits and misses, rate limiter back offs, and chromes recycled / restarted
+(see jgi_driver).
+
+A MetricsReporter rewrites a report file every `interval` seconds (and once
+more at the end of the crawl), atomically, either as json:
+
+  {"time": ..., "elapsed": ..., "stages": {stage: {"count", "sum", "mean", "max", "p50", "p90", "p99", "buckets": {le: count}}}, "counters": {...}}
+
+or, for a path ending in .prom, in the Prometheus text format (histogram
+`jgi_stage_seconds{stage=...}` and one `jgi_<counter>_total` per counter),
+e.g. for node_exporter's textfile collector.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+## upper bounds (seconds) of the histogram buckets; the last bucket is +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class Histogram(object):
+    """
+    latency histogram of one stage
+    """
+
+    def __init__(self):
+
+        self.counts = [0]*(len(BUCKETS)+1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        :param q: quantile, e.g. 0.9
+        :returns: upper bound of the bucket holding the q quantile (the max for the +Inf bucket)
+        """
+
+        rank = q*self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+
+        return self.max
+
+    def merge(self, other):
+        """
+        add the observations of another Histogram (e.g. one recorded in a reparse process) to this one
+        """
+
+        self.counts = [a+b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum/self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict((str(bound), count) for bound, count in zip(list(BUCKETS)+['+Inf'], self.counts)),
+        }
+
+class Metrics(object):
+    """
+    stage latency histograms and counters, safe to update from any thread
+    """
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.histograms = dict()
+        self.counters = dict()
+        self.started_at = time.time()
+
+    def observe(self, stage, seconds):
+        """
+        :param stage: name of the stage
+        :param seconds: time the stage took
+        """
+
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        time the body of a with block into stage's histogram (also when it raises)
+        """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.time()-start)
+
+    def count(self, name, n=1):
+        """
+        :param name: name of the counter
+        :param n: amount to add to it
+        """
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0)+n
+
+    def merge(self, histograms, counters):
+        """
+        add the histograms and counters of another Metrics (e.g. of a reparse process, see jgi_archive) to these
+
+        :param histograms: dict of stage -> Histogram
+        :param counters: dict of name -> count
+        """
+
+        with self.lock:
+            for stage, histogram in histograms.items():
+                self.histograms.setdefault(stage, Histogram()).merge(histogram)
+            for name, n in counters.items():
+                self.counters[name] = self.counters.get(name, 0)+n
+
+    def reset(self):
+
+        with self.lock:
+            self.histograms = dict()
+            self.counters = dict()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """
+        :returns: the json report (see the module docstring)
+        """
+
+        with self.lock:
+            return {
+                'time': time.time(),
+                'elapsed': time.time()-self.started_at,
+                'stages': dict((stage, histogram.summary()) for stage, histogram in self.histograms.items()),
+                'counters': dict(self.counters),
+            }
+
+    def prometheus(self):
+        """
+        :returns: the report in the Prometheus text exposition format
+        """
+
+        lines = ['# HELP jgi_stage_seconds Time spent in each stage of the crawl.', '# TYPE jgi_stage_seconds histogram']
+
+        with self.lock:
+
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(list(BUCKETS)+['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append('jgi_stage_seconds_bucket{stage="%s",le="%s"} %d'%(stage, bound, cumulative))
+                lines.append('jgi_stage_seconds_sum{stage="%s"} %f'%(stage, histogram.sum))
+                lines.append('jgi_stage_seconds_count{stage="%s"} %d'%(stage, histogram.count))
+
+            for name, value in sorted(self.counters.items()):
+                lines.append('# TYPE jgi_%s_total counter'%name)
+                lines.append('jgi_%s_total %d'%(name, value))
+
+            lines.append('# TYPE jgi_elapsed_seconds gauge')
+            lines.append('jgi_elapsed_seconds %f'%(time.time()-self.started_at))
+
+        return '\n'.join(lines)+'\n'
+
+## metrics of the running crawl
+METRICS = Metrics()
+
+class MetricsReporter(object):
+    """
+    rewrite a report of METRICS every interval seconds from a background thread
+    """
+
+    def __init__(self, path, interval=60.0, metrics=METRICS):
+        """
+        :param path: file to write; Prometheus text format if it ends in .prom, json otherwise
+        :param interval: seconds between reports
+        :param metrics: the Metrics to report
+        """
+
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self.fmt = 'prometheus' if path.endswith('.prom') else 'json'
+
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='jgi-metrics')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+
+        while not self.stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """
+        atomically rewrite the report
+        """
+
+        if self.fmt == 'prometheus':
+            text = self.metrics.prometheus()
+        else:
+            text = json.dumps(self.metrics.snapshot(), indent=1, sort_keys=True)
+
+        tmp_path = '%s.tmp.%d'%(self.path, os.getpid())
+        with open(tmp_path, 'w') as outfile:
+            outfile.write(text)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        """
+        stop the thread and write the final report
+        """
+
+        self.stop.set()
+        self.thread.join()
+        self.write()
+
+        print("Wrote stage metrics to %s"%self.path)
@@ -0,0 +1,325 @@
+## jgi_output
+"""
+Streaming concatenated output of the scrape_*_from_jgi scripts.
+
+Instead of holding every taxon in memory until the end of a crawl, each
+single taxon dict is appended to the concatenated file as soon as it is
+scraped, and flushed. Two formats are written:
+
+  json   `<save_dir>_concatenated.json`, a json array with one taxon per line
+         (loadable with json.load, same as before)
+  jsonl  `<save_dir>_concatenated.jsonl`, json lines, one taxon per line
+
+`iter_concatenated` reads either format back one taxon at a time, so memory
+stays flat however large the file is (`iter_taxa` does the same for a save
+dir of <taxon_id>.json files). A file cut short by a crash (an array
+without its closing bracket, or a torn last line) is read up to its last
+complete taxon.
+
+`iter_records` is the reading API for analysis scripts: it finds the taxa
+of a crawl wherever they were written (per-taxon jsons, a pack or the
+concatenated file), filters them by domain and datatype, and projects each
+one down to its metadata or its ecs as it is read.
+"""
+
+import os
+import json
+import threading
+from jgi_metrics import METRICS
+
+CONCATENATED_FORMATS = ('json', 'jsonl')
+
+## domain of the scrape_domains_from_jgi crawls -> 'Domain' of a taxon's metadata
+DOMAIN_NAMES = {'archaea': 'Archaea', 'bacteria': 'Bacteria', 'eukarya': 'Eukaryota', 'metagenomes': 'Metagenome'}
+
+## fields iter_records can project taxa down to
+PROJECTIONS = (None, 'metadata', 'ecs')
+
+def concatenated_path(save_dir, fmt='json'):
+    """
+    :param save_dir: dir the crawl writes its jsons to; the concatenated file is written next to it
+    :param fmt: 'json' or 'jsonl'
+    :returns: path of the concatenated file
+    """
+
+    if fmt not in CONCATENATED_FORMATS:
+        raise ValueError("Concatenated format must be one of %s"%(CONCATENATED_FORMATS,))
+
+    return save_dir.rstrip('/')+'_concatenated.'+fmt
+
+class ConcatenatedWriter(object):
+    """
+    append single taxon dicts to the concatenated file as they are scraped
+    """
+
+    def __init__(self, save_dir, fmt='json'):
+        """
+        :param save_dir: dir the crawl writes its jsons to; the concatenated file is written next to it
+        :param fmt: 'json' (streamed json array) or 'jsonl' (json lines)
+        """
+
+        self.path = concatenated_path(save_dir, fmt)
+        self.fmt = fmt
+        self.count = 0
+        self.lock = threading.Lock()
+
+        self.outfile = open(self.path, 'w')
+        if fmt == 'json':
+            self.outfile.write('[')
+            self.outfile.flush()
+
+    def write(self, record):
+        """
+        :param record: single taxon dict
+        """
+
+        line = json.dumps(record)
+
+        with self.lock, METRICS.timed('concatenated_write'):
+            if self.fmt == 'json':
+                self.outfile.write((',\n' if self.count else '\n')+line)
+            else:
+                self.outfile.write(line+'\n')
+            self.outfile.flush()
+            self.count += 1
+
+    def write_all(self, records):
+        """
+        :param records: iterable of single taxon dicts (e.g. taxa carried over from an earlier crawl)
+        """
+
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        """
+        close the json array (if any) and the file
+        """
+
+        with self.lock:
+            if self.fmt == 'json':
+                self.outfile.write('\n]\n')
+            self.outfile.close()
+
+        print("Wrote %d taxa to %s"%(self.count, self.path))
+
+def iter_json_array(infile, chunk_size=1024**2):
+    """
+    :param infile: open file holding a json array of objects
+    :param chunk_size: number of characters to read at a time
+    :returns: generator of the array's items, stopping at the last complete item if the array is cut short
+    """
+
+    decoder = json.JSONDecoder()
+    buf = infile.read(chunk_size).lstrip()
+
+    if not buf:
+        return
+    if buf[0] != '[':
+        raise ValueError("%s does not hold a json array"%infile.name)
+
+    pos = 1
+    eof = False
+
+    while True:
+
+        ## skip the separators up to the next item
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buf) and buf[pos] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                ## array cut short by a crash
+                return
+            chunk = infile.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:]+chunk
+            pos = 0
+            continue
+
+        yield item
+
+        pos = end
+
+def iter_json_lines(infile):
+    """
+    :param infile: open json lines file
+    :returns: generator of the file's items, skipping a torn last line
+    """
+
+    for line in infile:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            ## torn last line of a crawl that died mid-write
+            continue
+
+def iter_concatenated(path):
+    """
+    read a concatenated file (json array or json lines) one taxon at a time
+
+    :param path: path of a <save_dir>_concatenated.json or .jsonl
+    :returns: generator of single taxon dicts
+    """
+
+    with open(path) as infile:
+
+        head = infile.read(64).lstrip()
+        infile.seek(0)
+
+        if head.startswith('['):
+            for record in iter_json_array(infile):
+                yield record
+        else:
+            for record in iter_json_lines(infile):
+                yield record
+
+def iter_taxa(source):
+    """
+    read the taxa of a crawl one at a time
+
+    :param source: a save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file
+    :returns: generator of single taxon dicts
+    """
+
+    if os.path.isdir(source):
+        for fname in sorted(os.listdir(source)):
+            if fname.endswith('.json'):
+                with open(os.path.join(source, fname)) as infile:
+                    yield json.load(infile)
+    else:
+        for record in iter_concatenated(source):
+            yield record
+
+def taxon_id_of(single_dict):
+    """
+    :param single_dict: single taxon dict
+    :returns: the id its json is named after, 'Taxon ID' for genomes or 'Taxon Object ID' for metagenomes
+    """
+
+    return single_dict['metadata']['Taxon ID' if 'genome' in single_dict else 'Taxon Object ID']
+
+def enzyme_keys_of(single_dict):
+    """
+    :param single_dict: single taxon dict
+    :returns: keys of its enzyme dicts, 'genome' for genomes or the datatypes ('assembled', ...) for metagenomes
+    """
+
+    return [key for key in single_dict if key != 'metadata']
+
+def taxon_domain(single_dict):
+    """
+    :param single_dict: single taxon dict
+    :returns: its 'Domain' metadata ('Archaea', 'Bacteria', 'Eukaryota'), 'Metagenome' for metagenomes, or None
+    """
+
+    if 'Domain' in single_dict['metadata']:
+        return single_dict['metadata']['Domain']
+
+    return 'Metagenome' if 'genome' not in single_dict else None
+
+def project(single_dict, fields=None, datatype=None):
+    """
+    :param single_dict: single taxon dict
+    :param fields: None for the whole taxon, 'metadata' for its metadata only, or 'ecs' for its enzyme dicts
+        only (with its id left in its metadata, for taxon_id_of)
+    :param datatype: keep only this enzyme dict ('genome', 'assembled', ...), or None for all of them
+    :returns: the projected taxon dict, or None if it has no datatype enzyme dict
+    """
+
+    if datatype is not None and datatype not in single_dict:
+        return None
+
+    if fields == 'metadata':
+        return {'metadata': single_dict['metadata']}
+
+    if fields == 'ecs':
+        id_key = 'Taxon ID' if 'genome' in single_dict else 'Taxon Object ID'
+        record = {'metadata': {id_key: single_dict['metadata'][id_key]}}
+    else:
+        record = {'metadata': single_dict['metadata']}
+
+    for key in enzyme_keys_of(single_dict):
+        if datatype is None or key == datatype:
+            record[key] = single_dict[key]
+
+    return record
+
+def iter_pack(pack_dir):
+    """
+    :param pack_dir: dir of a TaxonPack (see jgi_pack)
+    :returns: generator of its single taxon dicts
+    """
+
+    ## jgi_pack needs zstandard, and imports this module
+    from jgi_pack import TaxonPack
+
+    pack = TaxonPack(pack_dir)
+    try:
+        for single_dict in pack.iter_taxa():
+            yield single_dict
+    finally:
+        pack.close()
+
+def iter_records(save_dir, domain=None, datatype=None, fields=None):
+    """
+    read the taxa of a crawl one at a time, in constant memory however large it is
+
+    :param save_dir: save dir of a crawl, read from its <taxon_id>.json files, or if it holds none from its pack
+        (see jgi_pack) or its concatenated .jsonl / .json file; or a concatenated file itself. With domain, the
+        save dir of scrape_domains_from_jgi is read from its <domain> subdir
+    :param domain: only taxa of this domain, e.g. 'bacteria' or 'Bacteria' (see DOMAIN_NAMES), or None for every taxon
+    :param datatype: only this enzyme dict of each taxon, e.g. 'genome' or 'assembled', skipping taxa without it
+    :param fields: None, 'metadata' or 'ecs' (see project)
+    :returns: generator of (projected) single taxon dicts
+    """
+
+    if fields not in PROJECTIONS:
+        raise ValueError("Fields must be one of %s"%(PROJECTIONS,))
+
+    domain_name = DOMAIN_NAMES.get(domain.lower(), domain) if domain is not None else None
+
+    if domain is not None and os.path.isdir(os.path.join(save_dir, domain.lower())):
+        ## every taxon of the subdir is of the domain
+        save_dir = os.path.join(save_dir, domain.lower())
+        domain_name = None
+
+    if not os.path.isdir(save_dir) or any(fname.endswith('.json') for fname in os.listdir(save_dir)):
+        records = iter_taxa(save_dir)
+    elif os.path.isdir(save_dir.rstrip('/')+'_pack'):
+        records = iter_pack(save_dir.rstrip('/')+'_pack')
+    else:
+        paths = [concatenated_path(save_dir, fmt) for fmt in CONCATENATED_FORMATS if os.path.exists(concatenated_path(save_dir, fmt))]
+        if not paths:
+            raise ValueError("No taxon jsons, pack or concatenated file found for %s"%save_dir)
+        records = iter_concatenated(paths[0])
+
+    for single_dict in records:
+
+        if domain_name is not None and (taxon_domain(single_dict) or '').lower() != domain_name.lower():
+            continue
+
+        record = project(single_dict, fields=fields, datatype=datatype)
+        if record is not None:
+            yield record
+
+def fan_out(*writers):
+    """
+    :param writers: objects with a write(single_dict) method (e.g. a ConcatenatedWriter or a TaxonPack, see jgi_pack), or None
+    :returns: function(single_dict) writing it to every writer that is not None
+    """
+
+    writers = [writer for writer in writers if writer is not None]
+
+    def write(single_dict):
+        for writer in writers:
+            writer.write(single_dict)
+
+    return write
@@ -0,0 +1,295 @@
+## jgi_pack
+"""
+Packed output of the scrape_*_from_jgi scripts (`--pack`): every taxon is
+appended to a few large, zstd compressed shard files instead of being
+written to its own <taxon_id>.json.
+
+  PACK_DIR/taxa-00000.zst, taxa-00001.zst, ...   one zstd frame per taxon (its json)
+  PACK_DIR/dictionary.zstd                       zstd dictionary trained on the first taxa of the pack
+  PACK_DIR/index.sqlite                          taxon_id -> shard, offset and length of its frame
+
+The taxa of a crawl share most of their metadata keys, ecs and enzyme names,
+so once `train_records` taxa have been written a dictionary is trained on
+them and every later frame is compressed with it (the frames written before
+keep no dictionary, and say so in the index). Each run appends to a new
+shard, and rolls over to another one past `shard_mb`; the newest frame of a
+taxon wins.
+
+Any taxon can be read back on its own (`TaxonPack.get`), and
+`export_jsons` writes the <taxon_id>.json files the scripts would have.
+
+Usage:
+  jgi_pack.py SOURCE PACK_DIR [options]
+  jgi_pack.py --export PACK_DIR SAVE_DIR
+  jgi_pack.py --get PACK_DIR TAXON_ID
+
+Arguments:
+  SOURCE   save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file (see jgi_output)
+  PACK_DIR directory holding the pack
+  SAVE_DIR directory to write <taxon_id>.json files to
+  TAXON_ID Taxon ID / Taxon Object ID of the taxon to print
+
+Options:
+  --level=<l>    zstd compression level [default: 9]
+  --shard_mb=<sm>    size in MB past which the next taxon starts a new shard [default: 256]
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from docopt import docopt
+import zstandard as zstd
+from jgi_output import iter_taxa, taxon_id_of
+from jgi_metrics import METRICS
+
+SHARD_PREFIX = 'taxa-'
+SHARD_SUFFIX = '.zst'
+
+def pack_path(save_dir):
+    """
+    :param save_dir: dir the crawl writes its jsons to; the pack is written next to it
+    :returns: path of the crawl's pack dir
+    """
+
+    return save_dir.rstrip('/')+'_pack'
+
+class TaxonPack(object):
+    """
+    append taxa to zstd compressed shards, and read any of them back by taxon id
+    """
+
+    def __init__(self, pack_dir, level=9, shard_mb=256, train_records=500, dict_kb=112):
+        """
+        :param pack_dir: dir to keep the shards, dictionary and index in
+        :param level: zstd compression level
+        :param shard_mb: size in MB past which the next taxon starts a new shard
+        :param train_records: number of taxa the dictionary is trained on
+        :param dict_kb: size of the dictionary, in KB
+        """
+
+        self.pack_dir = pack_dir
+        self.level = level
+        self.shard_bytes = shard_mb*1024**2
+        self.train_records = train_records
+        self.dict_bytes = dict_kb*1024
+
+        if not os.path.exists(pack_dir):
+            os.makedirs(pack_dir)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(pack_dir, 'index.sqlite'), check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS taxa (
+            taxon_id TEXT PRIMARY KEY, shard TEXT, offset INTEGER, length INTEGER, dictionary INTEGER, written_at REAL)''')
+
+        self.dict_path = os.path.join(pack_dir, 'dictionary.zstd')
+        self.dictionary = None
+        if os.path.exists(self.dict_path):
+            with open(self.dict_path, 'rb') as infile:
+                self.dictionary = zstd.ZstdCompressionDict(infile.read())
+        self.samples = list()
+        self.make_codecs()
+
+        self.fds = dict()
+        self.outfile = None
+        self.count = 0
+
+    def make_codecs(self):
+
+        self.compressor = zstd.ZstdCompressor(level=self.level)
+        self.decompressor = zstd.ZstdDecompressor()
+
+        if self.dictionary is not None:
+            self.dict_compressor = zstd.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+            self.dict_decompressor = zstd.ZstdDecompressor(dict_data=self.dictionary)
+
+    def open_shard(self):
+        """
+        start a new shard after the ones of earlier runs (call with self.lock held)
+        """
+
+        if self.outfile is not None:
+            self.outfile.close()
+
+        numbers = [int(name[len(SHARD_PREFIX):-len(SHARD_SUFFIX)]) for name in os.listdir(self.pack_dir)
+            if name.startswith(SHARD_PREFIX) and name.endswith(SHARD_SUFFIX)]
+
+        self.shard = '%s%05d%s'%(SHARD_PREFIX, max(numbers)+1 if numbers else 0, SHARD_SUFFIX)
+        self.outfile = open(os.path.join(self.pack_dir, self.shard), 'ab')
+        self.offset = self.outfile.tell()
+
+    def train(self):
+        """
+        train the dictionary on the samples kept so far, and save it (call with self.lock held)
+        """
+
+        try:
+            self.dictionary = zstd.train_dictionary(self.dict_bytes, self.samples)
+        except zstd.ZstdError as e:
+            ## too few or too alike samples; later taxa are compressed without a dictionary
+            print("Could not train a dictionary for %s: %s"%(self.pack_dir, e))
+            self.train_records = None
+        else:
+            tmp_path = '%s.tmp.%d'%(self.dict_path, os.getpid())
+            with open(tmp_path, 'wb') as outfile:
+                outfile.write(self.dictionary.as_bytes())
+            os.replace(tmp_path, self.dict_path)
+            self.make_codecs()
+            print("Trained a %d KB dictionary for %s on %d taxa"%(len(self.dictionary.as_bytes())//1024, self.pack_dir, len(self.samples)))
+
+        self.samples = list()
+
+    def write(self, single_dict):
+        """
+        append a taxon to the pack, replacing any earlier frame of it
+
+        :param single_dict: single taxon dict
+        """
+
+        data = json.dumps(single_dict).encode('utf-8')
+
+        with METRICS.timed('pack_write'):
+
+            with self.lock:
+
+                if self.dictionary is not None:
+                    frame = self.dict_compressor.compress(data)
+                else:
+                    frame = self.compressor.compress(data)
+                    if self.train_records:
+                        self.samples.append(data)
+
+                if self.outfile is None or (self.offset and self.offset+len(frame) > self.shard_bytes):
+                    self.open_shard()
+
+                offset = self.offset
+                self.outfile.write(frame)
+                ## the frame is on disk before the index points at it
+                self.outfile.flush()
+                self.offset += len(frame)
+
+                self.db.execute('INSERT OR REPLACE INTO taxa (taxon_id, shard, offset, length, dictionary, written_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    (taxon_id_of(single_dict), self.shard, offset, len(frame), int(self.dictionary is not None), time.time()))
+                self.count += 1
+
+                if self.dictionary is None and self.train_records and len(self.samples) >= self.train_records:
+                    self.train()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def taxon_ids(self):
+        """
+        :returns: set of ids of every taxon in the pack
+        """
+
+        with self.lock:
+            return set(row[0] for row in self.db.execute('SELECT taxon_id FROM taxa'))
+
+    def read(self, row):
+        """
+        :param row: (shard, offset, length, dictionary) of a frame in the index
+        :returns: the single taxon dict in the frame
+        """
+
+        shard, offset, length, dictionary = row
+
+        with self.lock:
+            if shard not in self.fds:
+                self.fds[shard] = os.open(os.path.join(self.pack_dir, shard), os.O_RDONLY)
+            fd = self.fds[shard]
+            decompressor = self.dict_decompressor if dictionary else self.decompressor
+
+        frame = os.pread(fd, length, offset)
+
+        with self.lock:
+            ## a zstd decompressor is not safe to share between threads
+            data = decompressor.decompress(frame)
+
+        return json.loads(data.decode('utf-8'))
+
+    def get(self, taxon_id):
+        """
+        :param taxon_id: Taxon ID / Taxon Object ID of a taxon
+        :returns: its single taxon dict, or None if it is not in the pack
+        """
+
+        with self.lock:
+            row = self.db.execute('SELECT shard, offset, length, dictionary FROM taxa WHERE taxon_id = ?', (taxon_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return self.read(row)
+
+    def iter_taxa(self, taxon_ids=None):
+        """
+        read taxa one at a time, in the order they sit in the shards
+
+        :param taxon_ids: ids of the taxa to read (ids not in the pack are skipped), or None for every taxon
+        :returns: generator of single taxon dicts
+        """
+
+        with self.lock:
+            rows = self.db.execute('SELECT taxon_id, shard, offset, length, dictionary FROM taxa ORDER BY shard, offset').fetchall()
+
+        for row in rows:
+            if taxon_ids is None or row[0] in taxon_ids:
+                yield self.read(row[1:])
+
+    def close(self):
+
+        with self.lock:
+            if self.outfile is not None:
+                self.outfile.close()
+            for fd in self.fds.values():
+                os.close(fd)
+            self.fds = dict()
+            self.db.close()
+
+        if self.count:
+            print("Packed %d taxa into %s"%(self.count, self.pack_dir))
+
+def export_jsons(pack_dir, save_dir):
+    """
+    PACK_DIR -> one <taxon_id>.json per taxon in save_dir, as written by the scrape_*_from_jgi scripts
+
+    :param pack_dir: dir of a TaxonPack
+    :param save_dir: dir to write the jsons to
+    """
+
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    pack = TaxonPack(pack_dir)
+
+    n = 0
+    for single_dict in pack.iter_taxa():
+        with open(os.path.join(save_dir, taxon_id_of(single_dict)+'.json'), 'w') as outfile:
+            json.dump(single_dict, outfile)
+        n += 1
+
+    pack.close()
+
+    print("Wrote %d taxa to %s"%(n, save_dir))
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='jgi_pack 1.0')
+
+    if arguments['--export']:
+        export_jsons(arguments['PACK_DIR'], arguments['SAVE_DIR'])
+    elif arguments['--get']:
+        pack = TaxonPack(arguments['PACK_DIR'])
+        single_dict = pack.get(arguments['TAXON_ID'])
+        pack.close()
+        if single_dict is None:
+            raise ValueError("No taxon %s in %s"%(arguments['TAXON_ID'], arguments['PACK_DIR']))
+        print(json.dumps(single_dict, indent=1))
+    else:
+        pack = TaxonPack(arguments['PACK_DIR'], level=int(arguments['--level']), shard_mb=float(arguments['--shard_mb']))
+        pack.write_all(iter_taxa(arguments['SOURCE']))
+        pack.close()
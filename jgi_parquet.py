@@ -0,0 +1,211 @@
+## jgi_parquet
+"""
+Export the taxa of a crawl to Parquet tables.
+
+  gene_counts.parquet  long format, one row per (taxon, datatype, ec):
+                       taxon_id (int64), domain, datatype, ec, gene_count (int64, null
+                       where the scraped count is not an integer)
+  metadata.parquet     one row per taxon: taxon_id, domain, and every metadata
+                       field (as int64 / float64 where every value parses as one)
+  enzymes.parquet      one row per ec: ec, enzyme_name
+
+gene_counts is sorted on `--sort_by` (ec, then taxon_id by default) and
+written in row groups with min/max statistics, so a scan filtered on the
+sort column only reads the row groups that can match, e.g.
+
+  read_gene_counts(OUT_DIR, ec='EC:1.1.1.1')
+
+The sort runs in memory: the whole gene_counts table (about 50 bytes per
+row as arrow, twice that while it is sorted) and every taxon's metadata are
+held at once, e.g. ~10 GB for 100 million gene_counts rows. Export a larger
+crawl one domain (one save dir) at a time.
+
+Usage:
+  jgi_parquet.py SOURCE OUT_DIR [options]
+
+Arguments:
+  SOURCE   save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file (see jgi_output)
+  OUT_DIR  directory to write the parquet files to
+
+Options:
+  --domain=<d>    domain recorded for every taxon, e.g. 'Bacteria' (by default the metadata's 'Domain', or 'Metagenome' for metagenomes)
+  --sort_by=<sb>    column gene_counts is sorted on, either 'ec' or 'taxon_id' [default: ec]
+  --row_group_size=<rg>    rows per row group of gene_counts [default: 131072]
+  --batch_size=<bs>    taxa converted to arrow at a time [default: 1000]
+"""
+
+import os
+import re
+from docopt import docopt
+import pyarrow as pa
+import pyarrow.parquet as pq
+from jgi_output import iter_taxa, taxon_id_of, enzyme_keys_of, taxon_domain
+
+SORT_COLUMNS = {'ec': ['ec', 'taxon_id'], 'taxon_id': ['taxon_id', 'datatype', 'ec']}
+
+GENE_COUNTS_SCHEMA = pa.schema([
+    ('taxon_id', pa.int64()),
+    ('domain', pa.string()),
+    ('datatype', pa.string()),
+    ('ec', pa.string()),
+    ('gene_count', pa.int64()),
+])
+
+def domain_of(single_dict, domain=None):
+    """
+    :param single_dict: single taxon dict
+    :param domain: domain to use, or None to take it from the taxon
+    :returns: the taxon's domain
+    """
+
+    if domain is not None:
+        return domain
+
+    return taxon_domain(single_dict)
+
+## plain decimal numbers only: int() and float() also take '1_000', ' 7 ', 'nan' and 'inf', which are kept as strings
+INT_REGEX = re.compile(r'-?\d+', re.ASCII)
+FLOAT_REGEX = re.compile(r'-?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?', re.ASCII)
+
+def typed_column(values):
+    """
+    :param values: list of metadata strings (or None)
+    :returns: arrow array of int64 or float64 if every value is a plain decimal number of that type, otherwise of strings
+    """
+
+    for regex, cast, arrow_type in ((INT_REGEX, int, pa.int64()), (FLOAT_REGEX, float, pa.float64())):
+        if all(value is None or (isinstance(value, str) and regex.fullmatch(value)) for value in values):
+            try:
+                return pa.array([None if value is None else cast(value) for value in values], type=arrow_type)
+            except (OverflowError, ValueError):
+                ## an integer past int64
+                pass
+
+    return pa.array(values, type=pa.string())
+
+def gene_count_of(genecount, taxon_id, ec):
+    """
+    :returns: genecount as an int, or None (written as null) if it is not one, so one bad row does not stop the export
+    """
+
+    try:
+        return int(genecount)
+    except (TypeError, ValueError):
+        print("Taxon %s, %s: gene count %r is not an integer, writing null"%(taxon_id, ec, genecount))
+        return None
+
+def gene_count_batch(columns):
+    return pa.RecordBatch.from_arrays([pa.array(columns[field.name], type=field.type) for field in GENE_COUNTS_SCHEMA], schema=GENE_COUNTS_SCHEMA)
+
+def export_parquet(source, out_dir, domain=None, sort_by='ec', row_group_size=131072, batch_size=1000):
+    """
+    source -> gene_counts.parquet, metadata.parquet and enzymes.parquet in out_dir
+
+    :param source: save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file
+    :param out_dir: dir to write the parquet files to
+    :param domain: domain recorded for every taxon, or None to take it from each taxon
+    :param sort_by: 'ec' or 'taxon_id', the column gene_counts is sorted on
+    :param row_group_size: rows per row group of gene_counts
+    :param batch_size: taxa converted to arrow at a time
+    :returns: dict of number of rows written to each table
+
+    gene_counts is sorted in memory, see the module docstring for how much that takes.
+    """
+
+    if sort_by not in SORT_COLUMNS:
+        raise ValueError("sort_by must be one of %s"%(tuple(SORT_COLUMNS),))
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    batches = list()
+    columns = dict((field.name, list()) for field in GENE_COUNTS_SCHEMA)
+    metadata_rows = list()
+    enzyme_names = dict()
+
+    for n, single_dict in enumerate(iter_taxa(source)):
+
+        taxon_id = int(taxon_id_of(single_dict))
+        taxon_domain = domain_of(single_dict, domain)
+
+        metadata_row = dict(single_dict['metadata'])
+        metadata_row['taxon_id'] = taxon_id
+        metadata_row['domain'] = taxon_domain
+        metadata_rows.append(metadata_row)
+
+        for datatype in enzyme_keys_of(single_dict):
+            for ec, (enzymeName, genecount) in single_dict[datatype].items():
+                columns['taxon_id'].append(taxon_id)
+                columns['domain'].append(taxon_domain)
+                columns['datatype'].append(datatype)
+                columns['ec'].append(ec)
+                columns['gene_count'].append(gene_count_of(genecount, taxon_id, ec))
+                enzyme_names.setdefault(ec, enzymeName)
+
+        if (n+1)%batch_size == 0:
+            batches.append(gene_count_batch(columns))
+            columns = dict((name, list()) for name in columns)
+            print("Converted %d taxa ..."%(n+1))
+
+    batches.append(gene_count_batch(columns))
+
+    gene_counts = pa.Table.from_batches(batches, schema=GENE_COUNTS_SCHEMA)
+    gene_counts = gene_counts.sort_by([(column, 'ascending') for column in SORT_COLUMNS[sort_by]])
+
+    pq.write_table(gene_counts, os.path.join(out_dir, 'gene_counts.parquet'),
+        row_group_size=row_group_size, compression='zstd', write_statistics=True)
+
+    ## metadata: taxon_id and domain first, then the metadata fields in the order they were first seen
+    metadata_keys = ['taxon_id', 'domain']
+    for metadata_row in metadata_rows:
+        for key in metadata_row:
+            if key not in metadata_keys:
+                metadata_keys.append(key)
+
+    metadata = pa.Table.from_arrays([
+        pa.array([row['taxon_id'] for row in metadata_rows], type=pa.int64()),
+        pa.array([row['domain'] for row in metadata_rows], type=pa.string())]+[
+        typed_column([row.get(key) for row in metadata_rows]) for key in metadata_keys[2:]], names=metadata_keys)
+    metadata = metadata.sort_by('taxon_id')
+
+    pq.write_table(metadata, os.path.join(out_dir, 'metadata.parquet'), compression='zstd')
+
+    ecs = sorted(enzyme_names)
+    enzymes = pa.Table.from_arrays([pa.array(ecs, type=pa.string()), pa.array([enzyme_names[ec] for ec in ecs], type=pa.string())],
+        names=['ec', 'enzyme_name'])
+
+    pq.write_table(enzymes, os.path.join(out_dir, 'enzymes.parquet'), compression='zstd')
+
+    rows = {'gene_counts': gene_counts.num_rows, 'metadata': metadata.num_rows, 'enzymes': enzymes.num_rows}
+
+    print("Wrote %d gene counts of %d taxa and %d ecs to %s"%(rows['gene_counts'], rows['metadata'], rows['enzymes'], out_dir))
+
+    return rows
+
+def read_gene_counts(out_dir, ec=None, taxon_id=None, columns=None):
+    """
+    read gene_counts.parquet, skipping the row groups that cannot match the filters
+
+    :param out_dir: dir written by export_parquet
+    :param ec: only read rows of this ec (e.g. 'EC:1.1.1.1'), or None
+    :param taxon_id: only read rows of this taxon id, or None
+    :param columns: list of columns to read, or None for all of them
+    :returns: pyarrow Table
+    """
+
+    filters = list()
+    if ec is not None:
+        filters.append(('ec', '=', ec))
+    if taxon_id is not None:
+        filters.append(('taxon_id', '=', int(taxon_id)))
+
+    return pq.read_table(os.path.join(out_dir, 'gene_counts.parquet'), columns=columns, filters=filters or None)
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='jgi_parquet 1.0')
+
+    export_parquet(arguments['SOURCE'], arguments['OUT_DIR'],
+        domain=arguments['--domain'],
+        sort_by=arguments['--sort_by'],
+        row_group_size=int(arguments['--row_group_size']),
+        batch_size=int(arguments['--batch_size']))
@@ -0,0 +1,211 @@
+## jgi_parse
+"""
+Fast html parsing shared by the scrape_*_from_jgi scripts.
+
+The metadata of a taxon is the first <table> of its page, but the scripts
+used to build a BeautifulSoup tree of the whole (often multi-megabyte) page
+to read it. `parse_metadata_table` instead runs the same tokenizer
+BeautifulSoup's "html.parser" builder is built on (the standard library's
+HTMLParser), keeps only a stack of open tags, and stops as soon as the first
+table is closed. Tags nest, close and collect text exactly as they do in a
+BeautifulSoup tree (unclosed cells nest, comments and script / style / ruby
+annotation contents are left out of the text, whitespace-only strings are
+collapsed), so the dict is the same as before.
+
+`extract_detail_links` pulls every TaxonDetail / MetaDetail link the scripts
+need out of a taxon page in one scan with one precompiled regex: the enzyme
+page link of a genome, the enzyme page link of each datatype of a metagenome,
+and the taxon's own detail page.
+"""
+
+import re
+from html.parser import HTMLParser
+from jgi_metrics import METRICS
+
+## href of a TaxonDetail / MetaDetail link, its section, and its page
+DETAIL_LINK_REGEX = re.compile(r'<a href="(main\.cgi\?section=(TaxonDetail|MetaDetail)&amp;page=(\w+)[^"]*)"')
+DATA_TYPE_REGEX = re.compile(r'data_type=(\w+)')
+
+## tags BeautifulSoup closes as soon as they open
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta', 'param',
+    'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'])
+
+## tags whose strings BeautifulSoup leaves out of .text
+SKIPPED_TEXT_TAGS = frozenset(['script', 'style', 'template', 'rt', 'rp'])
+
+## tags inside which BeautifulSoup keeps whitespace-only strings as they are
+PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+
+ASCII_SPACES = dict((ord(c), None) for c in ' \n\t\x0c\r')
+
+class FirstTableParsed(Exception):
+    pass
+
+class MetadataTableParser(HTMLParser):
+    """
+    collect the th / td text of every row of the first table of a page, stopping once the table is closed
+    """
+
+    def __init__(self):
+
+        HTMLParser.__init__(self, convert_charrefs=True)
+
+        ## open tags, as [name, cell or row or None]
+        self.stack = list()
+        self.table = None
+        self.rows = list()
+        self.data = list()
+
+    def handle_starttag(self, tag, attrs):
+
+        self.end_data()
+
+        node = None
+
+        if tag == 'table' and self.table is None:
+            node = self.table = dict()
+        elif self.table is None:
+            pass
+        elif tag == 'tr':
+            node = {'th': list(), 'td': list()}
+            self.rows.append(node)
+        elif tag in ('th', 'td'):
+            node = list()
+            ## a cell counts towards every row it is nested in
+            for name, row in self.stack:
+                if name == 'tr' and row is not None:
+                    row[tag].append(node)
+
+        if tag not in VOID_TAGS:
+            self.stack.append([tag, node])
+
+    def handle_startendtag(self, tag, attrs):
+
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+
+        self.end_data()
+
+        ## close the most recent open tag of that name and everything opened inside it; ignore strays
+        for i in range(len(self.stack)-1, -1, -1):
+            if self.stack[i][0] == tag:
+                closed = self.stack[i:]
+                del self.stack[i:]
+                if self.table is not None and any(node is self.table for name, node in closed):
+                    raise FirstTableParsed()
+                return
+
+    def handle_comment(self, data):
+        self.end_data()
+
+    def handle_decl(self, data):
+        self.end_data()
+
+    def handle_pi(self, data):
+        self.end_data()
+
+    def handle_data(self, data):
+        if self.table is not None:
+            self.data.append(data)
+
+    def end_data(self):
+        """
+        add the string read since the last tag to the text of every open cell
+        """
+
+        if not self.data:
+            return
+
+        data = ''.join(self.data)
+        self.data = list()
+
+        names = [name for name, node in self.stack]
+
+        if SKIPPED_TEXT_TAGS.intersection(names):
+            return
+
+        if not data.translate(ASCII_SPACES) and not PRESERVE_WHITESPACE_TAGS.intersection(names):
+            data = '\n' if '\n' in data else ' '
+
+        for name, node in self.stack:
+            if name in ('th', 'td'):
+                node.append(data)
+
+def parse_metadata_table(htmlSource):
+    """
+    htmlSource -> dictionary of the key / value rows of its first table
+
+    :param htmlSource: html source of a taxon page
+    :returns: dict of row header -> row value, for every row with exactly one <th> and one <td>
+    """
+
+    with METRICS.timed('metadata_parse'):
+        return parse_metadata_rows(htmlSource)
+
+def parse_metadata_rows(htmlSource):
+    """
+    untimed body of parse_metadata_table
+    """
+
+    parser = MetadataTableParser()
+
+    try:
+        parser.feed(htmlSource)
+        parser.close()
+        parser.end_data()
+    except FirstTableParsed:
+        pass
+
+    if parser.table is None:
+        raise ValueError("Page has no metadata table")
+
+    metadata_table_dict = dict()
+
+    for row in parser.rows:
+        if len(row['th']) == 1 and len(row['td']) == 1:
+            metadata_table_dict[''.join(row['th'][0]).rstrip()] = ''.join(row['td'][0]).rstrip()
+
+    return metadata_table_dict
+
+def extract_detail_links(htmlSource):
+    """
+    htmlSource -> the href (main.cgi?...) of the first link of each kind on the page, in a single scan
+
+    :param htmlSource: html source of a taxon (genome or metagenome) page
+    :returns: dict with 'genome' (enzyme page of a genome), a datatype such as 'assembled' (enzyme page of that datatype of a metagenome), and 'taxon' (the taxon's detail page); kinds missing from the page are left out
+    """
+
+    with METRICS.timed('link_extract'):
+        return extract_links(htmlSource)
+
+def extract_links(htmlSource):
+    """
+    untimed body of extract_detail_links
+    """
+
+    links = dict()
+
+    for match in DETAIL_LINK_REGEX.finditer(htmlSource):
+
+        href, section, page = match.groups()
+
+        if page == 'enzymes':
+            if section == 'TaxonDetail':
+                key = 'genome'
+            else:
+                data_type = DATA_TYPE_REGEX.search(href)
+                if data_type is None:
+                    continue
+                key = data_type.group(1)
+        elif page in ('taxonDetail', 'metaDetail'):
+            key = 'taxon'
+        else:
+            continue
+
+        if key not in links:
+            links[key] = href
+
+    return links
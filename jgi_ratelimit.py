@@ -0,0 +1,240 @@
+## jgi_ratelimit
+"""
+Adaptive rate limiting of the requests made by the fetchers of the
+scrape_*_from_jgi scripts (see jgi_fetch and jgi_async).
+
+Every request to a host first takes a token from that host's bucket and a
+slot below its concurrency limit. Tokens refill at the host's current rate
+(requests per second), and the bucket holds at most one second's worth of
+them. Both the rate and the concurrency limit are adjusted as responses come
+back (additive increase, multiplicative decrease):
+
+  - a response whose latency is steady grows the rate by about `increase`
+    requests per second, every second, and the concurrency limit by one
+    per window of requests
+  - a 429 or 5xx response, a timeout, or a latency more than
+    `latency_factor` times the best seen for that stage multiplies both by
+    `decrease` (at most once per `cooldown` seconds, so a burst of errors
+    from the same window only counts once). A Retry-After header also
+    pauses the host for that long
+
+`RateLimiter.current` gives the rate, concurrency limit and requests in
+flight of each host.
+"""
+
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+from jgi_metrics import METRICS
+
+## response statuses that mean the server is under pressure
+PRESSURE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+## weight of the newest latency in each stage's moving average
+LATENCY_ALPHA = 0.2
+
+## seconds; a moving average latency below this never counts as slow, however fast the best one was
+MIN_SLOW_LATENCY = 1.0
+
+class HostLimit(object):
+    """
+    token bucket, concurrency limit and latencies of one host
+    """
+
+    def __init__(self, rate, concurrency):
+
+        self.rate = rate
+        self.concurrency = concurrency
+        self.tokens = 1.0
+        self.refilled_at = time.time()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.backed_off_at = 0.0
+        self.backoffs = 0
+        self.requests = 0
+
+        ## stage -> moving average / lowest moving average of its latencies
+        self.latency = dict()
+        self.best_latency = dict()
+
+    def refill(self, now):
+
+        self.tokens = min(max(1.0, self.rate), self.tokens+(now-self.refilled_at)*self.rate)
+        self.refilled_at = now
+
+class RateLimiter(object):
+    """
+    per host token buckets whose rate and concurrency follow the server's responses
+    """
+
+    def __init__(self, rate=5.0, min_rate=0.2, max_rate=100.0, concurrency=4, max_concurrency=64,
+        increase=1.0, decrease=0.5, latency_factor=3.0, cooldown=5.0):
+        """
+        :param rate: requests per second each host starts at
+        :param min_rate: lowest rate backing off can go to
+        :param max_rate: highest rate increasing can go to
+        :param concurrency: requests in flight each host starts at
+        :param max_concurrency: highest concurrency limit
+        :param increase: requests per second added to the rate per second of steady responses
+        :param decrease: factor the rate and concurrency are multiplied by on server pressure
+        :param latency_factor: a latency this many times the best moving average of its stage counts as pressure
+        :param cooldown: seconds after a back off during which further pressure is ignored
+        """
+
+        self.initial_rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.initial_concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+
+        self.hosts = dict()
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+
+    def host(self, url):
+        """
+        :returns: the HostLimit of url's host (call with self.lock held)
+        """
+
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostLimit(self.initial_rate, self.initial_concurrency)
+
+        return self.hosts[host]
+
+    def try_acquire(self, url):
+        """
+        take a token and a concurrency slot for a request to url, if both are available
+
+        :returns: 0 once taken, otherwise the seconds to wait before trying again
+        """
+
+        now = time.time()
+
+        with self.lock:
+
+            limit = self.host(url)
+
+            if now < limit.paused_until:
+                return limit.paused_until-now
+
+            limit.refill(now)
+
+            if limit.tokens < 1:
+                return (1-limit.tokens)/limit.rate
+            if limit.in_flight >= int(limit.concurrency):
+                ## woken up early by release (see acquire)
+                return 1.0
+
+            limit.tokens -= 1
+            limit.in_flight += 1
+            limit.requests += 1
+
+            return 0
+
+    def acquire(self, url):
+        """
+        block until a request to url may be sent
+
+        :returns: start time of the request, to pass back to release
+        """
+
+        while True:
+            wait = self.try_acquire(url)
+            if not wait:
+                return time.time()
+            with self.released:
+                self.released.wait(wait)
+
+    async def acquire_async(self, url):
+        """
+        coroutine version of acquire
+        """
+
+        while True:
+            wait = self.try_acquire(url)
+            if not wait:
+                return time.time()
+            await asyncio.sleep(min(wait, 0.1))
+
+    def release(self, url, stage, start, status=None, timed_out=False, retry_after=None):
+        """
+        free the request's slot, and adjust the host's rate and concurrency to how it went
+
+        :param url: url that was requested
+        :param stage: stage the url belongs to (see jgi_waits.STAGE_TIMEOUTS); latencies are compared within a stage
+        :param start: time returned by acquire
+        :param status: http status of the response, or None if there was none (or it is unknown, e.g. in chrome)
+        :param timed_out: True if the request timed out
+        :param retry_after: value of the response's Retry-After header, if any
+        """
+
+        now = time.time()
+        latency = now-start
+
+        with self.lock:
+
+            limit = self.host(url)
+            limit.in_flight -= 1
+
+            ok = not timed_out and (status is None or status < 400)
+            pressure = timed_out or status in PRESSURE_STATUSES
+
+            if ok:
+
+                average = limit.latency.get(stage, latency)*(1-LATENCY_ALPHA)+latency*LATENCY_ALPHA
+                limit.latency[stage] = average
+                limit.best_latency[stage] = min(limit.best_latency.get(stage, average), average)
+
+                pressure = average > max(MIN_SLOW_LATENCY, self.latency_factor*limit.best_latency[stage])
+
+            if pressure:
+                if now-limit.backed_off_at >= self.cooldown:
+                    limit.rate = max(self.min_rate, limit.rate*self.decrease)
+                    limit.concurrency = max(1.0, limit.concurrency*self.decrease)
+                    limit.tokens = min(limit.tokens, 1.0)
+                    limit.backed_off_at = now
+                    limit.backoffs += 1
+                    METRICS.count('rate_limit_backoffs')
+                    reason = 'timeout' if timed_out else status if status in PRESSURE_STATUSES else 'slow responses'
+                    print("Backing off %s (%s): %.2f requests/s, %d in flight"%(urlsplit(url).netloc, reason, limit.rate, int(limit.concurrency)))
+                if retry_after:
+                    try:
+                        limit.paused_until = max(limit.paused_until, now+float(retry_after))
+                    except ValueError:
+                        pass
+            elif ok:
+                ## about `increase` requests/s more every second, and one more request in flight every window
+                limit.rate = min(self.max_rate, limit.rate+self.increase/max(1.0, limit.rate))
+                limit.concurrency = min(self.max_concurrency, limit.concurrency+1.0/limit.concurrency)
+
+            self.released.notify_all()
+
+    def current(self):
+        """
+        :returns: dict of host -> {'rate', 'concurrency', 'in_flight', 'requests', 'backoffs', 'latency'} (latency is stage -> moving average in seconds)
+        """
+
+        with self.lock:
+            return dict((host, {
+                'rate': limit.rate,
+                'concurrency': int(limit.concurrency),
+                'in_flight': limit.in_flight,
+                'requests': limit.requests,
+                'backoffs': limit.backoffs,
+                'latency': dict(limit.latency),
+            }) for host, limit in self.hosts.items())
+
+    def print_summary(self):
+        """
+        print the rate each host ended at
+        """
+
+        for host, stats in sorted(self.current().items()):
+            print("Rate limit of %s: %.2f requests/s, %d in flight, %d requests, %d back offs"%(
+                host, stats['rate'], stats['concurrency'], stats['requests'], stats['backoffs']))
@@ -0,0 +1,185 @@
+## jgi_retry
+"""
+Bounded retries and a quarantine of failing taxa, used by the
+scrape_*_from_jgi scripts (`--retries`, `--redrive`).
+
+A taxon whose scrape raises (a page missing what the scripts look for, a
+request past its deadline, an http error, ...) is scraped again up to
+`retries` times, after a jittered exponential backoff: a random delay of up
+to `retry_delay * 2**(attempt-1)` seconds (capped at `max_delay`), so workers
+failing together do not retry together.
+
+A taxon still failing after its retries is added to the quarantine,
+`<save_dir>_quarantine.jsonl`, and the crawl goes on without it:
+
+  {"taxon_id": ..., "taxon_url": ..., "error": ..., "attempts": ..., "time": ...}
+
+`--redrive` scrapes only the quarantined taxa (no list json is loaded).
+Taxa that succeed are dropped from the quarantine, the rest stay in it.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from jgi_manifest import taxon_id_from_url
+from jgi_metrics import METRICS
+
+def backoff_delay(attempt, retry_delay=2.0, max_delay=60.0):
+    """
+    :param attempt: number of attempts made so far (1 after the first failure)
+    :param retry_delay: seconds the backoff starts at
+    :param max_delay: max seconds to wait
+    :returns: random seconds to wait before the next attempt ("full jitter" exponential backoff)
+    """
+
+    return random.uniform(0, min(max_delay, retry_delay*2**(attempt-1)))
+
+def with_retries(scrape_taxon, retries=2, retry_delay=2.0, max_delay=60.0):
+    """
+    wrap a scrape function so a failing taxon is scraped again, up to retries more times
+
+    :param scrape_taxon: function(fetcher, taxon_url) -> result
+    :param retries: number of times a taxon is retried after its first failure
+    :param retry_delay: seconds the backoff starts at (see backoff_delay)
+    :param max_delay: max seconds to wait between attempts
+    :returns: function(fetcher, taxon_url) -> result, raising the last error once the retries are used up (with the attempts made in its `attempts`)
+    """
+
+    def retried_scrape_taxon(fetcher, taxon_url):
+
+        attempt = 0
+
+        while True:
+
+            attempt += 1
+
+            try:
+                return scrape_taxon(fetcher, taxon_url)
+            except Exception as e:
+                if attempt > retries:
+                    e.attempts = attempt
+                    raise
+                delay = backoff_delay(attempt, retry_delay, max_delay)
+                METRICS.count('taxon_retries')
+                print("Attempt %d at %s failed (%r), retrying in %.1fs ..."%(attempt, taxon_url, e, delay))
+                time.sleep(delay)
+
+    return retried_scrape_taxon
+
+async def retry_async(scrape_taxon, taxon_url, retries=2, retry_delay=2.0, max_delay=60.0):
+    """
+    coroutine version of with_retries
+
+    :param scrape_taxon: function() -> coroutine scraping taxon_url
+    :param taxon_url: url of the taxon (for the log)
+    :returns: the result of the first attempt that succeeds
+    """
+
+    attempt = 0
+
+    while True:
+
+        attempt += 1
+
+        try:
+            return await scrape_taxon()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempt > retries:
+                e.attempts = attempt
+                raise
+            delay = backoff_delay(attempt, retry_delay, max_delay)
+            METRICS.count('taxon_retries')
+            print("Attempt %d at %s failed (%r), retrying in %.1fs ..."%(attempt, taxon_url, e, delay))
+            await asyncio.sleep(delay)
+
+class Quarantine(object):
+    """
+    taxa that kept failing, kept next to the save dir until a redrive scrapes them
+    """
+
+    def __init__(self, save_dir):
+        """
+        :param save_dir: dir the crawl writes its jsons to; the quarantine is written next to it
+        """
+
+        self.path = save_dir.rstrip('/')+'_quarantine.jsonl'
+        self.lock = threading.Lock()
+
+        ## taxon_id -> entry, the last entry of a taxon winning
+        self.entries = dict()
+        self.previous = set()
+
+        if os.path.exists(self.path):
+            with open(self.path) as infile:
+                for line in infile:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        ## torn last line of a crawl that died mid-write
+                        continue
+                    self.entries[entry['taxon_id']] = entry
+            self.previous = set(self.entries)
+
+        self.outfile = open(self.path, 'a')
+
+    def taxon_urls(self):
+        """
+        :returns: urls of every quarantined taxon (to redrive)
+        """
+
+        return [entry['taxon_url'] for taxon_id, entry in sorted(self.entries.items())]
+
+    def add(self, taxon_url, error):
+        """
+        quarantine a taxon, appending it to the file right away
+
+        :param taxon_url: url of the taxon
+        :param error: the exception it last failed with
+        """
+
+        entry = {
+            'taxon_id': taxon_id_from_url(taxon_url),
+            'taxon_url': taxon_url,
+            'error': repr(error),
+            'attempts': getattr(error, 'attempts', 1),
+            'time': time.time(),
+        }
+
+        with self.lock:
+            self.entries[entry['taxon_id']] = entry
+            self.outfile.write(json.dumps(entry)+'\n')
+            self.outfile.flush()
+
+        METRICS.count('taxa_quarantined')
+
+        print("Quarantined %s after %d attempts: %r"%(taxon_url, entry['attempts'], error))
+
+    def close(self, completed):
+        """
+        rewrite the quarantine without the taxa scraped successfully, and report what is left in it
+
+        :param completed: set of ids of the taxa scraped successfully
+        """
+
+        with self.lock:
+
+            self.outfile.close()
+
+            for taxon_id in completed:
+                self.entries.pop(taxon_id, None)
+
+            tmp_path = '%s.tmp.%d'%(self.path, os.getpid())
+            with open(tmp_path, 'w') as outfile:
+                for taxon_id, entry in sorted(self.entries.items()):
+                    outfile.write(json.dumps(entry)+'\n')
+            os.replace(tmp_path, self.path)
+
+        if self.entries:
+            print("%d taxa are quarantined in %s; rerun with --redrive to scrape them again."%(len(self.entries), self.path))
+        elif self.previous:
+            print("Quarantine is empty.")
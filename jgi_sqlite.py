@@ -0,0 +1,240 @@
+## jgi_sqlite
+"""
+SQLite output of the scrape_*_from_jgi scripts (`--sqlite`), to query the
+taxa of a crawl without reading every json.
+
+  taxa         taxon_id, domain ('Metagenome' for metagenomes)
+  metadata     taxon_id, key, value               one row per metadata field of a taxon
+  ecs          ec_id, ec, enzyme_name             one row per ec
+  gene_counts  taxon_id, datatype, ec_id, gene_count
+               (datatype is 'genome' for genomes, 'assembled', 'unassembled' or 'both' for metagenomes)
+
+Taxa are buffered and inserted `batch_size` at a time, each batch in one
+transaction (a taxon scraped again replaces its earlier rows). The tables
+are clustered on taxon_id; the indexes on ec, gene count and metadata
+fields are dropped while loading and built once at `close`, e.g. for
+
+  SELECT taxon_id, gene_count FROM gene_counts JOIN ecs USING (ec_id) WHERE ec = 'EC:1.1.1.1' AND gene_count > 2
+
+(`taxa_with_ec` runs that query).
+
+Usage:
+  jgi_sqlite.py SOURCE DB [options]
+  jgi_sqlite.py --ec=<ec> DB [options]
+
+Arguments:
+  SOURCE   save dir of <taxon_id>.json files, or a concatenated .json / .jsonl file (see jgi_output)
+  DB       path of the sqlite database
+
+Options:
+  --ec=<ec>    print the taxa carrying this ec, e.g. 1.1.1.1 or EC:1.1.1.1
+  --min_gene_count=<mg>    with --ec, only taxa with more than this many genes for it [default: 0]
+  --datatype=<dt>    with --ec, only this datatype, e.g. 'genome' or 'assembled'
+  --batch_size=<bs>    taxa inserted per transaction [default: 500]
+"""
+
+import sqlite3
+import threading
+from docopt import docopt
+from jgi_output import iter_taxa, taxon_id_of, enzyme_keys_of, taxon_domain
+from jgi_metrics import METRICS
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS taxa (taxon_id TEXT PRIMARY KEY, domain TEXT) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS metadata (taxon_id TEXT, key TEXT, value TEXT, PRIMARY KEY (taxon_id, key)) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS ecs (ec_id INTEGER PRIMARY KEY, ec TEXT UNIQUE, enzyme_name TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS gene_counts (taxon_id TEXT, datatype TEXT, ec_id INTEGER, gene_count INTEGER,
+        PRIMARY KEY (taxon_id, datatype, ec_id)) WITHOUT ROWID''',
+]
+
+## built after the load (see TaxonDatabase.close)
+INDEXES = {
+    'gene_counts_ec': 'CREATE INDEX IF NOT EXISTS gene_counts_ec ON gene_counts (ec_id, gene_count)',
+    'metadata_field': 'CREATE INDEX IF NOT EXISTS metadata_field ON metadata (key, value)',
+    'taxa_domain': 'CREATE INDEX IF NOT EXISTS taxa_domain ON taxa (domain)',
+}
+
+def gene_count_value(gene_count):
+    """
+    :returns: the gene count as an int, or as it is if it is not one
+    """
+
+    try:
+        return int(gene_count)
+    except (TypeError, ValueError):
+        return gene_count
+
+def normalize_ec(ec):
+    """
+    :returns: ec as IMG writes it, e.g. 'EC:1.1.1.1' for '1.1.1.1'
+    """
+
+    return ec if ec.startswith('EC:') else 'EC:'+ec
+
+def taxa_with_ec(db, ec, min_gene_count=0, datatype=None):
+    """
+    :param db: sqlite3 connection to a database written by TaxonDatabase
+    :param ec: e.g. 'EC:1.1.1.1' or '1.1.1.1'
+    :param min_gene_count: only taxa with more than this many genes for ec
+    :param datatype: only this datatype ('genome', 'assembled', ...), or None for any
+    :returns: list of (taxon_id, datatype, gene_count), by taxon_id
+    """
+
+    query = 'SELECT taxon_id, datatype, gene_count FROM gene_counts JOIN ecs USING (ec_id) WHERE ec = ? AND gene_count > ?'
+    params = [normalize_ec(ec), min_gene_count]
+    if datatype is not None:
+        query += ' AND datatype = ?'
+        params.append(datatype)
+
+    return db.execute(query+' ORDER BY taxon_id, datatype', params).fetchall()
+
+class TaxonDatabase(object):
+    """
+    insert taxa into a sqlite database in batched transactions
+    """
+
+    def __init__(self, path, batch_size=500):
+        """
+        :param path: path of the database (created if needed; taxa of earlier runs are kept)
+        :param batch_size: number of taxa inserted per transaction
+        """
+
+        self.path = path
+        self.batch_size = batch_size
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self.db.execute(statement)
+
+        ## the indexes are rebuilt after the load instead of being updated row by row
+        for name in INDEXES:
+            self.db.execute('DROP INDEX IF EXISTS %s'%name)
+
+        self.ec_ids = dict(self.db.execute('SELECT ec, ec_id FROM ecs'))
+        self.pending = list()
+        self.count = 0
+
+    def write(self, single_dict):
+        """
+        queue a taxon, inserting the queue once it holds batch_size taxa
+
+        :param single_dict: single taxon dict
+        """
+
+        with self.lock:
+            self.pending.append(single_dict)
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def insert_missing(self, taxon_ids, read_taxa):
+        """
+        insert the taxa of taxon_ids that are not in the database, e.g. the taxa of an earlier run
+        still queued in a batch when it died, and so recorded as completed but never inserted
+
+        :param taxon_ids: ids of the taxa that should be in the database
+        :param read_taxa: function(taxon_ids) -> generator of single taxon dicts, e.g. TaxonPack.iter_taxa
+        :returns: number of taxa inserted
+        """
+
+        with self.lock:
+            stored_ids = set(taxon_id for (taxon_id,) in self.db.execute('SELECT taxon_id FROM taxa'))
+            stored_ids.update(taxon_id_of(single_dict) for single_dict in self.pending)
+
+        missing_ids = set(taxon_ids)-stored_ids
+        if not missing_ids:
+            return 0
+
+        print("Inserting %d taxa of earlier runs missing from %s ..."%(len(missing_ids), self.path))
+
+        n = 0
+        for single_dict in read_taxa(missing_ids):
+            self.write(single_dict)
+            n += 1
+
+        return n
+
+    def flush(self):
+        """
+        insert the queued taxa in one transaction (call with self.lock held)
+        """
+
+        if not self.pending:
+            return
+
+        taxa = list()
+        metadata = list()
+        new_ecs = list()
+        gene_counts = list()
+
+        for single_dict in self.pending:
+
+            taxon_id = taxon_id_of(single_dict)
+            taxa.append((taxon_id, taxon_domain(single_dict)))
+
+            metadata.extend((taxon_id, key, value) for key, value in single_dict['metadata'].items())
+
+            for datatype in enzyme_keys_of(single_dict):
+                for ec, (enzymeName, gene_count) in single_dict[datatype].items():
+                    if ec not in self.ec_ids:
+                        self.ec_ids[ec] = len(self.ec_ids)+1
+                        new_ecs.append((self.ec_ids[ec], ec, enzymeName))
+                    gene_counts.append((taxon_id, datatype, self.ec_ids[ec], gene_count_value(gene_count)))
+
+        with METRICS.timed('sqlite_insert'):
+
+            self.db.execute('BEGIN')
+            try:
+                ## a taxon scraped again replaces its earlier rows
+                self.db.executemany('DELETE FROM metadata WHERE taxon_id = ?', [(taxon_id,) for taxon_id, domain in taxa])
+                self.db.executemany('DELETE FROM gene_counts WHERE taxon_id = ?', [(taxon_id,) for taxon_id, domain in taxa])
+                self.db.executemany('INSERT OR REPLACE INTO taxa (taxon_id, domain) VALUES (?, ?)', taxa)
+                self.db.executemany('INSERT OR REPLACE INTO metadata (taxon_id, key, value) VALUES (?, ?, ?)', metadata)
+                self.db.executemany('INSERT INTO ecs (ec_id, ec, enzyme_name) VALUES (?, ?, ?)', new_ecs)
+                self.db.executemany('INSERT OR REPLACE INTO gene_counts (taxon_id, datatype, ec_id, gene_count) VALUES (?, ?, ?, ?)', gene_counts)
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                ## the ecs of the batch were not inserted either
+                self.ec_ids = dict(self.db.execute('SELECT ec, ec_id FROM ecs'))
+                raise
+
+        self.count += len(self.pending)
+        self.pending = list()
+
+    def close(self):
+        """
+        insert what is left, build the indexes and close the database
+        """
+
+        with self.lock:
+
+            self.flush()
+
+            with METRICS.timed('sqlite_index'):
+                for name, statement in INDEXES.items():
+                    self.db.execute(statement)
+                self.db.execute('ANALYZE')
+
+            self.db.close()
+
+        print("Wrote %d taxa to %s"%(self.count, self.path))
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='jgi_sqlite 1.0')
+
+    if arguments['--ec']:
+        db = sqlite3.connect(arguments['DB'])
+        for taxon_id, datatype, gene_count in taxa_with_ec(db, arguments['--ec'], int(arguments['--min_gene_count']), arguments['--datatype']):
+            print("%s\t%s\t%s"%(taxon_id, datatype, gene_count))
+        db.close()
+    else:
+        taxon_db = TaxonDatabase(arguments['DB'], batch_size=int(arguments['--batch_size']))
+        taxon_db.write_all(iter_taxa(arguments['SOURCE']))
+        taxon_db.close()
@@ -0,0 +1,217 @@
+## jgi_waits
+"""
+Readiness-based page waits shared by the scrape_*_from_jgi scripts.
+
+Every navigation used to be followed by a fixed `time.sleep(5)`. Instead, each
+navigation now waits only until the page it loaded is usable for its stage:
+
+  homepage     the document has been parsed
+  list         the YAHOO DataSource script is present
+  list_json    the <body> text parses as json
+  taxon        the metadata table exists
+  enzyme       the YAHOO DataSource script is present
+  enzyme_json  the <body> text parses as json
+
+Per-stage timeouts live in STAGE_TIMEOUTS (see `configure_waits`) and the time
+each wait actually took is added to running totals in WAIT_TIMES (see
+`wait_summary`), so a crawl of any length keeps a few numbers per stage.
+"""
+
+import re
+import json
+import time
+import threading
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
+from selenium.webdriver.support.ui import WebDriverWait
+
+DATASOURCE_REGEX = re.compile(r'var myDataSource = new YAHOO\.util\.DataSource\(\"(.*)\"\);')
+
+## seconds to wait for each stage before giving up
+STAGE_TIMEOUTS = {
+    'homepage': 30,
+    'list': 60,
+    'list_json': 120,
+    'taxon': 30,
+    'enzyme': 30,
+    'enzyme_json': 60,
+}
+
+## seconds between readiness checks
+POLL_FREQUENCY = 0.1
+
+## stage -> [number of waits, total seconds, longest wait in seconds] of the navigations of that stage
+WAIT_TIMES = dict()
+WAIT_TIMES_LOCK = threading.Lock()
+
+def document_parsed(driver):
+    """
+    readiness check: the html document has been fully parsed
+
+    :param driver: the chrome driver object
+    :returns: page source once parsed, otherwise False
+    """
+
+    if driver.execute_script('return document.readyState') in ('interactive', 'complete'):
+        return driver.page_source
+
+    return False
+
+def datasource_present(driver):
+    """
+    readiness check: the YAHOO DataSource script is in the page source
+
+    :param driver: the chrome driver object
+    :returns: page source once the DataSource script is present, otherwise False
+    """
+
+    htmlSource = driver.page_source
+
+    if DATASOURCE_REGEX.search(htmlSource):
+        return htmlSource
+
+    return False
+
+def body_json_parses(driver):
+    """
+    readiness check: the text of <body> is complete json
+
+    :param driver: the chrome driver object
+    :returns: single element list holding the parsed json (so an empty json is still truthy), otherwise False
+    """
+
+    try:
+        return [json.loads(driver.find_element_by_tag_name('body').text)]
+    except ValueError:
+        return False
+
+def metadata_table_present(driver):
+    """
+    readiness check: the metadata table exists and the document has been parsed
+
+    :param driver: the chrome driver object
+    :returns: page source once the metadata table is present, otherwise False
+    """
+
+    if driver.find_elements_by_tag_name('table'):
+        return document_parsed(driver)
+
+    return False
+
+STAGE_CONDITIONS = {
+    'homepage': document_parsed,
+    'list': datasource_present,
+    'list_json': body_json_parses,
+    'taxon': metadata_table_present,
+    'enzyme': datasource_present,
+    'enzyme_json': body_json_parses,
+}
+
+def configure_waits(stage_timeouts=None, poll_frequency=None):
+    """
+    override the default per-stage timeouts and/or the poll frequency
+
+    :param stage_timeouts: dict of stage -> timeout in seconds (e.g. {'list_json': 300})
+    :param poll_frequency: seconds between readiness checks
+    """
+
+    global POLL_FREQUENCY
+
+    for stage, timeout in (stage_timeouts or dict()).items():
+        if stage not in STAGE_CONDITIONS:
+            raise ValueError("Unknown stage '%s'; stage must be one of %s"%(stage, sorted(STAGE_CONDITIONS)))
+        STAGE_TIMEOUTS[stage] = timeout
+
+    if poll_frequency is not None:
+        POLL_FREQUENCY = poll_frequency
+
+def wait_for_stage(driver, stage, timeout=None):
+    """
+    block until the page currently loaded in driver is ready for stage
+
+    :param driver: the chrome driver object
+    :param stage: one of the keys of STAGE_CONDITIONS
+    :param timeout: seconds to wait [default=STAGE_TIMEOUTS[stage]]
+    :returns: whatever the stage's readiness check returned
+    """
+
+    condition = STAGE_CONDITIONS[stage]
+    timeout = STAGE_TIMEOUTS[stage] if timeout is None else timeout
+
+    start = time.time()
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=POLL_FREQUENCY,
+            ignored_exceptions=(NoSuchElementException, StaleElementReferenceException)).until(
+            condition, "Page not ready for stage '%s' after %ss: %s"%(stage, timeout, driver.current_url))
+    finally:
+        record_wait(stage, time.time() - start)
+
+def record_wait(stage, seconds):
+    """
+    add one wait of stage to the running totals in WAIT_TIMES (the worker threads of a crawl share them)
+    """
+
+    with WAIT_TIMES_LOCK:
+        totals = WAIT_TIMES.setdefault(stage, [0, 0., 0.])
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] = max(totals[2], seconds)
+
+def load_page(driver, url, stage):
+    """
+    load url -> wait until ready for stage -> retrieve htmlSource
+
+    :param driver: the chrome driver object
+    :param url: url of the page to load
+    :param stage: one of 'homepage', 'list', 'taxon', or 'enzyme'
+    :returns: html source of the page
+    """
+
+    ## a page that never finishes loading raises a TimeoutException instead of hanging the crawl
+    driver.set_page_load_timeout(STAGE_TIMEOUTS[stage])
+    driver.get(url)
+
+    return wait_for_stage(driver, stage)
+
+def load_json(driver, url, stage):
+    """
+    load url -> wait until the <body> json parses -> retrieve json
+
+    :param driver: the chrome driver object
+    :param url: url of a YAHOO DataSource json
+    :param stage: one of 'list_json' or 'enzyme_json'
+    :returns: the parsed json
+    """
+
+    ## a page that never finishes loading raises a TimeoutException instead of hanging the crawl
+    driver.set_page_load_timeout(STAGE_TIMEOUTS[stage])
+    driver.get(url)
+
+    return wait_for_stage(driver, stage)[0]
+
+def wait_summary():
+    """
+    summarize how long the waits of each stage took
+
+    :returns: dict of stage -> {'count', 'total', 'mean', 'max'} (seconds)
+    """
+
+    summary = dict()
+    with WAIT_TIMES_LOCK:
+        for stage, (count, total, longest) in WAIT_TIMES.items():
+            if count:
+                summary[stage] = {'count': count, 'total': total, 'mean': total/count, 'max': longest}
+
+    return summary
+
+def print_wait_summary():
+    """
+    print the time spent waiting on each stage
+    """
+
+    summary = wait_summary()
+    if not summary:
+        return
+
+    print("Time spent waiting for pages:")
+    for stage, stats in sorted(summary.items()):
+        print("  %-12s n=%-7d total=%9.1fs mean=%6.2fs max=%6.2fs"%(stage, stats['count'], stats['total'], stats['mean'], stats['max']))
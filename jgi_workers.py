@@ -0,0 +1,136 @@
+## jgi_workers
+"""
+Parallel taxon scraping shared by the scrape_*_from_jgi scripts.
+
+`scrape_in_parallel` runs a pool of worker threads, each with its own fetcher
+(and so, with the chrome backend, its own WebDriver instance). Workers pull
+taxon urls from a shared queue, so a slow taxon only holds up the worker that
+took it. Each taxon's json is written by the worker that scraped it, and the
+results are collected (or handed to `on_result`) in whatever order the taxa
+finish. A taxon that raises (scraping it, or in `on_result`) stops the whole
+crawl, unless `on_error` is given (e.g. to quarantine it, see jgi_retry), in
+which case the worker moves on to the next taxon. With a `manifest`, a taxon
+is recorded as completed only once `on_result` has written it out, so a
+crash in between leaves it to be scraped again by `--resume`. A SIGTERM or Ctrl-C stops every worker after the taxon
+it is on, each closing its own fetcher on the way out.
+"""
+
+import queue
+import threading
+
+def scrape_in_parallel(taxon_urls, scrape_taxon, workers, make_fetcher, first_fetcher=None, on_result=None, on_error=None, manifest=None):
+    """
+    scrape every taxon url with a pool of workers pulling from a shared queue
+
+    :param taxon_urls: list of urls, one per taxon
+    :param scrape_taxon: function(fetcher, taxon_url) -> result, e.g. a wrapped scrape_single_bacteria
+    :param workers: number of workers (and fetchers) to run at once
+    :param make_fetcher: function returning a new fetcher object (see jgi_fetch)
+    :param first_fetcher: already open fetcher for the first worker to use (it is not closed here)
+    :param on_result: function(result) called (one at a time) as each taxon finishes, instead of collecting the results
+    :param on_error: function(taxon_url, exception) called when a taxon raises, instead of stopping the crawl
+    :param manifest: CrawlManifest (or any object with mark_completed(taxon_url) and mark_failed(taxon_url, exception))
+        to record each taxon in once it is written out or has failed (see jgi_manifest), or None
+    :returns: list of results, in the order the taxa finished (empty when on_result is given)
+    """
+
+    url_queue = queue.Queue()
+    for taxon_url in taxon_urls:
+        url_queue.put(taxon_url)
+
+    results = list()
+    errors = list()
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def failed(taxon_url, e):
+        """
+        :returns: whether the crawl goes on past the failed taxon
+        """
+
+        if manifest is not None:
+            manifest.mark_failed(taxon_url, e)
+
+        if on_error is not None:
+            on_error(taxon_url, e)
+            return True
+
+        ## a failing taxon stops the whole crawl, same as when scraping serially
+        with lock:
+            errors.append(e)
+        stop.set()
+
+        return False
+
+    def work(fetcher):
+
+        while not stop.is_set():
+
+            try:
+                taxon_url = url_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                result = scrape_taxon(fetcher, taxon_url)
+            except Exception as e:
+                if failed(taxon_url, e):
+                    continue
+                return
+
+            error = None
+            with lock:
+                try:
+                    if on_result is not None:
+                        on_result(result)
+                    else:
+                        results.append(result)
+                except Exception as e:
+                    error = e
+                else:
+                    if manifest is not None:
+                        manifest.mark_completed(taxon_url)
+
+            if error is not None and not failed(taxon_url, error):
+                return
+
+    def run_worker(use_first_fetcher):
+
+        try:
+            fetcher = first_fetcher if use_first_fetcher else make_fetcher()
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            stop.set()
+            return
+
+        try:
+            work(fetcher)
+        finally:
+            if not use_first_fetcher:
+                fetcher.close()
+
+    workers = max(1, min(workers, len(taxon_urls)))
+
+    if workers == 1:
+        run_worker(first_fetcher is not None)
+    else:
+        threads = [threading.Thread(target=run_worker, args=(i == 0 and first_fetcher is not None,), name='jgi-worker-%d'%i)
+            for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except BaseException:
+            ## a SIGTERM (see jgi_driver.exit_on_sigterm) or Ctrl-C lands here in the main thread: stop
+            ## the workers after their current taxon, instead of letting them drain the queue, and re-raise
+            stop.set()
+            for thread in threads:
+                thread.join()
+            raise
+
+    if errors:
+        raise errors[0]
+
+    return results
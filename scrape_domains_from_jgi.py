@@ -0,0 +1,524 @@
+## jgi_domains_scraping
+"""
+Scrape the EC numbers of several domains (and metagenome ecosystem classes) from JGI in one run.
+`scrape_domains_from_jgi` is the only function meant to be called directly.
+
+The list jsons of every domain are loaded first and their taxa put into one
+frontier, which a single pool of fetchers (or, with the 'async' engine, one
+connection pool) works through. Each domain is written to its own dir,
+SAVE_DIR/<domain>, exactly as its scrape_<domain>_from_jgi script would
+(jsons, manifest, list snapshot and concatenated json).
+
+Usage:
+  scrape_domains_from_jgi.py SAVE_DIR [options]
+
+
+Arguments:
+  SAVE_DIR  directory to write one dir of jsons per domain to (no \ required after name)
+
+Options:
+  --domains=<d>    list; can be 'archaea', 'bacteria', 'eukarya', or 'metagenomes' [default: ['archaea', 'bacteria', 'eukarya', 'metagenomes']]
+  --database=<db>    Database to use, either 'jgi' or 'all' [default: jgi]
+  --homepage=<hp>    url of jgi homepage [default: https://img.jgi.doe.gov/cgi-bin/m/main.cgi]
+  --ecosystem_classes=<ec>  list; can be 'Engineered', 'Environmental', or 'Host-associated' (these are 3 different links on the homepage) [default: ['Engineered', 'Environmental', 'Host-associated']]
+  --datatypes=<dt>  list; can be 'assembled', 'unassembled', or 'both' (species which type of genomic data to pull ECs from) [default: ['assembled','unassembled','both']]
+  --write_concatenated_json=<wj>     write a concatenated json per domain (see jgi_output) [default: True]
+  --concatenated_format=<cf>    'json' (json array) or 'jsonl' (json lines); each taxon is appended to its domain's concatenated file as it finishes (see jgi_output) [default: json]
+  --stage_timeouts=<st>    dict of seconds to wait for each stage's page to be ready, e.g. {'list_json': 300} (see jgi_waits.STAGE_TIMEOUTS) [default: {}]
+  --backend=<be>    how pages are fetched, either 'http' (pooled keep-alive session) or 'chrome' (see jgi_fetch) [default: http]
+  --chrome_fallback=<cf>    with the 'http' backend, load pages that need javascript in chrome [default: True]
+  --driver_profile=<dp>    chrome started for --backend=chrome or the chrome fallback: 'lean' (headless, 'eager' page loads, images, css, fonts and trackers blocked) or 'default' (a plain, headed chrome) (see jgi_driver) [default: lean]
+  --chromedriver=<cd>    path of the chromedriver executable [default: ~/chromedriver]
+  --page_load_strategy=<pl>    chrome page load strategy, 'normal', 'eager' or 'none', instead of the --driver_profile's
+  --chrome_args=<ca>    list of extra chrome command line switches, e.g. "['--window-size=1280,800']" [default: []]
+  --driver_max_pages=<dm>    pages a chrome loads before it is quit and a fresh one started, 0 for no limit (see jgi_driver) [default: 1000]
+  --driver_max_rss_mb=<dr>    memory in MB of a chrome past which it is quit and a fresh one started, 0 for no limit [default: 2048]
+  --workers=<n>    number of fetchers (each with its own chrome when --backend=chrome) shared by every domain [default: 1]
+  --engine=<en>    either 'threads' (--workers fetchers from --backend) or 'async' (one asyncio http connection pool, see jgi_async) [default: threads]
+  --per_host=<ph>    with the 'async' engine, max number of requests in flight to any one host [default: 8]
+  --taxa_in_flight=<tf>    with the 'async' engine, max number of taxa being scraped at once, across every domain [default: 200]
+  --resume    skip taxa completed by an earlier crawl into SAVE_DIR (see jgi_manifest), retrying failed and pending ones
+  --incremental    only scrape taxa added to or changed in the list jsons since the last crawl into SAVE_DIR, keeping the jsons of unchanged ones (see jgi_delta)
+  --cache_dir=<cd>    keep fetched pages in an on-disk cache in this dir (see jgi_cache)
+  --cache_ttl=<ct>    seconds a cached page is used without revalidating it [default: 604800]
+  --cache_max_mb=<cm>    max size of the cache in MB; least recently used pages are evicted past it [default: 10240]
+  --rate=<r>    requests per second sent to each host at first; raised while responses are steady and cut on 429/5xx, timeouts or slow responses (see jgi_ratelimit) [default: 5]
+  --max_rate=<mr>    max requests per second sent to any one host [default: 100]
+  --retries=<r>    times a failing taxon is scraped again, after a jittered backoff, before it is quarantined (see jgi_retry) [default: 2]
+  --retry_delay=<rd>    seconds the backoff between retries starts at [default: 2]
+  --metrics=<mp>    write per-stage latency histograms and counters to this file every --metrics_interval seconds, in the Prometheus text format if it ends in .prom, as json otherwise (see jgi_metrics)
+  --metrics_interval=<mi>    seconds between metrics reports [default: 60]
+  --redrive    only scrape the taxa quarantined by earlier crawls into SAVE_DIR (see jgi_retry)
+  --archive_dir=<ad>    append every page and json fetched, of every domain, to a compressed archive in this dir, indexed by url and taxon id (see jgi_archive)
+  --reparse    rebuild the jsons of SAVE_DIR from the archive in --archive_dir instead of fetching anything, one domain after another, each in one process per core
+  --pack    write the taxa of each domain into a zstd compressed pack, SAVE_DIR/<domain>_pack (see jgi_pack), instead of one <taxon_id>.json each
+  --sqlite=<db>    also insert the taxa of every domain into this sqlite database, indexed by ec and gene count (see jgi_sqlite)
+"""
+
+import os
+from docopt import docopt
+from ast import literal_eval
+from jgi_waits import configure_waits, print_wait_summary
+from jgi_driver import configure_driver, print_driver_summary
+from jgi_fetch import make_fetcher
+from jgi_workers import scrape_in_parallel
+from jgi_manifest import CrawlManifest, iter_taxon_jsons
+from jgi_output import ConcatenatedWriter, fan_out
+from jgi_delta import ListDelta
+from jgi_cache import PageCache
+from jgi_ratelimit import RateLimiter
+from jgi_retry import Quarantine, with_retries
+from jgi_metrics import MetricsReporter
+from jgi_archive import ResponseArchive, ArchiveFetcher, reparse_archive
+import scrape_archaea_from_jgi as archaea
+import scrape_bacteria_from_jgi as bacteria
+import scrape_eukarya_from_jgi as eukarya
+import scrape_metagenomes_from_jgi as metagenomes
+
+DOMAINS = ('archaea', 'bacteria', 'eukarya', 'metagenomes')
+
+## domain -> the script whose functions scrape it
+SCRIPTS = {'archaea': archaea, 'bacteria': bacteria, 'eukarya': eukarya, 'metagenomes': metagenomes}
+
+activate_driver = archaea.activate_driver
+
+class HomepageOnce(object):
+    """
+    fetcher wrapper loading the homepage only once, however many domain links are read off it
+    """
+
+    def __init__(self, fetcher):
+        """
+        :param fetcher: the fetcher object used to load pages (see jgi_fetch)
+        """
+
+        self.fetcher = fetcher
+        self.homepages = dict()
+
+    def load_page(self, url, stage):
+        """
+        :param url: url of the page to load
+        :param stage: one of 'homepage', 'list', 'taxon', or 'enzyme'
+        :returns: html source of the page
+        """
+
+        if stage != 'homepage':
+            return self.fetcher.load_page(url, stage)
+
+        if url not in self.homepages:
+            self.homepages[url] = self.fetcher.load_page(url, stage)
+
+        return self.homepages[url]
+
+    def load_json(self, url, stage):
+        return self.fetcher.load_json(url, stage)
+
+class FrontierManifest(object):
+    """
+    records the (domain crawl, taxon_url) items of a frontier in the manifest of their domain
+    """
+
+    def mark_completed(self, item):
+        item[0].manifest.mark_completed(item[1])
+
+    def mark_failed(self, item, error):
+        item[0].manifest.mark_failed(item[1], error)
+
+class DomainCrawl(object):
+    """
+    the list pages, scrape functions and output (manifest, list snapshot, concatenated json) of one domain of the run
+    """
+
+    def __init__(self, domain, save_dir, homepage_url, database='jgi',
+        ecosystemClasses=['Engineered', 'Environmental', 'Host-associated'],
+        datatypes=['assembled','unassembled','both'],
+        resume=False, incremental=False, write_concatenated_json=True, concatenated_format='json',
+        retries=2, retry_delay=2.0, redrive=False, pack=False, taxon_db=None):
+        """
+        :param domain: one of DOMAINS
+        :param save_dir: dir to write the domain's jsons to
+        :param homepage_url: url of the jgi homepage
+        :param database: 'jgi' or 'all'
+        :param ecosystemClasses: for 'metagenomes', the ecosystem classes to scrape
+        :param datatypes: for 'metagenomes', the datatypes to pull ECs from
+        :param resume: skip taxa completed by an earlier crawl into save_dir (see jgi_manifest)
+        :param incremental: only scrape taxa added or changed since the last crawl into save_dir (see jgi_delta)
+        :param write_concatenated_json: append each taxon to the domain's concatenated file as it finishes (see jgi_output)
+        :param concatenated_format: 'json' or 'jsonl'
+        :param retries: number of times a failing taxon is scraped again before it is quarantined (see jgi_retry)
+        :param retry_delay: seconds the backoff between retries starts at
+        :param redrive: only scrape the taxa quarantined by earlier crawls into save_dir
+        :param pack: write the taxa into a pack next to save_dir instead of one json each (see jgi_pack)
+        :param taxon_db: TaxonDatabase to also insert the taxa into (see jgi_sqlite), shared by the domains of the run, or None
+        """
+
+        if domain not in DOMAINS:
+            raise ValueError("Domain must be one of %s"%(DOMAINS,))
+
+        self.domain = domain
+        self.save_dir = save_dir
+        self.homepage_url = homepage_url
+        self.database = database
+        self.ecosystemClasses = ecosystemClasses
+        self.datatypes = datatypes
+        self.resume = resume
+        self.redrive = redrive
+
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+
+        self.manifest = CrawlManifest(save_dir)
+        if resume or redrive:
+            self.manifest.load(sqlite_path=taxon_db.path if taxon_db is not None else None)
+
+        ## a redrive loads no list json, so there is nothing to diff
+        self.delta = ListDelta(save_dir) if incremental and not redrive else None
+
+        ## taxa still failing after their retries are set aside instead of stopping the crawl
+        self.quarantine = Quarantine(save_dir)
+
+        self.concatenated = ConcatenatedWriter(save_dir, fmt=concatenated_format) if write_concatenated_json else None
+
+        ## with a pack, taxa go into it instead of each into its own json
+        self.taxon_pack = None
+        if pack:
+            ## jgi_pack needs zstandard, only for --pack
+            from jgi_pack import TaxonPack, pack_path
+            self.taxon_pack = TaxonPack(pack_path(save_dir))
+        self.json_dir = None if pack else save_dir
+
+        ## each taxon is written out as soon as it is scraped instead of being kept in memory
+        self.taxon_db = taxon_db
+
+        self.on_result = fan_out(self.concatenated, self.taxon_pack, taxon_db)
+
+        self.scrape_taxon = with_retries(self.scrape_single, retries=retries, retry_delay=retry_delay)
+
+    def list_urls(self, fetcher):
+        """
+        :param fetcher: the fetcher object used to load the homepage (see jgi_fetch)
+        :returns: urls of the domain's list pages (one per ecosystem class for metagenomes), none for a redrive
+        """
+
+        if self.redrive:
+            return []
+
+        if self.domain == 'archaea':
+            return [archaea.get_archaea_url_from_jgi_img_homepage(fetcher,self.homepage_url,database=self.database)]
+        elif self.domain == 'bacteria':
+            return [bacteria.get_bacteria_url_from_jgi_img_homepage(fetcher,self.homepage_url,database=self.database)]
+        elif self.domain == 'eukarya':
+            return [eukarya.get_eukarya_url_from_jgi_img_homepage(fetcher,self.homepage_url,database=self.database)]
+
+        return [metagenomes.get_ecosystemclass_url_from_jgi_img_homepage(fetcher,self.homepage_url,ecosystemClass,database=self.database)
+            for ecosystemClass in self.ecosystemClasses]
+
+    def load_list_json(self, fetcher, list_url):
+        """
+        :param fetcher: the fetcher object used to load pages (see jgi_fetch)
+        :param list_url: one of list_urls
+        :returns: json containing urls of each individual taxon of the list
+        """
+
+        if self.domain == 'archaea':
+            return archaea.get_archaea_json_from_archaea_url(fetcher,list_url)
+        elif self.domain == 'bacteria':
+            return bacteria.get_bacteria_json_from_bacteria_url(fetcher,list_url)
+        elif self.domain == 'eukarya':
+            return eukarya.get_eukarya_json_from_eukarya_url(fetcher,list_url)
+
+        return metagenomes.get_ecosystemclass_json_from_ecosystem_class_url(fetcher,list_url)
+
+    def get_taxon_urls(self, list_json):
+        """
+        :param list_json: json of one of list_urls
+        :returns: list of all taxon urls in list_json
+        """
+
+        if self.domain == 'archaea':
+            return archaea.get_archaea_urls_from_archaea_json(None,self.homepage_url,list_json)
+        elif self.domain == 'bacteria':
+            return bacteria.get_bacteria_urls_from_bacteria_json(None,self.homepage_url,list_json)
+        elif self.domain == 'eukarya':
+            return eukarya.get_eukaryote_urls_from_eukarya_json(None,self.homepage_url,list_json)
+
+        return metagenomes.get_metagenome_urls_from_ecosystemclass_json(None,self.homepage_url,list_json)
+
+    def taxon_urls(self, fetcher, list_urls):
+        """
+        load every list json -> retrieve the urls of the taxa still to scrape (see jgi_manifest and jgi_delta)
+
+        :param fetcher: the fetcher object used to load pages (see jgi_fetch)
+        :param list_urls: urls of the domain's list pages
+        :returns: list of taxon urls
+        """
+
+        if self.redrive:
+            print("Redriving %d quarantined %s taxa ..."%(len(self.quarantine.taxon_urls()), self.domain))
+            return self.manifest.start(self.quarantine.taxon_urls())
+
+        taxon_urls = list()
+
+        for list_url in list_urls:
+
+            list_json = self.load_list_json(fetcher, list_url)
+
+            if self.delta is not None:
+                list_json = self.delta.select(list_json)
+
+            taxon_urls.extend(self.get_taxon_urls(list_json))
+
+        print("Found %d %s taxa."%(len(taxon_urls), self.domain))
+
+        return self.manifest.start(taxon_urls)
+
+    def scrape_single(self, fetcher, taxon_url):
+        """
+        load taxon_url -> scrape metadata and enzymes -> write <taxon_id>.json (see scrape_single_<domain> in the domain's script)
+        """
+
+        if self.domain == 'archaea':
+            return archaea.scrape_single_archaea(fetcher, taxon_url, self.json_dir)
+        elif self.domain == 'bacteria':
+            return bacteria.scrape_single_bacteria(fetcher, taxon_url, self.json_dir)
+        elif self.domain == 'eukarya':
+            return eukarya.scrape_single_eukaryote(fetcher, taxon_url, self.json_dir)
+
+        return metagenomes.scrape_single_metagenome(fetcher, taxon_url, self.json_dir, datatypes=self.datatypes)
+
+    def crawl_target(self, list_urls):
+        """
+        :param list_urls: urls of the domain's list pages
+        :returns: CrawlTarget for the 'async' engine (see jgi_async)
+        """
+
+        ## jgi_async needs aiohttp, only for the 'async' engine
+        from jgi_async import CrawlTarget
+
+        if self.domain == 'archaea':
+            get_metadata = archaea.get_archaea_metadata_while_on_archaea_page
+            get_enzyme_urls = lambda taxon_url, htmlSource: {'genome': archaea.get_enzyme_url_from_archaea_url(taxon_url, htmlSource)}
+        elif self.domain == 'bacteria':
+            get_metadata = bacteria.get_bacteria_metadata_while_on_bacteria_page
+            get_enzyme_urls = lambda taxon_url, htmlSource: {'genome': bacteria.get_enzyme_url_from_bacteria_url(taxon_url, htmlSource)}
+        elif self.domain == 'eukarya':
+            get_metadata = eukarya.get_eukaryote_metadata_while_on_eukaryote_page
+            get_enzyme_urls = lambda taxon_url, htmlSource: {'genome': eukarya.get_enzyme_url_from_eukaryote_url(taxon_url, htmlSource)}
+        else:
+            get_metadata = metagenomes.get_metagenome_metadata_while_on_metagenome_page
+            get_enzyme_urls = lambda taxon_url, htmlSource: metagenomes.get_enzyme_urls_from_metagenome_url(taxon_url, htmlSource, self.datatypes)
+
+        taxon_id_key = 'Taxon Object ID' if self.domain == 'metagenomes' else 'Taxon ID'
+
+        return CrawlTarget(list_urls, self.json_dir, self.get_taxon_urls, get_metadata, get_enzyme_urls,
+            SCRIPTS[self.domain].parse_enzyme_info_from_enzyme_json, taxon_id_key,
+            manifest=self.manifest, delta=self.delta, on_result=self.on_result,
+            on_error=self.quarantine.add, taxon_urls=self.quarantine.taxon_urls() if self.redrive else None)
+
+    def finish(self):
+        """
+        checkpoint the manifest, rewrite the quarantine, save the list snapshot, close the concatenated json (carrying over taxa of earlier runs)
+        and the pack, and insert the taxa of earlier runs missing from the database
+        """
+
+        self.manifest.close()
+
+        self.quarantine.close(self.manifest.completed)
+
+        if self.delta is not None:
+            self.delta.save(self.manifest.completed)
+
+        ## taxa scraped by earlier runs and not scraped again in this one
+        carried_ids = set()
+        if self.resume or self.redrive:
+            carried_ids |= self.manifest.previously_completed
+        if self.delta is not None:
+            carried_ids |= self.delta.unchanged
+
+        read_carried = lambda taxon_ids: self.taxon_pack.iter_taxa(taxon_ids) if self.taxon_pack is not None else iter_taxon_jsons(self.save_dir, taxon_ids)
+
+        if self.concatenated is not None:
+            self.concatenated.write_all(read_carried(carried_ids))
+            self.concatenated.close()
+
+        if self.taxon_db is not None:
+            self.taxon_db.insert_missing(carried_ids, read_carried)
+
+        if self.taxon_pack is not None:
+            self.taxon_pack.close()
+
+def scrape_domains_from_jgi(save_dir,
+    domains=DOMAINS,
+    homepage_url='https://img.jgi.doe.gov/cgi-bin/m/main.cgi',
+    database='jgi',
+    ecosystemClasses = ['Engineered', 'Environmental', 'Host-associated'],
+    datatypes = ['assembled','unassembled','both'],
+    write_concatenated_json=True,
+    stage_timeouts=None,
+    backend='http',
+    chrome_fallback=True,
+    workers=1,
+    engine='threads',
+    per_host=8,
+    taxa_in_flight=200,
+    resume=False,
+    cache_dir=None,
+    cache_ttl=7*24*3600,
+    cache_max_mb=10240,
+    rate=5.0,
+    max_rate=100.0,
+    retries=2,
+    retry_delay=2.0,
+    redrive=False,
+    metrics_path=None,
+    metrics_interval=60.0,
+    incremental=False,
+    concatenated_format='json',
+    archive_dir=None,
+    reparse=False,
+    pack=False,
+    sqlite_path=None,
+    driver_profile='lean',
+    chromedriver='~/chromedriver',
+    page_load_strategy=None,
+    chrome_args=None,
+    driver_max_pages=1000,
+    driver_max_rss_mb=2048):
+
+    configure_waits(stage_timeouts)
+
+    configure_driver(profile=driver_profile, chromedriver=chromedriver, page_load_strategy=page_load_strategy, arguments=chrome_args,
+        max_pages=driver_max_pages, max_rss_mb=driver_max_rss_mb)
+
+    reporter = MetricsReporter(metrics_path, interval=metrics_interval) if metrics_path else None
+
+    cache = PageCache(cache_dir, ttl=cache_ttl, max_bytes=cache_max_mb*1024**2) if cache_dir else None
+
+    ## every request of the crawl, whichever fetcher sends it, goes through one limiter
+    limiter = RateLimiter(rate=rate, max_rate=max_rate)
+
+    ## one database for every domain, closed once they have all finished
+    taxon_db = None
+    if sqlite_path:
+        from jgi_sqlite import TaxonDatabase
+        taxon_db = TaxonDatabase(sqlite_path)
+
+    crawls = [DomainCrawl(domain, os.path.join(save_dir, domain), homepage_url, database=database,
+        ecosystemClasses=ecosystemClasses, datatypes=datatypes, resume=resume, incremental=incremental and not reparse,
+        write_concatenated_json=write_concatenated_json, concatenated_format=concatenated_format,
+        retries=retries, retry_delay=retry_delay, redrive=redrive, pack=pack, taxon_db=taxon_db) for domain in domains]
+
+    if reparse and not archive_dir:
+        raise ValueError("--reparse needs the --archive_dir to reparse from")
+
+    ## a reparse reads the archive instead of adding to it
+    archive = ResponseArchive(archive_dir) if archive_dir and not reparse else None
+
+    ## a reparse answers every load, homepage and list pages included, from the archive
+    fetcher = ArchiveFetcher(archive_dir) if reparse else make_fetcher(backend, activate_driver, chrome_fallback=chrome_fallback, cache=cache, limiter=limiter, archive=archive)
+
+    print("Scraping %s ..."%', '.join(domains))
+
+    ## every domain link is read off a single load of the homepage
+    homepage_fetcher = HomepageOnce(fetcher)
+    list_urls = [crawl.list_urls(homepage_fetcher) for crawl in crawls]
+
+    if reparse:
+
+        ## one domain after another, each over every core
+        for crawl, crawl_list_urls in zip(crawls, list_urls):
+            reparse_archive(archive_dir, crawl.taxon_urls(fetcher, crawl_list_urls), crawl.scrape_single,
+                manifest=crawl.manifest, on_result=crawl.on_result, on_error=crawl.quarantine.add)
+
+    elif engine == 'async':
+
+        from jgi_async import crawl_targets_async
+
+        crawl_targets_async([crawl.crawl_target(crawl_list_urls) for crawl, crawl_list_urls in zip(crawls, list_urls)],
+            per_host=per_host, taxa_in_flight=taxa_in_flight, cache=cache, limiter=limiter, retries=retries, retry_delay=retry_delay,
+            archive=archive)
+
+    else:
+
+        ## one frontier of (domain crawl, taxon_url) worked through by one pool of fetchers
+        frontier = [(crawl, taxon_url) for crawl, crawl_list_urls in zip(crawls, list_urls)
+            for taxon_url in crawl.taxon_urls(fetcher, crawl_list_urls)]
+
+        print("Scraping %d taxa with %d workers ..."%(len(frontier), workers))
+
+        scrape_in_parallel(frontier,
+            lambda fetcher, item: (item[0], item[0].scrape_taxon(fetcher, item[1])),
+            workers, lambda: make_fetcher(backend, activate_driver, chrome_fallback=chrome_fallback, cache=cache, limiter=limiter, archive=archive), first_fetcher=fetcher,
+            on_result=lambda result: result[0].on_result(result[1]),
+            on_error=lambda item, e: item[0].quarantine.add(item[1], e), manifest=FrontierManifest())
+
+    print("Done scraping %s."%', '.join(domains))
+    print("="*90)
+
+    for crawl in crawls:
+        crawl.finish()
+
+    if taxon_db is not None:
+        taxon_db.close()
+
+    fetcher.close()
+
+    if archive is not None:
+        archive.close()
+
+    if cache is not None:
+        cache.print_summary()
+        cache.close()
+
+    limiter.print_summary()
+
+    print_wait_summary()
+
+    print_driver_summary()
+
+    if reporter is not None:
+        reporter.close()
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='scrape_domains_from_jgi 1.0')
+
+    if not os.path.exists(arguments['SAVE_DIR']):
+        os.makedirs(arguments['SAVE_DIR'])
+
+    scrape_domains_from_jgi(arguments['SAVE_DIR'],
+        domains=literal_eval(arguments['--domains']),
+        homepage_url=arguments['--homepage'],
+        database=arguments['--database'],
+        ecosystemClasses=literal_eval(arguments['--ecosystem_classes']),
+        datatypes=literal_eval(arguments['--datatypes']),
+        write_concatenated_json=literal_eval(arguments['--write_concatenated_json']),
+        stage_timeouts=literal_eval(arguments['--stage_timeouts']),
+        backend=arguments['--backend'],
+        chrome_fallback=literal_eval(arguments['--chrome_fallback']),
+        workers=int(arguments['--workers']),
+        engine=arguments['--engine'],
+        per_host=int(arguments['--per_host']),
+        taxa_in_flight=int(arguments['--taxa_in_flight']),
+        resume=arguments['--resume'],
+        cache_dir=arguments['--cache_dir'],
+        cache_ttl=float(arguments['--cache_ttl']),
+        cache_max_mb=float(arguments['--cache_max_mb']),
+        rate=float(arguments['--rate']),
+        max_rate=float(arguments['--max_rate']),
+        retries=int(arguments['--retries']),
+        retry_delay=float(arguments['--retry_delay']),
+        redrive=arguments['--redrive'],
+        metrics_path=arguments['--metrics'],
+        metrics_interval=float(arguments['--metrics_interval']),
+        incremental=arguments['--incremental'],
+        concatenated_format=arguments['--concatenated_format'],
+        archive_dir=arguments['--archive_dir'],
+        reparse=arguments['--reparse'],
+        pack=arguments['--pack'],
+        sqlite_path=arguments['--sqlite'],
+        driver_profile=arguments['--driver_profile'],
+        chromedriver=arguments['--chromedriver'],
+        page_load_strategy=arguments['--page_load_strategy'],
+        chrome_args=literal_eval(arguments['--chrome_args']),
+        driver_max_pages=int(arguments['--driver_max_pages']),
+        driver_max_rss_mb=float(arguments['--driver_max_rss_mb']))
@@ -4,12 +4,7 @@ Scrape individual metagenome EC numbers from JGI.
 `scrape_metagenomes_from_jgi` is the only function meant to be called directly.
 
 Usage:
-  scrape_metagenomes_from_jgi.py SAVE_DIR
-  scrape_metagenomes_from_jgi.py SAVE_DIR [--database=<db>]
-  scrape_metagenomes_from_jgi.py SAVE_DIR [--homepage=<hp>]
-  scrape_metagenomes_from_jgi.py SAVE_DIR [--write_concatenated_json=<wj>]
-  scrape_metagenomes_from_jgi.py SAVE_DIR [--ecosystem_classes=<ec>]
-  scrape_metagenomes_from_jgi.py SAVE_DIR [--datatypes=<dt>]
+  scrape_metagenomes_from_jgi.py SAVE_DIR [options]
 
 
 Arguments:
@@ -21,87 +16,122 @@ Options:
   --ecosystem_classes=<ec>  list; can be 'Engineered', 'Environmental', or 'Host-associated' (these are 3 different links on the homepage) [default: ['Engineered', 'Environmental', 'Host-associated']]
   --datatypes=<dt>  list; can be 'assembled', 'unassembled', or 'both' (species which type of genomic data to pull ECs from) [default: ['assembled','unassembled','both']]
   --write_concatenated_json=<wj>     write single concatenated json after all individual jsons are written [default: True]
+  --concatenated_format=<cf>    'json' (json array) or 'jsonl' (json lines); each taxon is appended to the concatenated file as it finishes (see jgi_output) [default: json]
+  --stage_timeouts=<st>    dict of seconds to wait for each stage's page to be ready, e.g. {'list_json': 300} (see jgi_waits.STAGE_TIMEOUTS) [default: {}]
+  --backend=<be>    how pages are fetched, either 'http' (pooled keep-alive session) or 'chrome' (see jgi_fetch) [default: http]
+  --chrome_fallback=<cf>    with the 'http' backend, load pages that need javascript in chrome [default: True]
+  --driver_profile=<dp>    chrome started for --backend=chrome or the chrome fallback: 'lean' (headless, 'eager' page loads, images, css, fonts and trackers blocked) or 'default' (a plain, headed chrome) (see jgi_driver) [default: lean]
+  --chromedriver=<cd>    path of the chromedriver executable [default: ~/chromedriver]
+  --page_load_strategy=<pl>    chrome page load strategy, 'normal', 'eager' or 'none', instead of the --driver_profile's
+  --chrome_args=<ca>    list of extra chrome command line switches, e.g. "['--window-size=1280,800']" [default: []]
+  --driver_max_pages=<dm>    pages a chrome loads before it is quit and a fresh one started, 0 for no limit (see jgi_driver) [default: 1000]
+  --driver_max_rss_mb=<dr>    memory in MB of a chrome past which it is quit and a fresh one started, 0 for no limit [default: 2048]
+  --workers=<n>    number of fetchers (each with its own chrome when --backend=chrome) scraping metagenomes in parallel [default: 1]
+  --engine=<en>    either 'threads' (--workers fetchers from --backend) or 'async' (one asyncio http connection pool, see jgi_async) [default: threads]
+  --per_host=<ph>    with the 'async' engine, max number of requests in flight to any one host [default: 8]
+  --taxa_in_flight=<tf>    with the 'async' engine, max number of metagenomes being scraped at once [default: 200]
+  --resume    skip taxa completed by an earlier crawl into SAVE_DIR (see jgi_manifest), retrying failed and pending ones
+  --incremental    only scrape taxa added to or changed in the list json since the last crawl into SAVE_DIR, keeping the jsons of unchanged ones (see jgi_delta)
+  --cache_dir=<cd>    keep fetched pages in an on-disk cache in this dir (see jgi_cache)
+  --cache_ttl=<ct>    seconds a cached page is used without revalidating it [default: 604800]
+  --cache_max_mb=<cm>    max size of the cache in MB; least recently used pages are evicted past it [default: 10240]
+  --rate=<r>    requests per second sent to each host at first; raised while responses are steady and cut on 429/5xx, timeouts or slow responses (see jgi_ratelimit) [default: 5]
+  --max_rate=<mr>    max requests per second sent to any one host [default: 100]
+  --retries=<r>    times a failing metagenome is scraped again, after a jittered backoff, before it is quarantined (see jgi_retry) [default: 2]
+  --retry_delay=<rd>    seconds the backoff between retries starts at [default: 2]
+  --metrics=<mp>    write per-stage latency histograms and counters to this file every --metrics_interval seconds, in the Prometheus text format if it ends in .prom, as json otherwise (see jgi_metrics)
+  --metrics_interval=<mi>    seconds between metrics reports [default: 60]
+  --redrive    only scrape the metagenomes quarantined by earlier crawls into SAVE_DIR (see jgi_retry)
+  --archive_dir=<ad>    append every page and json fetched to a compressed archive in this dir, indexed by url and taxon id (see jgi_archive)
+  --reparse    rebuild the jsons of SAVE_DIR from the archive in --archive_dir instead of fetching anything, in one process per core
+  --pack    write the taxa into a zstd compressed pack next to SAVE_DIR, SAVE_DIR_pack (see jgi_pack), instead of one <taxon_id>.json each
+  --sqlite=<db>    also insert the taxa into this sqlite database, indexed by ec and gene count (see jgi_sqlite)
 """
 
-from selenium import webdriver
-import time
 import os
 import re
 import json
 from docopt import docopt
 from ast import literal_eval
-from bs4 import BeautifulSoup
+from jgi_waits import configure_waits, print_wait_summary
+from jgi_driver import configure_driver, start_driver, print_driver_summary
+from jgi_fetch import make_fetcher
+from jgi_parse import parse_metadata_table, extract_detail_links
+from jgi_workers import scrape_in_parallel
+from jgi_manifest import CrawlManifest, iter_taxon_jsons
+from jgi_output import ConcatenatedWriter, fan_out
+from jgi_delta import ListDelta
+from jgi_cache import PageCache
+from jgi_ratelimit import RateLimiter
+from jgi_retry import Quarantine, with_retries
+from jgi_metrics import METRICS, MetricsReporter
+from jgi_archive import ResponseArchive, ArchiveFetcher, reparse_archive
 
 def activate_driver():
     """
     Activate chrome driver used to automate webpage navigation (see: https://sites.google.com/a/chromium.org/chromedriver/)
-    The chrome driver .exec file must be in the home directory
+    Chrome is started with the profile and chromedriver path set by configure_driver (see jgi_driver)
 
     :returns: driver [object]
     """
-    homedir = os.path.expanduser('~')
-    return webdriver.Chrome(homedir+'/chromedriver')
+    return start_driver()
 
-def get_ecosystemclass_url_from_jgi_img_homepage(driver,homepage_url,ecosystemClass,database='jgi'):
+def get_ecosystemclass_url_from_jgi_img_homepage(fetcher,homepage_url,ecosystemClass,database='jgi'):
     """
     load homepage_url -> retrieve ecosytemClass_url
 
-    :param driver: the chrome driver object
+    :param fetcher: the fetcher object used to load pages (see jgi_fetch)
     :param homepage_url: url of the jgi homepage. should be 'https://img.jgi.doe.gov/cgi-bin/m/main.cgi' as of 6/15/2017
     :param ecosystemClass: can be 'Engineered', 'Environmental', or 'Host-associated' (these are 3 different links on the homepage)
     :param database: choose to use only the jgi database, or all database [default=jgi]
     :returns: url of the eukarya database page
     """
 
-    driver.get(homepage_url)
-    time.sleep(5)
-    htmlSource = driver.page_source
+    htmlSource = fetcher.load_page(homepage_url,'homepage')
 
     ## All ampersands (&) must be followed by 'amp;'
     regex = r'href=\"main\.cgi(\?section=TaxonList&amp;domain=Metagenome&amp;seq_center=%s&amp;page=metaCatList&amp;phylum=%s)\"'%(database,ecosystemClass)
 
     match = re.search(regex, htmlSource)
+    if match is None:
+        raise ValueError("No link to ecosystemClass '%s' found on the homepage: %s"%(ecosystemClass,homepage_url))
     ecosystemClass_suffix = match.group(1)
     ecosystemClass_url = homepage_url+ecosystemClass_suffix
     # ecosystemClass_urls.append(ecosystemClass_url)
 
     return ecosystemClass_url
 
-def get_ecosystemclass_json_from_ecosystem_class_url(driver,ecosystemClass_url):
+def get_ecosystemclass_json_from_ecosystem_class_url(fetcher,ecosystemClass_url):
     """
     load ecosystemClass_url- > retrieve ecosystemClass_json_url -> load ecosystemClass_json_url -> retrieve ecosystemClass_json
 
-    :param driver: the chrome driver object
+    :param fetcher: the fetcher object used to load pages (see jgi_fetch)
     :param ecosystemClass_url: url of either the 'Engineered', 'Environmental', or 'Host-associated' ecosystemClasses (these are 3 different links on the homepage)
     :returns: json containing urls of each individual metagenome in specified ecosystemClass
     """
 
-    driver.get(ecosystemClass_url)
-    time.sleep(5)
-    htmlSource = driver.page_source
+    htmlSource = fetcher.load_page(ecosystemClass_url,'list')
     # driver.quit()
 
     regex = r'var myDataSource = new YAHOO\.util\.DataSource\(\"(.*)\"\);'
     match = re.search(regex, htmlSource)
+    if match is None:
+        raise ValueError("No YAHOO DataSource found on ecosystemClass page: %s"%ecosystemClass_url)
     ecosystemClass_json_suffix = match.group(1)
     ecosystemClass_url_prefix = ecosystemClass_url.split('main.cgi')[0]
     ecosystemClass_json_url = ecosystemClass_url_prefix+ecosystemClass_json_suffix
 
-    driver.get(ecosystemClass_json_url)
-    time.sleep(5)
-    # jsonSource = driver.page_source
-
     ## convert the jsonSource into a dict of dicts here
-    ecosystemClass_json = json.loads(driver.find_element_by_tag_name('body').text)
+    ecosystemClass_json = fetcher.load_json(ecosystemClass_json_url,'list_json')
 
     return ecosystemClass_json
 
 
-def get_metagenome_urls_from_ecosystemclass_json(driver,homepage_url,ecosystemClass_json):
+def get_metagenome_urls_from_ecosystemclass_json(fetcher,homepage_url,ecosystemClass_json):
     """
     parse ecosystemClass_json -> retrieve metagenome_urls
 
-    :param driver: the chrome driver object
+    :param fetcher: the fetcher object used to load pages (see jgi_fetch)
     :param homepage_url: url of the jgi homepage. should be 'https://img.jgi.doe.gov/cgi-bin/m/main.cgi' as of 6/15/2017
     :param ecosystemClass_json: json text of either the 'Engineered', 'Environmental', or 'Host-associated' ecosystemClasses
     :returns: list of all metagenome urls
@@ -114,24 +144,26 @@ def get_metagenome_urls_from_ecosystemclass_json(driver,homepage_url,ecosystemCl
     for htmlandjunk in all_GenomeNameSampleNameDisp:
         regex = r"<a href='main\.cgi(.*)'>"
         match = re.search(regex, htmlandjunk)
+        if match is None:
+            ## one malformed row should not stop the crawl
+            print("No taxon link found in list row: %s"%htmlandjunk)
+            continue
         html_suffix = match.group(1)
         full_url = homepage_url+html_suffix
         metagenome_urls.append(full_url)
 
     return metagenome_urls
 
-def get_metagenome_htmlSource_and_metadata(driver, metagenome_url):
+def get_metagenome_htmlSource_and_metadata(fetcher, metagenome_url):
     """
     load metagenome_url -> retrieve metagenome_htmlSource & metadata
 
-    :param driver: the chrome driver object
+    :param fetcher: the fetcher object used to load pages (see jgi_fetch)
     :param metagenome_url: url for an single metagenome
     :returns: html source of single metagenome, all metadata for that metagenome
     """
 
-    driver.get(metagenome_url)
-    time.sleep(5)
-    metagenome_htmlSource = driver.page_source
+    metagenome_htmlSource = fetcher.load_page(metagenome_url,'taxon')
 
     metadata_table_dict = get_metagenome_metadata_while_on_metagenome_page(metagenome_htmlSource)
 
@@ -143,53 +175,55 @@ def get_enzyme_url_from_metagenome_url(metagenome_url, metagenome_htmlSource, da
     """
     metagenome_htmlSource -> parse out enzyme_url
 
-    :param driver: the chrome driver object
     :param metagenome_url: url for an single metagenome
     :param data_type: can be assembled, unassembled, or both (refers to whether the metagenomes are assembled or not)
     :returns: url of a single metagenome's enzyme page
     """
 
+    return get_enzyme_urls_from_metagenome_url(metagenome_url, metagenome_htmlSource, [datatype])[datatype]
 
-    regex = r'<a href=\"(main\.cgi\?section=MetaDetail&amp;page=enzymes.*data_type=%s.*)\" onclick'%datatype
-    match = re.search(regex, metagenome_htmlSource)
+def get_enzyme_urls_from_metagenome_url(metagenome_url, metagenome_htmlSource, datatypes):
 
-    if match:
+    """
+    metagenome_htmlSource -> parse out the enzyme_url of every datatype, in a single scan of the page (see jgi_parse)
 
-        print("Metagenome url: %s ...\n...has datatype: %s"%(metagenome_url,datatype))
+    :param metagenome_url: url for an single metagenome
+    :param datatypes: list; can be 'assembled', 'unassembled', or 'both'
+    :returns: dict of datatype -> url of a single metagenome's enzyme page for that datatype, or None if it has none
+    """
 
-        enzyme_url_suffix = match.group(1)
-        enzyme_url_prefix = metagenome_url.split('main.cgi')[0]
-        enzyme_url = enzyme_url_prefix+enzyme_url_suffix
+    links = extract_detail_links(metagenome_htmlSource)
+    enzyme_url_prefix = metagenome_url.split('main.cgi')[0]
 
-    else:
+    enzyme_urls = dict()
+
+    for datatype in datatypes:
+
+        if datatype in links:
+
+            print("Metagenome url: %s ...\n...has datatype: %s"%(metagenome_url,datatype))
+
+            enzyme_urls[datatype] = enzyme_url_prefix+links[datatype]
 
-        print("Metagenome url: %s ...\n...does not have datatype: %s"%(metagenome_url,datatype))
+        else:
 
-        enzyme_url = None
+            print("Metagenome url: %s ...\n...does not have datatype: %s"%(metagenome_url,datatype))
 
-    return enzyme_url
+            enzyme_urls[datatype] = None
+
+    return enzyme_urls
 
 
 def get_metagenome_metadata_while_on_metagenome_page(htmlSource):
     """
     htmlSource -> dictionary of metagenome metadata
 
-    :param htmlSource: the metagenome_url driver's .page_source
+    :param htmlSource: the metagenome_url page's html source
     :returns: all metadata from a metagenome's html
     """
 
-    # return dict of metagenome table data
-    bs = BeautifulSoup(htmlSource,"html.parser")
-    metadata_table = bs.findAll('table')[0]
-
-    metadata_table_dict = dict()
-    for row in metadata_table.findAll('tr'):
-
-        if (len(row.findAll('th')) == 1) and (len(row.findAll('td')) == 1):
-
-            row_key = row.findAll('th')[0].text.rstrip()
-            row_value = row.findAll('td')[0].text.rstrip() if row.findAll('td')[0] else None
-            metadata_table_dict[row_key] = row_value
+    # return dict of metagenome table data (see jgi_parse)
+    metadata_table_dict = parse_metadata_table(htmlSource)
 
     metadata_table_dict.pop('Geographical Map', None)
 
@@ -197,32 +231,28 @@ def get_metagenome_metadata_while_on_metagenome_page(htmlSource):
 
     return metadata_table_dict
 
-def get_enzyme_json_from_enzyme_url(driver,enzyme_url):
+def get_enzyme_json_from_enzyme_url(fetcher,enzyme_url):
     """
     load enzyme_url -> retrieve enzyme_json_url -> load enzyme_json_url -> retrieve enzyme_json
 
-    :param driver: the chrome driver object
+    :param fetcher: the fetcher object used to load pages (see jgi_fetch)
     :param enzyme_url: url for an single enzyme type from an single metagenome
     :returns: json of single metagenome's enzyme data
     """
 
-    driver.get(enzyme_url)
-    time.sleep(5)
-    htmlSource = driver.page_source
+    htmlSource = fetcher.load_page(enzyme_url,'enzyme')
     # driver.quit()
 
     regex = r'var myDataSource = new YAHOO\.util\.DataSource\(\"(.*)\"\);'
     match = re.search(regex, htmlSource)
+    if match is None:
+        raise ValueError("No YAHOO DataSource found on enzyme page: %s"%enzyme_url)
     enzyme_json_suffix = match.group(1)
     enzyme_url_prefix = enzyme_url.split('main.cgi')[0]
     enzyme_json_url = enzyme_url_prefix+enzyme_json_suffix
 
-    driver.get(enzyme_json_url)
-    time.sleep(5)
-    # jsonSource = driver.page_source
-
     ## convert the jsonSource into a dict of dicts here
-    enzyme_json = json.loads(driver.find_element_by_tag_name('body').text)
+    enzyme_json = fetcher.load_json(enzyme_json_url,'enzyme_json')
 
     return enzyme_json
 
@@ -245,87 +275,243 @@ def parse_enzyme_info_from_enzyme_json(enzyme_json):
 
     return enzyme_dict
 
-def write_concatenated_json(save_dir,jgi_metagenomes):
+def scrape_single_metagenome(fetcher, metagenome_url, save_dir, datatypes=['assembled','unassembled','both']):
     """
-    write single json of all metagenome data
+    load metagenome_url -> scrape metadata and enzymes of each datatype -> write <taxon_object_id>.json
 
-    :param save_dir: dir where each single_metagenome_dict.json is saved to
-    :param jgi_metagenomes: dict of single_metagenome_dicts. Used to write single json.
+    :param fetcher: the fetcher object used to load pages (see jgi_fetch)
+    :param metagenome_url: url for an single metagenome
+    :param save_dir: dir to write the single_metagenome_dict.json to (None to write nothing, e.g. when the taxa are packed)
+    :param datatypes: list; can be 'assembled', 'unassembled', or 'both'
+    :returns: single_metagenome_dict (metadata and enzyme dict of each datatype of a single metagenome)
     """
 
-    print("Writing concatenated json to file...")
+    print("Scraping metagenome: %s ..."%metagenome_url)
+
+    metagenome_htmlSource, metadata_table_dict = get_metagenome_htmlSource_and_metadata(fetcher, metagenome_url)
+
+    single_metagenome_dict = {'metadata':metadata_table_dict}
+
+    taxon_object_id = metadata_table_dict['Taxon Object ID']
 
-    concatenated_fname = save_dir+'_concatenated.json'
+    enzyme_urls = get_enzyme_urls_from_metagenome_url(metagenome_url, metagenome_htmlSource, datatypes)
 
-    with open(concatenated_fname, 'w') as outfile:
+    for datatype in datatypes:
 
-        json.dump(jgi_metagenomes,outfile)
+        enzyme_url = enzyme_urls[datatype]
 
-    print("Done.")
+        if enzyme_url:
+
+            enzyme_json = get_enzyme_json_from_enzyme_url(fetcher,enzyme_url)
+
+            enzyme_dict = parse_enzyme_info_from_enzyme_json(enzyme_json)
+
+            single_metagenome_dict[datatype] = enzyme_dict
+
+    if save_dir is not None:
+        with METRICS.timed('write'):
+            with open(save_dir+'/'+taxon_object_id+'.json', 'w') as outfile:
+
+                json.dump(single_metagenome_dict,outfile)
+
+    print("Done scraping metagenome.")
+    print("-"*80)
+
+    return single_metagenome_dict
 
 def scrape_metagenomes_from_jgi(save_dir,
     homepage_url='https://img.jgi.doe.gov/cgi-bin/m/main.cgi',
     database='jgi',
     ecosystemClasses = ['Engineered', 'Environmental', 'Host-associated'],
     datatypes = ['assembled','unassembled','both'],
-    write_concatenated_json=True):
+    write_concatenated_json=True,
+    stage_timeouts=None,
+    backend='http',
+    chrome_fallback=True,
+    workers=1,
+    engine='threads',
+    per_host=8,
+    taxa_in_flight=200,
+    resume=False,
+    cache_dir=None,
+    cache_ttl=7*24*3600,
+    cache_max_mb=10240,
+    rate=5.0,
+    max_rate=100.0,
+    retries=2,
+    retry_delay=2.0,
+    redrive=False,
+    metrics_path=None,
+    metrics_interval=60.0,
+    incremental=False,
+    concatenated_format='json',
+    archive_dir=None,
+    reparse=False,
+    pack=False,
+    sqlite_path=None,
+    driver_profile='lean',
+    chromedriver='~/chromedriver',
+    page_load_strategy=None,
+    chrome_args=None,
+    driver_max_pages=1000,
+    driver_max_rss_mb=2048):
+
+    configure_waits(stage_timeouts)
+
+    configure_driver(profile=driver_profile, chromedriver=chromedriver, page_load_strategy=page_load_strategy, arguments=chrome_args,
+        max_pages=driver_max_pages, max_rss_mb=driver_max_rss_mb)
+
+    reporter = MetricsReporter(metrics_path, interval=metrics_interval) if metrics_path else None
+
+    cache = PageCache(cache_dir, ttl=cache_ttl, max_bytes=cache_max_mb*1024**2) if cache_dir else None
+
+    ## every request of the crawl, whichever fetcher sends it, goes through one limiter
+    limiter = RateLimiter(rate=rate, max_rate=max_rate)
+
+    manifest = CrawlManifest(save_dir)
+    if resume or redrive:
+        manifest.load(sqlite_path=sqlite_path)
+
+    ## a redrive loads no list json, and a reparse no new one, so there is nothing to diff
+    delta = ListDelta(save_dir) if incremental and not redrive and not reparse else None
+
+    ## taxa still failing after their retries are set aside instead of stopping the crawl
+    quarantine = Quarantine(save_dir)
+
+    concatenated = ConcatenatedWriter(save_dir, fmt=concatenated_format) if write_concatenated_json else None
+
+    ## with a pack, taxa go into it instead of each into its own json
+    taxon_pack = None
+    if pack:
+        ## jgi_pack needs zstandard, only for --pack
+        from jgi_pack import TaxonPack, pack_path
+        taxon_pack = TaxonPack(pack_path(save_dir))
+    json_dir = None if pack else save_dir
+
+    taxon_db = None
+    if sqlite_path:
+        from jgi_sqlite import TaxonDatabase
+        taxon_db = TaxonDatabase(sqlite_path)
+
+    ## each taxon is written out as soon as it is scraped instead of being kept in memory
+    on_result = fan_out(concatenated, taxon_pack, taxon_db)
+
+    if reparse and not archive_dir:
+        raise ValueError("--reparse needs the --archive_dir to reparse from")
+
+    ## a reparse reads the archive instead of adding to it
+    archive = ResponseArchive(archive_dir) if archive_dir and not reparse else None
+
+    ## a reparse answers every load, homepage and list pages included, from the archive
+    fetcher = ArchiveFetcher(archive_dir) if reparse else make_fetcher(backend, activate_driver, chrome_fallback=chrome_fallback, cache=cache, limiter=limiter, archive=archive)
+
+    if redrive:
+        print("Redriving %d quarantined metagenomes ..."%len(quarantine.taxon_urls()))
+
+    if engine == 'async' and not reparse:
+
+        ## jgi_async needs aiohttp, only for the 'async' engine
+        from jgi_async import crawl_async
+
+        ecosystemClass_urls = [] if redrive else [get_ecosystemclass_url_from_jgi_img_homepage(fetcher,homepage_url,ecosystemClass,database=database)
+            for ecosystemClass in ecosystemClasses]
+
+        crawl_async(ecosystemClass_urls, json_dir,
+            lambda ecosystemClass_json: get_metagenome_urls_from_ecosystemclass_json(None,homepage_url,ecosystemClass_json),
+            get_metagenome_metadata_while_on_metagenome_page,
+            lambda metagenome_url, metagenome_htmlSource: get_enzyme_urls_from_metagenome_url(metagenome_url, metagenome_htmlSource, datatypes),
+            parse_enzyme_info_from_enzyme_json, 'Taxon Object ID',
+            per_host=per_host, taxa_in_flight=taxa_in_flight, manifest=manifest, cache=cache, delta=delta, on_result=on_result, limiter=limiter,
+            retries=retries, retry_delay=retry_delay, on_error=quarantine.add, taxon_urls=quarantine.taxon_urls() if redrive else None,
+            archive=archive)
 
-    driver = activate_driver()
+    else:
 
-    jgi_metagenomes = list()
+        if redrive:
+            metagenome_urls = quarantine.taxon_urls()
+        else:
+            metagenome_urls = list()
 
-    for ecosystemClass in ecosystemClasses:
+            for ecosystemClass in ecosystemClasses:
 
-        print("Scraping all metagenomes from ecosystemClass: %s ..."%ecosystemClass)
+                print("Finding all metagenomes from ecosystemClass: %s ..."%ecosystemClass)
 
-        ecosystemClass_url = get_ecosystemclass_url_from_jgi_img_homepage(driver,homepage_url,ecosystemClass,database=database)
+                ecosystemClass_url = get_ecosystemclass_url_from_jgi_img_homepage(fetcher,homepage_url,ecosystemClass,database=database)
 
-        ecosystemClass_json = get_ecosystemclass_json_from_ecosystem_class_url(driver,ecosystemClass_url)
+                ecosystemClass_json = get_ecosystemclass_json_from_ecosystem_class_url(fetcher,ecosystemClass_url)
 
-        metagenome_urls = get_metagenome_urls_from_ecosystemclass_json(driver,homepage_url,ecosystemClass_json)
+                if delta is not None:
+                    ecosystemClass_json = delta.select(ecosystemClass_json)
 
-        for metagenome_url in metagenome_urls:
+                ecosystemClass_metagenome_urls = get_metagenome_urls_from_ecosystemclass_json(fetcher,homepage_url,ecosystemClass_json)
 
-            print("Scraping metagenome: %s ..."%metagenome_url)
+                print("Found %d metagenomes in ecosystemClass: %s."%(len(ecosystemClass_metagenome_urls),ecosystemClass))
+                print("="*90)
 
-            metagenome_htmlSource, metadata_table_dict = get_metagenome_htmlSource_and_metadata(driver, metagenome_url)
+                metagenome_urls.extend(ecosystemClass_metagenome_urls)
 
-            single_metagenome_dict = {'metadata':metadata_table_dict}
+        metagenome_urls = manifest.start(metagenome_urls)
 
-            taxon_object_id = metadata_table_dict['Taxon Object ID']
+        if reparse:
+            reparse_archive(archive_dir, metagenome_urls, lambda fetcher, metagenome_url: scrape_single_metagenome(fetcher, metagenome_url, json_dir, datatypes=datatypes),
+                manifest=manifest, on_result=on_result, on_error=quarantine.add)
+        else:
+            scrape_in_parallel(metagenome_urls,
+                with_retries(lambda fetcher, metagenome_url: scrape_single_metagenome(fetcher, metagenome_url, json_dir, datatypes=datatypes),
+                    retries=retries, retry_delay=retry_delay),
+                workers, lambda: make_fetcher(backend, activate_driver, chrome_fallback=chrome_fallback, cache=cache, limiter=limiter, archive=archive), first_fetcher=fetcher, on_result=on_result,
+                on_error=quarantine.add, manifest=manifest)
 
-            for datatype in datatypes:
+    print("Done scraping all metagenomes.")
+    print("-"*90)
 
-                enzyme_url = get_enzyme_url_from_metagenome_url(metagenome_url, metagenome_htmlSource, datatype)
+    manifest.close()
 
-                if enzyme_url:
+    quarantine.close(manifest.completed)
 
-                    enzyme_json = get_enzyme_json_from_enzyme_url(driver,enzyme_url)
+    if delta is not None:
+        delta.save(manifest.completed)
 
-                    enzyme_dict = parse_enzyme_info_from_enzyme_json(enzyme_json)
+    ## taxa scraped by earlier runs and not scraped again in this one
+    carried_ids = set()
+    if resume or redrive:
+        carried_ids |= manifest.previously_completed
+    if delta is not None:
+        carried_ids |= delta.unchanged
 
-                    single_metagenome_dict[datatype] = enzyme_dict
+    read_carried = lambda taxon_ids: taxon_pack.iter_taxa(taxon_ids) if taxon_pack is not None else iter_taxon_jsons(save_dir, taxon_ids)
 
-            jgi_metagenomes.append(single_metagenome_dict)
+    if concatenated is not None:
+        concatenated.write_all(read_carried(carried_ids))
+        concatenated.close()
 
-            with open(save_dir+'/'+taxon_object_id+'.json', 'w') as outfile:
+    if taxon_db is not None:
+        ## a taxon recorded as completed by an earlier run but lost from the database is inserted again
+        taxon_db.insert_missing(carried_ids, read_carried)
 
-                json.dump(single_metagenome_dict,outfile)
+    if taxon_pack is not None:
+        taxon_pack.close()
 
-            print("Done scraping metagenome.")
-            print("-"*80)
+    if taxon_db is not None:
+        taxon_db.close()
 
-        print("Done scraping metagenomes from ecosystemClass: %s."%ecosystemClass)
-        print("="*90)
+    fetcher.close()
 
-    print("Done scraping all metagenomes.")
-    print("-"*90)
+    if archive is not None:
+        archive.close()
+
+    if cache is not None:
+        cache.print_summary()
+        cache.close()
+
+    limiter.print_summary()
 
-    if write_concatenated_json:
+    print_wait_summary()
 
-        write_concatenated_json(save_dir,jgi_metagenomes)
+    print_driver_summary()
 
-## Can i write it so that it scrapes many at a time?
+    if reporter is not None:
+        reporter.close()
 
 if __name__ == '__main__':
     arguments = docopt(__doc__, version='scrape_metagenomes_from_jgi 1.0')
@@ -338,4 +524,34 @@ if __name__ == '__main__':
         database=arguments['--database'],
         ecosystemClasses=literal_eval(arguments['--ecosystem_classes']),
         datatypes=literal_eval(arguments['--datatypes']),
-        write_concatenated_json=literal_eval((arguments['--write_concatenated_json'])))
+        write_concatenated_json=literal_eval((arguments['--write_concatenated_json'])),
+        stage_timeouts=literal_eval(arguments['--stage_timeouts']),
+        backend=arguments['--backend'],
+        chrome_fallback=literal_eval(arguments['--chrome_fallback']),
+        workers=int(arguments['--workers']),
+        engine=arguments['--engine'],
+        per_host=int(arguments['--per_host']),
+        taxa_in_flight=int(arguments['--taxa_in_flight']),
+        resume=arguments['--resume'],
+        cache_dir=arguments['--cache_dir'],
+        cache_ttl=float(arguments['--cache_ttl']),
+        cache_max_mb=float(arguments['--cache_max_mb']),
+        rate=float(arguments['--rate']),
+        max_rate=float(arguments['--max_rate']),
+        retries=int(arguments['--retries']),
+        retry_delay=float(arguments['--retry_delay']),
+        redrive=arguments['--redrive'],
+        metrics_path=arguments['--metrics'],
+        metrics_interval=float(arguments['--metrics_interval']),
+        incremental=arguments['--incremental'],
+        concatenated_format=arguments['--concatenated_format'],
+        archive_dir=arguments['--archive_dir'],
+        reparse=arguments['--reparse'],
+        pack=arguments['--pack'],
+        sqlite_path=arguments['--sqlite'],
+        driver_profile=arguments['--driver_profile'],
+        chromedriver=arguments['--chromedriver'],
+        page_load_strategy=arguments['--page_load_strategy'],
+        chrome_args=literal_eval(arguments['--chrome_args']),
+        driver_max_pages=int(arguments['--driver_max_pages']),
+        driver_max_rss_mb=float(arguments['--driver_max_rss_mb']))